@@ -0,0 +1,10 @@
+from django.apps import AppConfig
+
+
+class ApiCarsConfig(AppConfig):
+    name = "api_cars"
+
+    def ready(self):
+        # Registers token cache invalidation and connection health check signals,
+        # and system checks
+        from . import auth, checks, db  # noqa: F401
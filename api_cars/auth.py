@@ -1,7 +1,169 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from functools import partial
+from typing import Tuple
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+from django.utils.functional import SimpleLazyObject
+from rest_framework import exceptions
 from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from .metrics import record_cache_lookup
+
+
+class LRUCache:
+    """
+    Small thread safe in-process LRU cache with per entry expiry
+    """
+
+    def __init__(self, max_entries: int, timeout: float) -> None:
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value) -> None:
+        if self.timeout <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.timeout)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+class TokenCache:
+    """
+    Token -> (user id, is_active) lookup, kept in process LRU and in shared cache.
+
+    Deleting a token, deactivating its user or changing their password removes entry
+    from shared cache and from LRU of current process right away. Other processes may
+    keep serving it from their LRU for up to LOCAL_TIMEOUT seconds, set it to 0 to
+    always ask shared cache.
+    """
+
+    def __init__(self) -> None:
+        config = settings.TOKEN_AUTH_CACHE
+        self.shared = caches[config["ALIAS"]]
+        self.timeout = config["TIMEOUT"]
+        self.local = LRUCache(config["LOCAL_MAX_ENTRIES"], config["LOCAL_TIMEOUT"])
+
+    @staticmethod
+    def cache_key(key: str) -> str:
+        # Raw tokens are credentials, they don't belong in cache keys
+        return f"auth-token:{hashlib.sha256(key.encode()).hexdigest()}"
+
+    def get(self, key: str):
+        cache_key = self.cache_key(key)
+        entry = self.local.get(cache_key)
+        if entry is None:
+            entry = self.shared.get(cache_key)
+            if entry is not None:
+                self.local.set(cache_key, entry)
+        return entry
+
+    def set(self, key: str, entry: Tuple[int, bool]) -> None:
+        cache_key = self.cache_key(key)
+        self.shared.set(cache_key, entry, self.timeout)
+        self.local.set(cache_key, entry)
+
+    def delete(self, key: str) -> None:
+        cache_key = self.cache_key(key)
+        self.shared.delete(cache_key)
+        self.local.delete(cache_key)
+
+
+_token_cache = None
+_token_cache_lock = threading.Lock()
+
+
+def get_token_cache() -> TokenCache:
+    global _token_cache
+    if _token_cache is None:
+        with _token_cache_lock:
+            if _token_cache is None:
+                _token_cache = TokenCache()
+    return _token_cache
 
 
-class BearerTokenAuthentication(TokenAuthentication):
+@receiver(setting_changed)
+def reset_token_cache(setting, **kwargs):
+    global _token_cache
+    if setting == "TOKEN_AUTH_CACHE":
+        _token_cache = None
+
+
+class LazyUser(SimpleLazyObject):
+    """
+    User of a cached token, loaded from database only when more than its id
+    and authentication state is needed
+    """
+
+    is_active = True
+    is_authenticated = True
+    is_anonymous = False
+
+    def __init__(self, user_id: int) -> None:
+        super().__init__(partial(get_user_model().objects.get, pk=user_id))
+        # Not proxied, reading them doesn't load the user
+        self.__dict__["pk"] = self.__dict__["id"] = user_id
+
+    def __bool__(self) -> bool:
+        # Permission checks test "request.user and ...", a user is always truthy
+        return True
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    Token authentication which looks tokens up in cache before database,
+    so steady state requests don't query for token and user at all.
+    Only user id and active flag are cached, never the user itself.
+    """
+
+    def authenticate_credentials(self, key):
+        token_cache = get_token_cache()
+        entry = token_cache.get(key)
+        record_cache_lookup("auth_token", hit=entry is not None)
+        if entry is None:
+            user, token = super().authenticate_credentials(key)
+            token_cache.set(key, (user.pk, user.is_active))
+            return (user, token)
+
+        user_id, is_active = entry
+        if not is_active:
+            raise exceptions.AuthenticationFailed("User inactive or deleted.")
+        return (LazyUser(user_id), self.get_model()(key=key, user_id=user_id))
+
+
+class BearerTokenAuthentication(CachedTokenAuthentication):
     """
     Simple token based authentication.
 
@@ -12,3 +174,35 @@ class BearerTokenAuthentication(TokenAuthentication):
     """
 
     keyword = "Bearer"
+
+
+@receiver(post_delete, sender=Token)
+def token_deleted(sender, instance, **kwargs):
+    get_token_cache().delete(instance.key)
+
+
+# Fields of user whose change drops cached tokens of the user
+TOKEN_USER_FIELDS = ("is_active", "password")
+
+
+def token_user_state(user) -> tuple:
+    return tuple(getattr(user, field) for field in TOKEN_USER_FIELDS)
+
+
+@receiver(post_init, sender=get_user_model())
+def user_loaded(sender, instance, **kwargs):
+    instance._token_user_state = token_user_state(instance)
+
+
+@receiver(post_save, sender=get_user_model())
+def user_saved(sender, instance, created, update_fields, **kwargs):
+    # Deactivation or password change, other saves (e.g. last_login) cost no query
+    if update_fields is not None and not set(update_fields) & set(TOKEN_USER_FIELDS):
+        return
+    state, instance._token_user_state = instance._token_user_state, token_user_state(
+        instance
+    )
+    if created or state == instance._token_user_state:
+        return
+    for key in Token.objects.filter(user=instance).values_list("key", flat=True):
+        get_token_cache().delete(key)
@@ -0,0 +1,28 @@
+from django.conf import settings
+from django.core.checks import Error, Tags, register
+
+LOCAL_CACHE_BACKENDS = (
+    "django.core.cache.backends.locmem.LocMemCache",
+    "django.core.cache.backends.dummy.DummyCache",
+)
+
+
+@register(Tags.caches)
+def check_shared_cache(app_configs, **kwargs):
+    """
+    Cache invalidation (listing generation, token lookups) and pins to primary
+    have to reach every worker, which per-process caches can't do
+    """
+    if not settings.CACHE_SHARED_REQUIRED:
+        return []
+    return [
+        Error(
+            f"Cache {alias!r} is local to a process, workers would serve stale "
+            f"listings, revoked tokens and ignore each other's replica pins.",
+            hint="Set CACHE_BACKEND and CACHE_LOCATION to a shared cache "
+            "(e.g. memcached) or CACHE_SHARED_REQUIRED=0 for a single process.",
+            id="api_cars.E001",
+        )
+        for alias in sorted({"default", settings.TOKEN_AUTH_CACHE["ALIAS"]})
+        if settings.CACHES[alias]["BACKEND"] in LOCAL_CACHE_BACKENDS
+    ]
@@ -0,0 +1,198 @@
+"""
+Health checks of persistent database connections (CONN_MAX_AGE > 0) and routing
+of listing reads to read replicas (DATABASE_REPLICAS).
+
+Django closes connections which are too old or broke during the previous request,
+but a connection dropped meanwhile by the server or a pooler (restart, idle timeout)
+is only noticed by the first query of the next request, which then fails.
+With CONN_HEALTH_CHECKS on, a reused connection is pinged when request starts
+and replaced when it doesn't answer.
+
+Replicas serve only views decorated with read_from_replica, everything else
+(writes included) uses default database. A user who just wrote through a view
+decorated with pin_to_primary reads from primary for REPLICA_PIN_SECONDS, so
+replication lag doesn't hide their own write.
+"""
+import logging
+import threading
+import time
+from contextvars import ContextVar
+from functools import wraps
+from typing import List
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.signals import request_started, setting_changed
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, OperationalError, connections
+from django.dispatch import receiver
+
+logger = logging.getLogger(__name__)
+
+# Database of reads in current request, None routes them to default
+_read_database = ContextVar("read_database", default=None)
+
+
+@receiver(request_started)
+def check_persistent_connections(**kwargs):
+    if not settings.CONN_HEALTH_CHECKS:
+        return
+    for connection in connections.all():
+        # New connections are opened lazily by first query, nothing to check
+        if connection.connection is None or connection.in_atomic_block:
+            continue
+        if not connection.settings_dict["CONN_MAX_AGE"]:
+            continue
+        if not connection.is_usable():
+            connection.close()
+
+
+class ReplicaPool:
+    """
+    Round robin over replicas, one which can't be connected to is skipped
+    for retry_seconds. Thread safe.
+    """
+
+    def __init__(self, aliases: List[str], retry_seconds: float) -> None:
+        self.aliases = aliases
+        self.retry_seconds = retry_seconds
+        self._lock = threading.Lock()
+        self._next = 0
+        self._down_until = {}
+
+    def mark_down(self, alias: str) -> None:
+        with self._lock:
+            self._down_until[alias] = time.monotonic() + self.retry_seconds
+
+    def is_healthy(self, alias: str) -> bool:
+        try:
+            # No-op for an open connection, already pinged by check_persistent_connections
+            connections[alias].ensure_connection()
+        except DatabaseError:
+            return False
+        return True
+
+    def choose(self) -> str:
+        """
+        Next available replica, default database when none is
+        """
+        for _ in range(len(self.aliases)):
+            with self._lock:
+                alias = self.aliases[self._next % len(self.aliases)]
+                self._next += 1
+                down = self._down_until.get(alias, 0) > time.monotonic()
+            if down:
+                continue
+            if self.is_healthy(alias):
+                return alias
+            logger.warning("Replica %s is unavailable", alias)
+            self.mark_down(alias)
+        return DEFAULT_DB_ALIAS
+
+
+_replica_pool = None
+_replica_pool_lock = threading.Lock()
+
+
+def get_replica_pool() -> ReplicaPool:
+    global _replica_pool
+    if _replica_pool is None:
+        with _replica_pool_lock:
+            if _replica_pool is None:
+                _replica_pool = ReplicaPool(
+                    settings.DATABASE_REPLICAS, settings.REPLICA_RETRY_SECONDS
+                )
+    return _replica_pool
+
+
+@receiver(setting_changed)
+def reset_replica_pool(setting, **kwargs):
+    global _replica_pool
+    if setting in ("DATABASE_REPLICAS", "REPLICA_RETRY_SECONDS"):
+        _replica_pool = None
+
+
+def pin_key(user) -> str:
+    return f"db-pin:{user.pk}"
+
+
+def is_pinned(user) -> bool:
+    return user.is_authenticated and cache.get(pin_key(user)) is not None
+
+
+def pin_user(user) -> None:
+    """
+    Route reads of the user to primary for REPLICA_PIN_SECONDS after their write
+    """
+    if settings.DATABASE_REPLICAS and user.is_authenticated:
+        cache.set(pin_key(user), 1, settings.REPLICA_PIN_SECONDS)
+
+
+def get_read_database() -> str:
+    return _read_database.get() or DEFAULT_DB_ALIAS
+
+
+def read_from_replica(handler):
+    """
+    Run reads of an APIView handler on a replica, unless user is pinned to primary.
+    Handler failing on connection error is repeated on primary.
+    """
+
+    @wraps(handler)
+    def wrapper(self, request, *args, **kwargs):
+        if not settings.DATABASE_REPLICAS or is_pinned(request.user):
+            return handler(self, request, *args, **kwargs)
+        alias = get_replica_pool().choose()
+        token = _read_database.set(alias)
+        try:
+            return handler(self, request, *args, **kwargs)
+        except OperationalError:
+            if alias == DEFAULT_DB_ALIAS:
+                raise
+            logger.warning("Replica %s failed, reading from primary", alias)
+            get_replica_pool().mark_down(alias)
+        finally:
+            _read_database.reset(token)
+        return handler(self, request, *args, **kwargs)
+
+    return wrapper
+
+
+def pin_to_primary(handler):
+    """
+    Route following reads of the user to primary for REPLICA_PIN_SECONDS
+    after a successful write of an APIView handler
+    """
+
+    @wraps(handler)
+    def wrapper(self, request, *args, **kwargs):
+        response = handler(self, request, *args, **kwargs)
+        if response.status_code < 400:
+            pin_user(request.user)
+        return response
+
+    return wrapper
+
+
+class ReplicaRouter:
+    """
+    Reads go to replica chosen by read_from_replica, if any. Writes always go
+    to default, also for instances loaded from a replica.
+    """
+
+    def db_for_read(self, model, **hints):
+        return _read_database.get()
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS}
+        if {obj1._state.db, obj2._state.db} <= databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, **hints):
+        # Replicas get schema by replication
+        if db in settings.DATABASE_REPLICAS:
+            return False
+        return None
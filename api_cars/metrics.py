@@ -0,0 +1,174 @@
+"""
+Process wide metrics registry, rendered in Prometheus text format by /metrics.
+
+Every worker process keeps its own numbers, scrape each worker (or run a single
+one per container) to get complete picture.
+"""
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional, Tuple
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Histogram:
+    def __init__(self, buckets: tuple) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[Labels, float]] = {}
+        self._histograms: Dict[str, Dict[Labels, Histogram]] = {}
+        self._buckets: Dict[str, tuple] = {}
+        self._help: Dict[str, str] = {}
+        self._collectors: List[Callable[[], Dict[str, Dict[Labels, float]]]] = []
+
+    def describe(self, name: str, help_text: str, buckets: Optional[tuple] = None):
+        self._help[name] = help_text
+        if buckets is not None:
+            self._buckets[name] = buckets
+
+    def inc(self, name: str, amount: float = 1, **labels) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + amount
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = Histogram(
+                    self._buckets.get(name, LATENCY_BUCKETS)
+                )
+            histogram.observe(value)
+
+    def add_collector(self, collector: Callable) -> None:
+        """
+        Register callable returning {counter name: {labels: value}} read at every scrape
+        """
+        self._collectors.append(collector)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    @staticmethod
+    def _format_labels(labels: Labels, extra: Labels = ()) -> str:
+        pairs = [f'{name}="{value}"' for name, value in labels + extra]
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def render(self) -> str:
+        counters = {}
+        with self._lock:
+            for name, series in self._counters.items():
+                counters[name] = dict(series)
+            histograms = {
+                name: {
+                    labels: (list(h.buckets), list(h.counts), h.sum)
+                    for labels, h in series.items()
+                }
+                for name, series in self._histograms.items()
+            }
+        for collector in self._collectors:
+            for name, series in collector().items():
+                counters.setdefault(name, {}).update(series)
+
+        lines = []
+        for name in sorted(counters):
+            if name in self._help:
+                lines.append(f"# HELP {name} {self._help[name]}")
+            lines.append(f"# TYPE {name} counter")
+            for labels, value in sorted(counters[name].items()):
+                lines.append(f"{name}{self._format_labels(labels)} {value:g}")
+        for name in sorted(histograms):
+            if name in self._help:
+                lines.append(f"# HELP {name} {self._help[name]}")
+            lines.append(f"# TYPE {name} histogram")
+            for labels, (buckets, counts, total) in sorted(histograms[name].items()):
+                cumulative = 0
+                for bound, count in zip(buckets + ["+Inf"], counts):
+                    cumulative += count
+                    le = (("le", f"{bound:g}" if bound != "+Inf" else bound),)
+                    lines.append(
+                        f"{name}_bucket{self._format_labels(labels, le)} {cumulative}"
+                    )
+                lines.append(f"{name}_sum{self._format_labels(labels)} {total:g}")
+                lines.append(f"{name}_count{self._format_labels(labels)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+registry.describe(
+    "http_request_duration_seconds", "Time spent handling request, per view"
+)
+registry.describe(
+    "db_queries_per_request", "SQL queries issued per request", COUNT_BUCKETS
+)
+registry.describe("db_query_duration_seconds", "Time spent in SQL queries per request")
+registry.describe(
+    "external_api_request_duration_seconds", "Duration of calls to vPIC external api"
+)
+registry.describe("cache_requests_total", "Cache lookups by cache and result")
+registry.describe(
+    "vpic_lookups_coalesced_total",
+    "Make lookups answered by concurrent request's external api call",
+)
+
+
+# Durations (seconds) spent per category during current request, for Server-Timing
+_request_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar(
+    "request_timings", default=None
+)
+
+
+def start_request_timings() -> Dict[str, float]:
+    timings: Dict[str, float] = {}
+    _request_timings.set(timings)
+    return timings
+
+
+def stop_request_timings() -> None:
+    _request_timings.set(None)
+
+
+def add_request_timing(name: str, seconds: float) -> None:
+    timings = _request_timings.get()
+    if timings is not None:
+        timings[name] = timings.get(name, 0) + seconds
+
+
+@contextmanager
+def timed_external_call(api: str):
+    """
+    Record duration of an outbound call in registry and in current request timings
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        registry.observe("external_api_request_duration_seconds", elapsed, api=api)
+        add_request_timing(api, elapsed)
+
+
+def record_cache_lookup(cache: str, hit: bool) -> None:
+    registry.inc("cache_requests_total", cache=cache, result="hit" if hit else "miss")
@@ -0,0 +1,145 @@
+import itertools
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.middleware.gzip import GZipMiddleware
+from django.urls import reverse
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.settings import api_settings
+
+from .metrics import registry, start_request_timings, stop_request_timings
+from .profiling import finish_profile, start_profile
+
+
+class QueryTimer:
+    """
+    Database execute wrapper counting queries and their total duration
+    """
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - started
+            self.count += 1
+
+
+class PerformanceMetricsMiddleware:
+    """
+    Records per view latency, SQL query count and time, and outbound api time
+    in metrics registry and in Server-Timing response header.
+    Removed from the stack entirely when PERFORMANCE_METRICS_ENABLED is off.
+    """
+
+    def __init__(self, get_response):
+        if not settings.PERFORMANCE_METRICS_ENABLED:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timings = start_request_timings()
+        queries = QueryTimer()
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(queries))
+                response = self.get_response(request)
+        finally:
+            stop_request_timings()
+        elapsed = time.perf_counter() - started
+
+        match = request.resolver_match
+        view = match.view_name if match else "unmatched"
+        registry.observe(
+            "http_request_duration_seconds",
+            elapsed,
+            view=view,
+            method=request.method,
+            status=str(response.status_code),
+        )
+        registry.observe("db_queries_per_request", queries.count, view=view)
+        registry.observe("db_query_duration_seconds", queries.duration, view=view)
+
+        server_timing = [
+            f'db;dur={queries.duration * 1000:.2f};desc="{queries.count} queries"'
+        ]
+        server_timing += [
+            f"{name};dur={seconds * 1000:.2f}" for name, seconds in timings.items()
+        ]
+        server_timing.append(f"total;dur={elapsed * 1000:.2f}")
+        response["Server-Timing"] = ", ".join(server_timing)
+        return response
+
+
+class ThresholdGZipMiddleware(GZipMiddleware):
+    """
+    GZipMiddleware compressing only responses of at least GZIP_MIN_LENGTH bytes,
+    smaller ones don't pay back CPU time spent on compression
+    """
+
+    def process_response(self, request, response):
+        if not response.streaming and len(response.content) < settings.GZIP_MIN_LENGTH:
+            return response
+        return super().process_response(request, response)
+
+
+class ProfilingMiddleware:
+    """
+    Profiles requests of staff users sending "X-Profile: 1" header or "?profile=1",
+    and every PROFILING_SAMPLE_RATE-th request of anyone when set. Profile id and
+    summary are returned to staff in X-Profile and X-Profile-Summary headers.
+    Removed from the stack entirely when PROFILING_ENABLED is off.
+    """
+
+    def __init__(self, get_response):
+        if not settings.PROFILING_ENABLED:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        self._counter = itertools.count(1)
+
+    @staticmethod
+    def is_staff(request) -> bool:
+        for authentication_class in api_settings.DEFAULT_AUTHENTICATION_CLASSES:
+            try:
+                user_auth = authentication_class().authenticate(request)
+            except AuthenticationFailed:
+                return False
+            if user_auth is not None:
+                return user_auth[0].is_staff
+        return False
+
+    def __call__(self, request):
+        requested = (
+            request.META.get("HTTP_X_PROFILE") == "1"
+            or request.GET.get("profile") == "1"
+        ) and self.is_staff(request)
+        rate = settings.PROFILING_SAMPLE_RATE
+        sampled = rate > 0 and next(self._counter) % rate == 0
+        if not requested and not sampled:
+            return self.get_response(request)
+
+        profile = start_profile()
+        if profile is None:
+            response = self.get_response(request)
+            if requested:
+                response["X-Profile"] = "busy"
+            return response
+        try:
+            with profile:
+                response = self.get_response(request)
+            summary = profile.save(request)
+        finally:
+            finish_profile()
+        if requested:
+            response["X-Profile"] = reverse("profile", args=[profile.id])
+            response["X-Profile-Summary"] = summary
+        return response
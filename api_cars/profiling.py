@@ -0,0 +1,153 @@
+"""
+On demand profiling of requests (ProfilingMiddleware), see README.
+
+A profiled request runs under cProfile with a log of every SQL query it issued
+and where in the project code it came from. Both are stored in PROFILING_DIR as
+"<id>.prof" (pstats) and "<id>.sql.json", only PROFILING_MAX_FILES newest
+profiles are kept.
+"""
+import cProfile
+import json
+import pstats
+import sys
+import threading
+import time
+import uuid
+from contextlib import ExitStack
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connections
+
+PROFILE_SUFFIX = ".prof"
+QUERIES_SUFFIX = ".sql.json"
+
+# cProfile of one thread at a time, concurrent requests aren't profiled
+_profiler_lock = threading.Lock()
+
+
+class QueryLog:
+    """
+    Database execute wrapper recording SQL, duration and calling project code
+    """
+
+    def __init__(self) -> None:
+        self.queries = []
+
+    @staticmethod
+    def origin() -> str:
+        """
+        Innermost project frame (outside api_cars) of the query, walked without
+        reading source lines, which would show up in the profile
+        """
+        base_dir = str(settings.BASE_DIR)
+        frame = sys._getframe(2)
+        while frame is not None:
+            filename = frame.f_code.co_filename
+            if filename.startswith(base_dir) and "/api_cars/" not in filename:
+                path = Path(filename).relative_to(base_dir)
+                return f"{path}:{frame.f_lineno}({frame.f_code.co_name})"
+            frame = frame.f_back
+        return ""
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append(
+                {
+                    "sql": sql,
+                    "ms": round((time.perf_counter() - started) * 1000, 3),
+                    "many": many,
+                    "origin": self.origin(),
+                }
+            )
+
+
+class RequestProfile:
+    """
+    Profiles code run in its context, save() stores results and returns summary
+    """
+
+    def __init__(self) -> None:
+        self.id = f"{time.strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        self.profiler = cProfile.Profile()
+        self.queries = QueryLog()
+        self.duration = 0.0
+        self._stack = ExitStack()
+
+    def __enter__(self):
+        for connection in connections.all():
+            self._stack.enter_context(connection.execute_wrapper(self.queries))
+        self._started = time.perf_counter()
+        self.profiler.enable()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profiler.disable()
+        self.duration = time.perf_counter() - self._started
+        self._stack.close()
+
+    def summary(self) -> str:
+        stats = pstats.Stats(self.profiler).stats
+        sql_ms = sum(query["ms"] for query in self.queries.queries)
+        summary = (
+            f"{self.duration * 1000:.1f} ms, {len(self.queries.queries)} queries"
+            f" ({sql_ms:.1f} ms)"
+        )
+        if stats:
+            # Function with the most own (total) time
+            (filename, line, function), _ = max(
+                stats.items(), key=lambda item: item[1][2]
+            )
+            summary += f", top: {Path(filename).name}:{line}({function})"
+        return summary
+
+    def save(self, request) -> str:
+        directory = Path(settings.PROFILING_DIR)
+        directory.mkdir(parents=True, exist_ok=True)
+        self.profiler.dump_stats(directory / f"{self.id}{PROFILE_SUFFIX}")
+        with open(directory / f"{self.id}{QUERIES_SUFFIX}", "w") as file:
+            json.dump(
+                {
+                    "method": request.method,
+                    "path": request.get_full_path(),
+                    "ms": round(self.duration * 1000, 3),
+                    "queries": self.queries.queries,
+                },
+                file,
+                indent=1,
+            )
+        prune_profiles(directory, settings.PROFILING_MAX_FILES)
+        return self.summary()
+
+
+def start_profile():
+    """
+    New RequestProfile, None while another request is being profiled
+    """
+    if not _profiler_lock.acquire(blocking=False):
+        return None
+    return RequestProfile()
+
+
+def finish_profile() -> None:
+    _profiler_lock.release()
+
+
+def prune_profiles(directory: Path, keep: int) -> None:
+    profiles = []
+    for path in directory.glob(f"*{PROFILE_SUFFIX}"):
+        try:
+            profiles.append((path.stat().st_mtime, path))
+        except FileNotFoundError:
+            pass
+    profiles.sort(reverse=True)
+    for _, path in profiles[keep:]:
+        profile_id = path.name[: -len(PROFILE_SUFFIX)]
+        for stale in (path, directory / f"{profile_id}{QUERIES_SUFFIX}"):
+            try:
+                stale.unlink()
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,66 @@
+"""
+JSON renderers of the API. orjson is used when installed, otherwise they fall back
+to DRF's stdlib based rendering with identical output.
+"""
+from operator import itemgetter
+
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer serializing with orjson. Types orjson doesn't know (Decimal, lazy
+    strings) and datetimes go through DRF's encoder, so values look the same.
+    Indented output (e.g. "Accept: application/json; indent=4") is left to DRF.
+    """
+
+    encoder = JSONEncoder()
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or data is None:
+            return super().render(data, accepted_media_type, renderer_context)
+        if self.get_indent(accepted_media_type, renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+        content = orjson.dumps(
+            data,
+            default=self.encoder.default,
+            # int keys (e.g. rating histogram) become strings, as with stdlib json
+            option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS,
+        )
+        # Same as DRF, line separators are valid JSON but break JavaScript
+        return content.replace(b"\xe2\x80\xa8", b"\\u2028").replace(
+            b"\xe2\x80\xa9", b"\\u2029"
+        )
+
+
+class ColumnarJSONRenderer(FastJSONRenderer):
+    """
+    Lists of objects as column names and rows of values, e.g.
+    {"columns": ["id", "make_name"], "rows": [[1, "Tesla"], [2, "Audi"]]},
+    which spares repeating keys in every item. Other data is rendered as is.
+    """
+
+    media_type = "application/vnd.cars.columnar+json"
+    format = "columnar"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, list) and all(isinstance(item, dict) for item in data):
+            columns = list(data[0]) if data else []
+            try:
+                if len(columns) > 1:
+                    # Tuples are serialized as arrays, itemgetter builds them in C
+                    rows = list(map(itemgetter(*columns), data))
+                else:
+                    rows = [[item[column] for column in columns] for item in data]
+            except KeyError:
+                # Objects of different shapes, no common columns
+                rows = None
+            if rows is not None:
+                data = {"columns": columns, "rows": rows}
+        return super().render(data, accepted_media_type, renderer_context)
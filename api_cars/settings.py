@@ -10,8 +10,8 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/3.1/ref/settings/
 """
 
-from pathlib import Path
 import os
+from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -42,9 +42,13 @@ INSTALLED_APPS = [
     "rate.apps.RateConfig",
     "rest_framework",
     "rest_framework.authtoken",
+    "api_cars.apps.ApiCarsConfig",
 ]
 
 MIDDLEWARE = [
+    "api_cars.middleware.PerformanceMetricsMiddleware",
+    "api_cars.middleware.ThresholdGZipMiddleware",
+    "api_cars.middleware.ProfilingMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -54,6 +58,25 @@ MIDDLEWARE = [
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
 
+# Responses of at least this many bytes are gzipped for clients accepting it
+GZIP_MIN_LENGTH = int(os.environ.get("GZIP_MIN_LENGTH", default=1024))
+
+# Request timing, SQL and external api metrics (GET /metrics and Server-Timing header)
+PERFORMANCE_METRICS_ENABLED = int(
+    os.environ.get("PERFORMANCE_METRICS_ENABLED", default=1)
+)
+# Bearer token required by GET /metrics, which is closed when empty unless DEBUG is on
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")
+
+# Profiling of requests (api_cars.profiling) asked for by staff with "X-Profile: 1"
+# header, and of every PROFILING_SAMPLE_RATE-th request when above 0.
+# With PROFILING_ENABLED off the middleware isn't part of the stack at all
+PROFILING_ENABLED = int(os.environ.get("PROFILING_ENABLED", default=0))
+PROFILING_SAMPLE_RATE = int(os.environ.get("PROFILING_SAMPLE_RATE", default=0))
+PROFILING_DIR = os.environ.get("PROFILING_DIR", default=str(BASE_DIR / "profiles"))
+# Number of newest profiles kept in PROFILING_DIR
+PROFILING_MAX_FILES = int(os.environ.get("PROFILING_MAX_FILES", default=100))
+
 ROOT_URLCONF = "api_cars.urls"
 
 TEMPLATES = [
@@ -78,6 +101,8 @@ WSGI_APPLICATION = "api_cars.wsgi.application"
 # Database
 # https://docs.djangoproject.com/en/3.1/ref/settings/#databases
 
+SQL_CONN_MAX_AGE = os.environ.get("SQL_CONN_MAX_AGE", "60")
+
 DATABASES = {
     "default": {
         "ENGINE": os.environ.get("SQL_ENGINE"),
@@ -86,9 +111,186 @@ DATABASES = {
         "PASSWORD": os.environ.get("SQL_PASSWORD"),
         "HOST": os.environ.get("SQL_HOST"),
         "PORT": os.environ.get("SQL_PORT", ""),
+        # Seconds a connection is kept open and reused by following requests of the same
+        # worker thread, 0 closes it after every request, empty keeps it forever
+        "CONN_MAX_AGE": int(SQL_CONN_MAX_AGE) if SQL_CONN_MAX_AGE else None,
+        # Required behind pooler in transaction mode (e.g. pgbouncer), where named
+        # cursors of GET /cars/export don't survive between transactions
+        "DISABLE_SERVER_SIDE_CURSORS": bool(
+            int(os.environ.get("SQL_DISABLE_SERVER_SIDE_CURSORS", default=0))
+        ),
     }
 }
 
+# Ping reused persistent connections at request start and reconnect when they are gone
+CONN_HEALTH_CHECKS = bool(int(os.environ.get("SQL_CONN_HEALTH_CHECKS", default=1)))
+
+# Read replicas of default database as comma separated host[:port], they share its
+# name and credentials. Listing endpoints read from them in turns (api_cars.db)
+DATABASE_REPLICAS = []
+for index, replica in enumerate(
+    filter(None, os.environ.get("SQL_REPLICA_HOSTS", "").split(","))
+):
+    replica_host, _, replica_port = replica.strip().partition(":")
+    DATABASES[f"replica{index + 1}"] = {
+        **DATABASES["default"],
+        "HOST": replica_host,
+        "PORT": replica_port or DATABASES["default"]["PORT"],
+        "TEST": {"MIRROR": "default"},
+    }
+    DATABASE_REPLICAS.append(f"replica{index + 1}")
+
+DATABASE_ROUTERS = ["api_cars.db.ReplicaRouter"]
+
+# Seconds a user who wrote reads from primary, should exceed usual replication lag
+REPLICA_PIN_SECONDS = int(os.environ.get("SQL_REPLICA_PIN_SECONDS", default=5))
+
+# Seconds an unavailable replica is skipped before it's tried again
+REPLICA_RETRY_SECONDS = int(os.environ.get("SQL_REPLICA_RETRY_SECONDS", default=30))
+
+
+# Cache
+# https://docs.djangoproject.com/en/3.1/topics/cache/
+# Local memory by default, set CACHE_BACKEND/CACHE_LOCATION to share cache between workers
+# (e.g. django.core.cache.backends.memcached.MemcachedCache and memcached:11211)
+
+CACHE_BACKEND = os.environ.get(
+    "CACHE_BACKEND", "django.core.cache.backends.locmem.LocMemCache"
+)
+CACHE_LOCATION = os.environ.get("CACHE_LOCATION", "")
+
+# Listing generation, token lookups and replica pins only hold across workers with a shared
+# default cache, when required a local memory one fails system checks (api_cars.E001).
+# Required with replicas, a pin set by one worker has to keep the others off replicas
+CACHE_SHARED_REQUIRED = bool(
+    int(os.environ.get("CACHE_SHARED_REQUIRED", default=int(bool(DATABASE_REPLICAS))))
+)
+
+CACHE_OPTIONS = {}
+VPIC_CACHE_OPTIONS = {
+    "MAX_ENTRIES": int(os.environ.get("VPIC_CACHE_MAX_ENTRIES", default=1000)),
+}
+if CACHE_BACKEND.endswith(".MemcachedCache"):
+    # Options go to python-memcached client, which knows no MAX_ENTRIES and refuses
+    # values over 1 MB (memcached of docker-compose.prod.yml stores up to 4 MB)
+    CACHE_OPTIONS = VPIC_CACHE_OPTIONS = {"server_max_value_length": 4 * 1024 * 1024}
+
+CACHES = {
+    "default": {
+        "BACKEND": CACHE_BACKEND,
+        "LOCATION": CACHE_LOCATION,
+        "OPTIONS": CACHE_OPTIONS,
+    },
+    # make -> models catalogue fetched from vPIC external api
+    "vpic": {
+        "BACKEND": CACHE_BACKEND,
+        # Separate location keeps local memory caches from sharing one store
+        "LOCATION": CACHE_LOCATION or "vpic",
+        "KEY_PREFIX": "vpic",
+        "TIMEOUT": int(os.environ.get("VPIC_CACHE_TTL", default=60 * 60 * 24)),
+        "OPTIONS": VPIC_CACHE_OPTIONS,
+    },
+}
+
+
+# External vPIC api client
+# Timeouts are in seconds, breaker opens after FAILURE_THRESHOLD failed calls in a row
+# and rejects calls with 503 for RESET_TIMEOUT seconds
+
+VPIC_API_URL = os.environ.get(
+    "VPIC_API_URL", default="https://vpic.nhtsa.dot.gov/api/vehicles"
+)
+
+# How POST /cars validates cars:
+#  "local_first" - look up catalogue imported by import_vpic_catalogue, call external api on a miss
+#  "local" - imported catalogue only, for air-gapped deployments
+#  "remote" - external api only
+VPIC_VALIDATION_BACKEND = os.environ.get(
+    "VPIC_VALIDATION_BACKEND", default="local_first"
+)
+
+VPIC_CLIENT = {
+    "CONNECT_TIMEOUT": float(os.environ.get("VPIC_CONNECT_TIMEOUT", default=3.05)),
+    "READ_TIMEOUT": float(os.environ.get("VPIC_READ_TIMEOUT", default=10)),
+    "RETRIES": int(os.environ.get("VPIC_RETRIES", default=2)),
+    "BACKOFF_FACTOR": float(os.environ.get("VPIC_BACKOFF_FACTOR", default=0.3)),
+    "POOL_MAXSIZE": int(os.environ.get("VPIC_POOL_MAXSIZE", default=10)),
+    # Used by async client, one per event loop shared by all in-flight requests
+    "ASYNC_POOL_MAXSIZE": int(os.environ.get("VPIC_ASYNC_POOL_MAXSIZE", default=100)),
+    "FAILURE_THRESHOLD": int(os.environ.get("VPIC_FAILURE_THRESHOLD", default=5)),
+    "RESET_TIMEOUT": float(os.environ.get("VPIC_RESET_TIMEOUT", default=30)),
+}
+
+# Concurrent lookups of one make share a single external api call, in a process and
+# (with shared cache) across workers. Seconds the others wait before calling it themselves
+VPIC_SINGLE_FLIGHT_TIMEOUT = float(
+    os.environ.get("VPIC_SINGLE_FLIGHT_TIMEOUT", default=15)
+)
+
+
+# Pagination of GET /cars and GET /popular, default limit of None returns whole list
+
+CARS_PAGE_DEFAULT_LIMIT = (
+    int(os.environ["CARS_PAGE_DEFAULT_LIMIT"])
+    if os.environ.get("CARS_PAGE_DEFAULT_LIMIT")
+    else None
+)
+CARS_PAGE_MAX_LIMIT = int(os.environ.get("CARS_PAGE_MAX_LIMIT", default=1000))
+
+# Seconds rendered GET /cars and GET /popular responses are cached for,
+# any write to cars or rates makes them stale earlier
+CARS_LISTING_CACHE_TIMEOUT = int(
+    os.environ.get("CARS_LISTING_CACHE_TIMEOUT", default=300)
+)
+
+# Results returned by GET /cars/search without ?limit, and whether it also matches
+# misspelled names (PostgreSQL with pg_trgm extension only)
+CARS_SEARCH_DEFAULT_LIMIT = int(os.environ.get("CARS_SEARCH_DEFAULT_LIMIT", default=20))
+CARS_SEARCH_FUZZY = bool(int(os.environ.get("CARS_SEARCH_FUZZY", default=1)))
+
+# GET /cars?order=score ranks cars by (w * m + sum of ratings) / (w + number of ratings),
+# m is the mean of all ratings and w this weight: number of ratings a car needs
+# before its own average counts as much as the mean
+RANKING_PRIOR_WEIGHT = float(os.environ.get("RANKING_PRIOR_WEIGHT", default=10))
+
+# Rows fetched from database cursor (and written to response) at once by GET /cars/export
+CARS_EXPORT_CHUNK_SIZE = 2000
+
+
+# Bulk car and rating ingestion limits
+
+CARS_BULK_MAX_ITEMS = int(os.environ.get("CARS_BULK_MAX_ITEMS", default=5000))
+CARS_BULK_BATCH_SIZE = 500
+
+# Number of ratings validated and inserted together by batch POST /rate
+RATE_BATCH_CHUNK_SIZE = int(os.environ.get("RATE_BATCH_CHUNK_SIZE", default=1000))
+
+# Write-behind POST /rate: ratings are appended to spool files and stored in batches
+# by flush_rating_buffer command. RATE_SPOOL_DIR has to be shared by web and flusher,
+# without fsync accepted ratings survive process crash but not machine crash
+RATE_WRITE_BEHIND = bool(int(os.environ.get("RATE_WRITE_BEHIND", default=0)))
+RATE_SPOOL_DIR = os.environ.get("RATE_SPOOL_DIR", default=str(BASE_DIR / "rate_spool"))
+RATE_SPOOL_FSYNC = bool(int(os.environ.get("RATE_SPOOL_FSYNC", default=1)))
+# Seconds a worker appends to one segment before handing it over to the flusher
+RATE_SPOOL_ROTATE_SECONDS = float(
+    os.environ.get("RATE_SPOOL_ROTATE_SECONDS", default=1)
+)
+
+# Longest ?window= (in days) of GET /popular and GET /cars/<id>/stats
+RATE_STATS_MAX_WINDOW_DAYS = int(
+    os.environ.get("RATE_STATS_MAX_WINDOW_DAYS", default=365)
+)
+
+
+# Background car creation (POST /cars with "Prefer: respond-async"), see process_car_jobs
+
+CARS_JOB_BATCH_SIZE = int(os.environ.get("CARS_JOB_BATCH_SIZE", default=100))
+CARS_JOB_MAX_ATTEMPTS = int(os.environ.get("CARS_JOB_MAX_ATTEMPTS", default=5))
+# Seconds before failed external api lookup is retried, doubled with every attempt
+CARS_JOB_RETRY_DELAY = float(os.environ.get("CARS_JOB_RETRY_DELAY", default=30))
+# Seconds after which job claimed by a (presumably dead) worker is picked up again
+CARS_JOB_LOCK_TIMEOUT = int(os.environ.get("CARS_JOB_LOCK_TIMEOUT", default=300))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.1/ref/settings/#auth-password-validators
@@ -130,7 +332,22 @@ STATIC_URL = "/static/"
 
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": [
-        "rest_framework.authentication.TokenAuthentication",
-        "api_cars.auth.BearerTokenAuthentication"
+        "api_cars.auth.CachedTokenAuthentication",
+        "api_cars.auth.BearerTokenAuthentication",
+    ],
+    "DEFAULT_RENDERER_CLASSES": [
+        "api_cars.renderers.FastJSONRenderer",
+        "api_cars.renderers.ColumnarJSONRenderer",
+        "rest_framework.renderers.BrowsableAPIRenderer",
     ],
-}
\ No newline at end of file
+}
+
+# Token -> user lookups cached by api_cars.auth, in process for LOCAL_TIMEOUT seconds
+# and in shared cache ALIAS for TIMEOUT seconds (both dropped when token is deleted, user
+# deactivated or their password changed)
+TOKEN_AUTH_CACHE = {
+    "ALIAS": "default",
+    "TIMEOUT": int(os.environ.get("TOKEN_AUTH_CACHE_TIMEOUT", default=300)),
+    "LOCAL_TIMEOUT": float(os.environ.get("TOKEN_AUTH_LOCAL_TIMEOUT", default=5)),
+    "LOCAL_MAX_ENTRIES": 10000,
+}
@@ -0,0 +1,71 @@
+"""
+Production settings serving the token authenticated API only.
+
+Admin, sessions, messages and static files are not installed and their
+middleware (sessions, CSRF, messages, authentication by session) is not run,
+responses are rendered as JSON only. Use DJANGO_SETTINGS_MODULE=api_cars.settings
+for a deployment with admin and browsable API.
+"""
+import os
+
+from .settings import *  # noqa: F401,F403
+from .settings import (
+    CACHE_SHARED_REQUIRED,
+    DEBUG,
+    INSTALLED_APPS,
+    MIDDLEWARE,
+    REST_FRAMEWORK,
+    TEMPLATES,
+)
+
+UNUSED_APPS = {
+    "django.contrib.admin",
+    "django.contrib.sessions",
+    "django.contrib.messages",
+    "django.contrib.staticfiles",
+}
+INSTALLED_APPS = [app for app in INSTALLED_APPS if app not in UNUSED_APPS]
+
+UNUSED_MIDDLEWARE = {
+    "django.contrib.sessions.middleware.SessionMiddleware",
+    "django.middleware.csrf.CsrfViewMiddleware",
+    "django.contrib.auth.middleware.AuthenticationMiddleware",
+    "django.contrib.messages.middleware.MessageMiddleware",
+    # Frame options only matter for HTML pages
+    "django.middleware.clickjacking.XFrameOptionsMiddleware",
+}
+MIDDLEWARE = [item for item in MIDDLEWARE if item not in UNUSED_MIDDLEWARE]
+
+ROOT_URLCONF = "api_cars.urls_api"
+
+# Production runs several workers, refuse to start them with per-process caches
+CACHE_SHARED_REQUIRED = bool(
+    int(
+        os.environ.get(
+            "CACHE_SHARED_REQUIRED", default=int(CACHE_SHARED_REQUIRED or not DEBUG)
+        )
+    )
+)
+
+# Nothing stores sessions, but test client's logout() still instantiates a store,
+# cookie backend doesn't need sessions app and its table
+SESSION_ENGINE = "django.contrib.sessions.backends.signed_cookies"
+
+TEMPLATES = [
+    {
+        **TEMPLATES[0],
+        "OPTIONS": {
+            "context_processors": [
+                "django.template.context_processors.request",
+            ],
+        },
+    }
+]
+
+REST_FRAMEWORK = {
+    **REST_FRAMEWORK,
+    "DEFAULT_RENDERER_CLASSES": [
+        "api_cars.renderers.FastJSONRenderer",
+        "api_cars.renderers.ColumnarJSONRenderer",
+    ],
+}
@@ -0,0 +1,578 @@
+import gzip
+import json
+import os
+import pstats
+import tempfile
+import unittest
+from datetime import datetime, timezone
+from decimal import Decimal
+from unittest import mock
+
+from django.contrib.auth.models import User, update_last_login
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from django.test import SimpleTestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APITestCase
+
+from cars.cache import invalidate_listings, listing_cache_timeout
+from cars.models import Car
+
+from . import settings_api
+from .auth import BearerTokenAuthentication, get_token_cache
+from .checks import check_shared_cache
+from .db import ReplicaPool, ReplicaRouter, check_persistent_connections
+from .metrics import registry
+from .renderers import ColumnarJSONRenderer, FastJSONRenderer, orjson
+
+
+class CachedTokenAuthenticationTests(APITestCase):
+    def setUp(self) -> None:
+        """
+        Auxiliary test objects and functions
+        """
+        self.url = reverse("cars-popular")
+        self.user = User.objects.create_user(username="foo")
+        self.token = Token.objects.create(user=self.user)
+
+    def get(self, keyword="Bearer"):
+        return self.client.get(
+            self.url, format="json", HTTP_AUTHORIZATION=f"{keyword} {self.token.key}"
+        )
+
+    def test_cached_token_no_queries(self):
+        """
+        Positive test case
+        Once token was seen, authentication doesn't touch database
+        """
+        for keyword in ("Bearer", "Token"):
+            self.assertEqual(self.get(keyword).status_code, status.HTTP_200_OK)
+            with self.assertNumQueries(0):  # listing itself is cached as well
+                self.assertEqual(self.get(keyword).status_code, status.HTTP_200_OK)
+
+    def test_deleted_token_rejected(self):
+        """
+        Negative test case
+        Deleted token stops working immediately, even if cached before
+        """
+        self.assertEqual(self.get().status_code, status.HTTP_200_OK)
+        self.token.delete()
+        self.assertEqual(self.get().status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_deactivated_user_rejected(self):
+        """
+        Negative test case
+        Token of deactivated user stops working immediately, even if cached before
+        """
+        self.assertEqual(self.get().status_code, status.HTTP_200_OK)
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.get().status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_only_user_id_cached(self):
+        """
+        Positive test case
+        Cache holds user id and active flag only, user is loaded when needed
+        """
+        self.assertEqual(self.get().status_code, status.HTTP_200_OK)
+        self.assertEqual(get_token_cache().get(self.token.key), (self.user.pk, True))
+
+        user, token = BearerTokenAuthentication().authenticate_credentials(
+            self.token.key
+        )
+        with self.assertNumQueries(0):
+            self.assertEqual((user.pk, token.user_id), (self.user.pk, self.user.pk))
+        with self.assertNumQueries(1):
+            self.assertEqual(user.username, "foo")
+
+    def test_user_save_keeps_cached_token(self):
+        """
+        Positive test case
+        Saves not touching is_active or password (e.g. last_login) don't look for tokens,
+        password change drops them from cache
+        """
+        self.assertEqual(self.get().status_code, status.HTTP_200_OK)
+        with self.assertNumQueries(1):
+            update_last_login(None, self.user)
+        self.user.first_name = "Foo"
+        with self.assertNumQueries(1):
+            self.user.save()
+        self.assertIsNotNone(get_token_cache().get(self.token.key))
+
+        self.user.set_password("secret")
+        self.user.save()
+        self.assertIsNone(get_token_cache().get(self.token.key))
+
+    def test_invalid_token_rejected(self):
+        """
+        Negative test case
+        Unknown token should result in 401_UNAUTHORIZED error
+        """
+        response = self.client.get(
+            self.url, format="json", HTTP_AUTHORIZATION="Bearer abc"
+        )
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class PerformanceMetricsTests(APITestCase):
+    def setUp(self) -> None:
+        """
+        Auxiliary test objects and functions
+        """
+        registry.clear()
+        cache.clear()
+        test_user = User.objects.create_user(username="foo")  # Used for bearer auth
+        self.client.force_authenticate(user=test_user)
+
+    def test_server_timing_header(self):
+        """
+        Positive test case
+        Responses carry Server-Timing with database and total time
+        """
+        response = self.client.get(reverse("cars-list"), format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertRegex(
+            response["Server-Timing"], r'^db;dur=[\d.]+;desc="\d+ queries"'
+        )
+        self.assertIn("total;dur=", response["Server-Timing"])
+
+    @override_settings(DEBUG=True)
+    def test_metrics_endpoint(self):
+        """
+        Positive test case
+        Recorded requests are exposed in Prometheus text format
+        """
+        self.client.get(reverse("cars-list"), format="json")
+        self.client.get(reverse("cars-list"), format="json")
+
+        response = self.client.get(reverse("metrics"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        body = response.content.decode()
+        self.assertIn(
+            'http_request_duration_seconds_count{method="GET",status="200",view="cars-list"} 2',
+            body,
+        )
+        self.assertIn('cache_requests_total{cache="listing",result="hit"} 1', body)
+        self.assertIn('cache_requests_total{cache="listing",result="miss"} 1', body)
+        self.assertIn('db_queries_per_request_count{view="cars-list"} 2', body)
+
+    @override_settings(METRICS_TOKEN="secret")
+    def test_metrics_endpoint_token(self):
+        """
+        Negative test case
+        With METRICS_TOKEN set, scraper without it gets 401_UNAUTHORIZED
+        """
+        response = self.client.get(reverse("metrics"))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        response = self.client.get(
+            reverse("metrics"), HTTP_AUTHORIZATION="Bearer secret"
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    @override_settings(METRICS_TOKEN="", DEBUG=False)
+    def test_metrics_endpoint_no_token(self):
+        """
+        Negative test case
+        Without METRICS_TOKEN and DEBUG off metrics are closed with 403_FORBIDDEN
+        """
+        response = self.client.get(reverse("metrics"))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    @override_settings(PERFORMANCE_METRICS_ENABLED=0)
+    def test_metrics_disabled(self):
+        """
+        Positive test case
+        Disabled middleware doesn't touch responses
+        """
+        response = self.client.get(reverse("cars-list"), format="json")
+        self.assertNotIn("Server-Timing", response)
+
+
+@override_settings(
+    MIDDLEWARE=settings_api.MIDDLEWARE,
+    ROOT_URLCONF=settings_api.ROOT_URLCONF,
+    REST_FRAMEWORK=settings_api.REST_FRAMEWORK,
+)
+class ApiSettingsTests(APITestCase):
+    def setUp(self) -> None:
+        """
+        Auxiliary test objects and functions
+        """
+        test_user = User.objects.create_user(username="foo")  # Used for bearer auth
+        self.client.force_authenticate(user=test_user)
+
+    def test_api_without_sessions(self):
+        """
+        Positive test case
+        API works without session, CSRF and message middleware
+        """
+        response = self.client.get(reverse("cars-list"), format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn("Cookie", response.get("Vary", ""))
+        self.assertEqual(response.cookies, {})
+
+    def test_admin_not_routed(self):
+        """
+        Negative test case
+        Admin isn't part of API-only deployment
+        """
+        response = self.client.get("/admin/")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+@override_settings(CACHE_SHARED_REQUIRED=True)
+class SharedCacheCheckTests(SimpleTestCase):
+    def test_local_cache_refused(self):
+        """
+        Negative test case
+        Per-process cache fails system checks when shared one is required
+        """
+        errors = check_shared_cache(None)
+        self.assertEqual([error.id for error in errors], ["api_cars.E001"])
+
+    def test_shared_cache_accepted(self):
+        """
+        Positive test case
+        Memcached passes, as does local cache of a single process deployment
+        """
+        memcached = {
+            "BACKEND": "django.core.cache.backends.memcached.MemcachedCache",
+            "LOCATION": "memcached:11211",
+        }
+        with self.settings(CACHES={"default": memcached}):
+            self.assertEqual(check_shared_cache(None), [])
+        with self.settings(CACHE_SHARED_REQUIRED=False):
+            self.assertEqual(check_shared_cache(None), [])
+
+
+class ConnectionHealthCheckTests(SimpleTestCase):
+    def setUp(self) -> None:
+        """
+        Auxiliary test objects and functions
+        """
+        self.connections = []
+        patcher = mock.patch("api_cars.db.connections")
+        self.addCleanup(patcher.stop)
+        patcher.start().all.return_value = self.connections
+
+    def add_connection(self, usable=True, opened=True, conn_max_age=60):
+        connection = mock.Mock(in_atomic_block=False)
+        connection.connection = object() if opened else None
+        connection.settings_dict = {"CONN_MAX_AGE": conn_max_age}
+        connection.is_usable.return_value = usable
+        self.connections.append(connection)
+        return connection
+
+    def test_broken_connection_closed(self):
+        """
+        Positive test case
+        Reused persistent connection which doesn't answer is closed, working one is kept
+        """
+        broken = self.add_connection(usable=False)
+        working = self.add_connection()
+        check_persistent_connections()
+        broken.close.assert_called_once_with()
+        working.close.assert_not_called()
+
+    def test_fresh_connections_not_checked(self):
+        """
+        Positive test case
+        Not yet opened and not persistent connections cost no extra query
+        """
+        connections = [
+            self.add_connection(opened=False),
+            self.add_connection(conn_max_age=0),
+        ]
+        check_persistent_connections()
+        for connection in connections:
+            connection.is_usable.assert_not_called()
+
+    @override_settings(CONN_HEALTH_CHECKS=False)
+    def test_health_checks_disabled(self):
+        """
+        Negative test case
+        With CONN_HEALTH_CHECKS off connections are not pinged
+        """
+        connection = self.add_connection(usable=False)
+        check_persistent_connections()
+        connection.is_usable.assert_not_called()
+
+
+@override_settings(DATABASE_REPLICAS=["default"])
+class ReplicaRoutingTests(APITestCase):
+    def setUp(self) -> None:
+        """
+        Auxiliary test objects and functions
+        """
+        cache.clear()
+        self.car = Car.objects.create(make_name="Tesla", model_name="Model S")
+        self.user = User.objects.create_user(username="foo")  # Used for bearer auth
+        self.client.force_authenticate(user=self.user)
+        # The only test database stands in for replica
+        patcher = mock.patch.object(
+            ReplicaPool, "choose", return_value=DEFAULT_DB_ALIAS
+        )
+        self.addCleanup(patcher.stop)
+        self.choose = patcher.start()
+
+    def test_listing_reads_from_replica(self):
+        """
+        Positive test case
+        Listing endpoints pick a replica, writes always go to primary
+        """
+        for url in (reverse("cars-list"), reverse("cars-popular")):
+            response = self.client.get(url, format="json")
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.choose.call_count, 2)
+        self.assertEqual(
+            ReplicaRouter().db_for_write(Car, instance=mock.Mock()), DEFAULT_DB_ALIAS
+        )
+
+    def test_writer_pinned_to_primary(self):
+        """
+        Positive test case
+        User who just rated a car reads from primary, others keep using replicas
+        """
+        response = self.client.post(
+            reverse("rate-car"), {"car": self.car.pk, "rating": 5}, format="json"
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.client.get(reverse("cars-popular"), format="json")
+        self.choose.assert_not_called()
+
+        self.client.force_authenticate(user=User.objects.create_user(username="bar"))
+        self.client.get(reverse("cars-popular"), format="json")
+        self.choose.assert_called_once_with()
+
+    @override_settings(CARS_LISTING_CACHE_TIMEOUT=300, REPLICA_PIN_SECONDS=5)
+    def test_replica_listing_cached_for_lag_window(self):
+        """
+        Positive test case
+        Listing read from replica right after a change is cached only until replicas catch up
+        """
+        cache.clear()
+        with mock.patch("cars.cache.get_read_database", return_value="replica1"):
+            self.assertEqual(listing_cache_timeout(), 300)
+            invalidate_listings()
+            self.assertLessEqual(listing_cache_timeout(), 5)
+        self.assertEqual(listing_cache_timeout(), 300)
+
+
+class ReplicaPoolTests(SimpleTestCase):
+    def setUp(self) -> None:
+        """
+        Auxiliary test objects and functions
+        """
+        self.pool = ReplicaPool(["replica1", "replica2"], retry_seconds=30)
+        self.healthy = {"replica1", "replica2"}
+        patcher = mock.patch.object(
+            self.pool, "is_healthy", side_effect=lambda alias: alias in self.healthy
+        )
+        self.addCleanup(patcher.stop)
+        patcher.start()
+
+    def test_round_robin(self):
+        """
+        Positive test case
+        Replicas are used in turns
+        """
+        self.assertEqual(
+            [self.pool.choose() for _ in range(3)], ["replica1", "replica2", "replica1"]
+        )
+
+    def test_unavailable_replica_skipped(self):
+        """
+        Negative test case
+        Replica which can't be connected to is skipped, with none left reads go to primary
+        """
+        self.healthy = {"replica2"}
+        with self.assertLogs("api_cars.db", "WARNING"):
+            self.assertEqual(
+                [self.pool.choose() for _ in range(3)],
+                ["replica2", "replica2", "replica2"],
+            )
+        self.pool.mark_down("replica2")
+        self.assertEqual(self.pool.choose(), DEFAULT_DB_ALIAS)
+
+
+class RendererTests(SimpleTestCase):
+    data = [
+        {
+            "id": 1,
+            "make_name": "Škoda",
+            "average_rate": Decimal("4.5"),
+            "histogram": {1: 0, 5: 2},
+            "last_rated_at": datetime(2020, 11, 20, 10, 30, 1, 123456, timezone.utc),
+            "note": "line\u2028separator",
+        }
+    ]
+
+    @unittest.skipIf(orjson is None, "orjson is not installed")
+    def test_fast_renderer_output(self):
+        """
+        Positive test case
+        orjson output is byte for byte the same as DRF's JSONRenderer
+        """
+        self.assertEqual(
+            FastJSONRenderer().render(self.data), JSONRenderer().render(self.data)
+        )
+
+    def test_fast_renderer_fallback(self):
+        """
+        Positive test case
+        Without orjson rendering falls back to stdlib json
+        """
+        with mock.patch("api_cars.renderers.orjson", None):
+            content = FastJSONRenderer().render(self.data)
+        self.assertEqual(content, JSONRenderer().render(self.data))
+
+    def test_columnar_renderer(self):
+        """
+        Positive test case
+        List of objects is rendered as column names and rows, other data as is
+        """
+        rows = [{"id": 1, "make_name": "Tesla"}, {"id": 2, "make_name": "Audi"}]
+        self.assertEqual(
+            ColumnarJSONRenderer().render(rows),
+            b'{"columns":["id","make_name"],"rows":[[1,"Tesla"],[2,"Audi"]]}',
+        )
+        self.assertEqual(
+            ColumnarJSONRenderer().render({"error": "x"}), b'{"error":"x"}'
+        )
+
+
+class CompressionTests(APITestCase):
+    def setUp(self) -> None:
+        """
+        Auxiliary test objects and functions
+        """
+        cache.clear()
+        Car.objects.bulk_create(
+            Car(make_name="Tesla", model_name=f"Model {i}") for i in range(100)
+        )
+        test_user = User.objects.create_user(username="foo")  # Used for bearer auth
+        self.client.force_authenticate(user=test_user)
+
+    def test_columnar_listing(self):
+        """
+        Positive test case
+        Listing is served in columnar form when client accepts it
+        """
+        response = self.client.get(
+            reverse("cars-list"), HTTP_ACCEPT=ColumnarJSONRenderer.media_type
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response["Content-Type"], ColumnarJSONRenderer.media_type)
+        body = response.json()
+        self.assertEqual(
+            body["columns"], ["id", "make_name", "model_name", "average_rate"]
+        )
+        self.assertEqual(len(body["rows"]), 100)
+
+    def test_large_response_gzipped(self):
+        """
+        Positive test case
+        Large listing is gzipped, conditional request with its weak ETag gets 304
+        """
+        url = reverse("cars-list")
+        response = self.client.get(url, format="json", HTTP_ACCEPT_ENCODING="gzip")
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertEqual(len(json.loads(gzip.decompress(response.content))), 100)
+
+        response = self.client.get(
+            url,
+            format="json",
+            HTTP_ACCEPT_ENCODING="gzip",
+            HTTP_IF_NONE_MATCH=response["ETag"],
+        )
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    @override_settings(GZIP_MIN_LENGTH=10 ** 6)
+    def test_small_response_not_gzipped(self):
+        """
+        Negative test case
+        Responses under GZIP_MIN_LENGTH are sent as they are
+        """
+        response = self.client.get(
+            reverse("cars-list"), format="json", HTTP_ACCEPT_ENCODING="gzip"
+        )
+        self.assertNotIn("Content-Encoding", response)
+
+
+class ProfilingTests(APITestCase):
+    def setUp(self) -> None:
+        """
+        Auxiliary test objects and functions
+        """
+        cache.clear()
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        settings_override = override_settings(
+            PROFILING_ENABLED=1,
+            PROFILING_DIR=self.directory.name,
+            PROFILING_MAX_FILES=2,
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        Car.objects.create(make_name="Tesla", model_name="Model S")
+        self.staff = User.objects.create_user(username="foo", is_staff=True)
+        self.token = Token.objects.create(user=self.staff)
+
+    def get(self, token, **extra):
+        return self.client.get(
+            reverse("cars-list"), HTTP_AUTHORIZATION=f"Bearer {token.key}", **extra
+        )
+
+    def test_staff_request_profiled(self):
+        """
+        Positive test case
+        Staff gets profile link and summary, profile holds stats and SQL of the view
+        """
+        response = self.get(self.token, HTTP_X_PROFILE="1")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertRegex(response["X-Profile-Summary"], r"^[\d.]+ ms, \d+ queries")
+
+        link = response["X-Profile"]
+        response = self.client.get(link, HTTP_AUTHORIZATION=f"Bearer {self.token.key}")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        with tempfile.NamedTemporaryFile() as file:
+            file.write(b"".join(response.streaming_content))
+            file.flush()
+            self.assertTrue(pstats.Stats(file.name).total_calls)
+
+        response = self.client.get(
+            f"{link}?output=sql", HTTP_AUTHORIZATION=f"Bearer {self.token.key}"
+        )
+        queries = json.loads(b"".join(response.streaming_content))["queries"]
+        self.assertTrue(any(q["origin"].startswith("cars/") for q in queries))
+
+    def test_non_staff_not_profiled(self):
+        """
+        Negative test case
+        Profiling header of a regular user is ignored, profiles aren't served to them
+        """
+        user = User.objects.create_user(username="bar")
+        token = Token.objects.create(user=user)
+        response = self.get(token, HTTP_X_PROFILE="1")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn("X-Profile", response)
+        self.assertFalse(os.listdir(self.directory.name))
+
+        link = self.get(self.token, HTTP_X_PROFILE="1")["X-Profile"]
+        response = self.client.get(link, HTTP_AUTHORIZATION=f"Bearer {token.key}")
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    @override_settings(PROFILING_SAMPLE_RATE=1)
+    def test_sampled_requests_bounded(self):
+        """
+        Positive test case
+        Sampled requests are profiled without header, only newest profiles are kept
+        """
+        for _ in range(3):
+            response = self.get(self.token)
+            self.assertNotIn("X-Profile", response)
+        self.assertEqual(len(os.listdir(self.directory.name)), 4)
@@ -14,13 +14,16 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.contrib import admin
-from django.urls import path,include
-
+from django.urls import include, path
 from rest_framework.authtoken.views import obtain_auth_token
 
+from .views import ProfileAPIView, metrics
+
 urlpatterns = [
-    path('admin/', admin.site.urls),
-    path('api-token-auth/', obtain_auth_token),
-    path('', include('cars.urls')),
-    path('', include('rate.urls')),
+    path("admin/", admin.site.urls),
+    path("api-token-auth/", obtain_auth_token),
+    path("metrics", metrics, name="metrics"),
+    path("profiles/<slug:profile_id>", ProfileAPIView.as_view(), name="profile"),
+    path("", include("cars.urls")),
+    path("", include("rate.urls")),
 ]
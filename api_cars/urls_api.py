@@ -0,0 +1,15 @@
+"""
+URL configuration of api_cars.settings_api, same as api_cars.urls without admin
+"""
+from django.urls import include, path
+from rest_framework.authtoken.views import obtain_auth_token
+
+from .views import ProfileAPIView, metrics
+
+urlpatterns = [
+    path("api-token-auth/", obtain_auth_token),
+    path("metrics", metrics, name="metrics"),
+    path("profiles/<slug:profile_id>", ProfileAPIView.as_view(), name="profile"),
+    path("", include("cars.urls")),
+    path("", include("rate.urls")),
+]
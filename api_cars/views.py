@@ -0,0 +1,50 @@
+from pathlib import Path
+
+from django.conf import settings
+from django.http import FileResponse, Http404, HttpResponse
+from django.utils.crypto import constant_time_compare
+from rest_framework.permissions import IsAdminUser
+from rest_framework.views import APIView
+
+from .metrics import registry
+from .profiling import PROFILE_SUFFIX, QUERIES_SUFFIX
+
+
+def metrics(request):
+    """
+    Metrics of this worker process in Prometheus text format. Scraper has to send
+    METRICS_TOKEN in "Authorization: Bearer <token>" header, without the token
+    metrics are served only with DEBUG on.
+    """
+    if settings.METRICS_TOKEN:
+        expected = f"Bearer {settings.METRICS_TOKEN}"
+        if not constant_time_compare(
+            request.META.get("HTTP_AUTHORIZATION", ""), expected
+        ):
+            return HttpResponse(status=401)
+    elif not settings.DEBUG:
+        return HttpResponse(status=403)
+    return HttpResponse(
+        registry.render(), content_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
+class ProfileAPIView(APIView):
+    """
+    Stored request profile for staff: pstats file (open with pstats or snakeviz),
+    or SQL query log with "?output=sql"
+    """
+
+    permission_classes = (IsAdminUser,)
+
+    def get(self, request, profile_id):
+        sql = request.query_params.get("output") == "sql"
+        suffix = QUERIES_SUFFIX if sql else PROFILE_SUFFIX
+        path = Path(settings.PROFILING_DIR) / f"{profile_id}{suffix}"
+        try:
+            file = open(path, "rb")
+        except FileNotFoundError:
+            raise Http404("Profile not found (or already pruned)")
+        if sql:
+            return FileResponse(file, content_type="application/json")
+        return FileResponse(file, as_attachment=True, filename=path.name)
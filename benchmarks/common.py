@@ -0,0 +1,66 @@
+"""
+Helpers shared by benchmark scripts, run them from repository root, e.g.
+
+    python -m benchmarks.export_memory --cars 1000000
+"""
+import os
+import sys
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+
+
+def setup_django(database: str = "") -> None:
+    """
+    Configure Django for a benchmark process. Uses SQL_* variables from environment
+    when set, otherwise given sqlite database file (benchmark.sqlite3 by default).
+    """
+    sys.path.insert(0, str(BASE_DIR))
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "api_cars.settings")
+    os.environ.setdefault("SECRET_KEY", "benchmark")
+    os.environ.setdefault("DJANGO_ALLOWED_HOSTS", "testserver localhost")
+    if not os.environ.get("SQL_ENGINE"):
+        os.environ["SQL_ENGINE"] = "django.db.backends.sqlite3"
+        os.environ["SQL_DATABASE"] = database or str(BASE_DIR / "benchmark.sqlite3")
+
+    import django
+
+    django.setup()
+
+
+def create_schema() -> None:
+    from django.core.management import call_command
+
+    call_command("migrate", verbosity=0)
+
+
+def seed_cars(count: int, batch_size: int = 10000) -> None:
+    """
+    Insert count cars with made-up aggregates, skipped if they are already there
+    """
+    from cars.models import Car
+
+    existing = Car.objects.count()
+    for start in range(existing, count, batch_size):
+        Car.objects.bulk_create(
+            [
+                Car(
+                    make_name=f"make {i % 1000}",
+                    model_name=f"model {i}",
+                    rating_qty=i % 97,
+                    rating_sum=(i % 97) * 3,
+                    average_rate=3 if i % 97 else 0,
+                )
+                for i in range(start, min(start + batch_size, count))
+            ]
+        )
+
+
+def authenticated_client():
+    from django.contrib.auth.models import User
+    from rest_framework.test import APIClient
+
+    user, _ = User.objects.get_or_create(username="benchmark")
+    client = APIClient()
+    client.force_authenticate(user=user)
+    return client
@@ -0,0 +1,53 @@
+"""
+Compare two result files of benchmarks.run, exits with status 1 when any scenario
+got slower (p50 or p99) by more than --threshold percent, or issues more queries:
+
+    python -m benchmarks.compare before.json after.json --threshold 10
+"""
+import argparse
+import json
+import sys
+
+
+def load(path: str) -> dict:
+    with open(path) as file:
+        report = json.load(file)
+    return {(row["cars"], row["scenario"]): row for row in report["results"]}
+
+
+def change(before: float, after: float) -> float:
+    return (after - before) / before * 100 if before else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("before")
+    parser.add_argument("after")
+    parser.add_argument("--threshold", type=float, default=10)
+    args = parser.parse_args()
+
+    before, after = load(args.before), load(args.after)
+    regressions = 0
+    print(f"{'cars':>8} {'scenario':<28} {'p50 ms':>18} {'p99 ms':>18} {'queries':>12}")
+    for key in sorted(before.keys() & after.keys()):
+        old, new = before[key], after[key]
+        p50 = change(old["p50_ms"], new["p50_ms"])
+        p99 = change(old["p99_ms"], new["p99_ms"])
+        regressed = (
+            p50 > args.threshold
+            or p99 > args.threshold
+            or new["queries_per_request"] > old["queries_per_request"]
+        )
+        regressions += regressed
+        print(
+            f"{key[0]:>8} {key[1]:<28} "
+            f"{new['p50_ms']:>9.2f} ({p50:+5.0f}%) "
+            f"{new['p99_ms']:>9.2f} ({p99:+5.0f}%) "
+            f"{old['queries_per_request']:>5g} -> {new['queries_per_request']:<5g}"
+            f"{'  REGRESSION' if regressed else ''}"
+        )
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+"""
+Throughput and latency of gunicorn serving the API with different database
+connection settings, e.g. new connection per request vs persistent ones:
+
+    SQL_ENGINE=django.db.backends.postgresql SQL_HOST=... \\
+        python -m benchmarks.connections --configs "SQL_CONN_MAX_AGE=0;SQL_CONN_MAX_AGE=60"
+
+Every config starts gunicorn (gunicorn.conf.py) with the given variables, then
+--concurrency clients with keep-alive HTTP connections send authenticated
+GET /cars/<id> requests, which issue one query each. On PostgreSQL 14+ number of
+database sessions opened by the server is reported too.
+"""
+import argparse
+import http.client
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+from .common import BASE_DIR, create_schema, seed_cars, setup_django
+
+
+def database_sessions():
+    """
+    Sessions ever opened to the benchmark database, None where not tracked
+    """
+    from django.db import connection
+
+    if connection.vendor != "postgresql" or connection.pg_version < 140000:
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT pg_stat_clear_snapshot(), sessions FROM pg_stat_database"
+            " WHERE datname = current_database()"
+        )
+        return cursor.fetchone()[1]
+
+
+def wait_for_port(port: int, timeout: float = 30) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"gunicorn didn't start listening on {port}")
+
+
+def client(port: int, paths: list, token: str, latencies: list) -> None:
+    connection = http.client.HTTPConnection("127.0.0.1", port)
+    headers = {
+        "Host": "localhost",
+        "Authorization": f"Bearer {token}",
+        "Accept": "application/json",
+    }
+    for path in paths:
+        started = time.perf_counter()
+        connection.request("GET", path, headers=headers)
+        response = connection.getresponse()
+        response.read()
+        if response.status != 200:
+            raise RuntimeError(f"GET {path} answered {response.status}")
+        latencies.append(time.perf_counter() - started)
+    connection.close()
+
+
+def measure(config: str, args, car_ids: list, token: str) -> dict:
+    env = {
+        **os.environ,
+        **dict(item.split("=", 1) for item in config.split()),
+        "GUNICORN_BIND": f"127.0.0.1:{args.port}",
+        "GUNICORN_WORKERS": str(args.workers),
+        "GUNICORN_THREADS": str(args.threads),
+        "GUNICORN_ACCESSLOG": "/dev/null",
+    }
+    sessions = database_sessions()
+    # gunicorn 20.0 can't be run with -m
+    command = "from gunicorn.app.wsgiapp import run; run()"
+    server = subprocess.Popen(
+        [
+            sys.executable,
+            "-c",
+            command,
+            "api_cars.wsgi:application",
+            "-c",
+            "gunicorn.conf.py",
+        ],
+        cwd=BASE_DIR,
+        env=env,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        wait_for_port(args.port)
+        # Warm up every worker (imports, token cache) before measuring
+        client(args.port, [f"/cars/{car_ids[0]}"] * args.workers * 4, token, [])
+
+        latencies = []
+        per_client = args.requests // args.concurrency
+        clients = [
+            threading.Thread(
+                target=client,
+                args=(
+                    args.port,
+                    [
+                        f"/cars/{car_ids[(n + i) % len(car_ids)]}"
+                        for i in range(per_client)
+                    ],
+                    token,
+                    latencies,
+                ),
+            )
+            for n in range(args.concurrency)
+        ]
+        started = time.perf_counter()
+        for thread in clients:
+            thread.start()
+        for thread in clients:
+            thread.join()
+        elapsed = time.perf_counter() - started
+    finally:
+        server.terminate()
+        server.wait()
+
+    latencies.sort()
+    result = {
+        "config": config,
+        "requests": len(latencies),
+        "requests_per_second": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(statistics.median(latencies) * 1000, 2),
+        "p99_ms": round(latencies[int(len(latencies) * 0.99) - 1] * 1000, 2),
+    }
+    if sessions is not None:
+        # Sessions are counted when they end, give the server a moment
+        time.sleep(1)
+        result["db_sessions_opened"] = database_sessions() - sessions
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--configs", default="SQL_CONN_MAX_AGE=0;SQL_CONN_MAX_AGE=60")
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    setup_django()
+    create_schema()
+    seed_cars(1000)
+    from django.contrib.auth.models import User
+    from rest_framework.authtoken.models import Token
+
+    from cars.models import Car
+
+    user, _ = User.objects.get_or_create(username="benchmark")
+    token, _ = Token.objects.get_or_create(user=user)
+    car_ids = list(Car.objects.values_list("id", flat=True)[:1000])
+
+    results = [
+        measure(config.strip(), args, car_ids, token.key)
+        for config in args.configs.split(";")
+    ]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
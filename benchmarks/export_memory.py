@@ -0,0 +1,75 @@
+"""
+Peak RSS of a worker serving the whole catalogue, GET /cars (one rendered list)
+compared with streamed GET /cars/export in both output formats.
+
+Every mode runs in a fresh process, so its peak RSS is measured in isolation:
+
+    python -m benchmarks.export_memory --cars 1000000
+"""
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import time
+
+from .common import authenticated_client, create_schema, seed_cars, setup_django
+
+MODES = {
+    "list": "/cars",
+    "export-json": "/cars/export",
+    "export-ndjson": "/cars/export?output=ndjson",
+}
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def measure(mode: str) -> dict:
+    client = authenticated_client()
+    baseline = peak_rss_mb()
+    started = time.perf_counter()
+    response = client.get(MODES[mode])
+    size = 0
+    if response.streaming:
+        for chunk in response.streaming_content:
+            size += len(chunk)
+    else:
+        size = len(response.content)
+    return {
+        "mode": mode,
+        "seconds": round(time.perf_counter() - started, 3),
+        "bytes": size,
+        "baseline_rss_mb": round(baseline, 1),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--cars", type=int, default=1000000)
+    parser.add_argument("--database", default="")
+    parser.add_argument("--mode", choices=MODES, help="measure single mode in-process")
+    args = parser.parse_args()
+
+    setup_django(args.database)
+    if args.mode:
+        print(json.dumps(measure(args.mode)))
+        return
+
+    create_schema()
+    seed_cars(args.cars)
+    results = []
+    for mode in MODES:
+        command = [sys.executable, "-m", "benchmarks.export_memory", "--mode", mode]
+        if args.database:
+            command += ["--database", args.database]
+        output = subprocess.run(command, check=True, capture_output=True, text=True)
+        results.append(json.loads(output.stdout))
+    print(json.dumps({"cars": args.cars, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
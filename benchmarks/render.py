@@ -0,0 +1,74 @@
+"""
+Render time and bytes on wire of a full car listing per renderer:
+
+    python -m benchmarks.render --sizes 10000,100000,1000000
+
+Rows have the shape of GET /cars items (id, make_name, model_name, average_rate),
+"gzip" sizes are what ThresholdGZipMiddleware sends to clients accepting it.
+"""
+import argparse
+import json
+import time
+
+from .common import setup_django
+
+
+def build_rows(count: int) -> list:
+    return [
+        {
+            "id": i,
+            "make_name": f"make {i % 1000}",
+            "model_name": f"model {i}",
+            # Car.average_rate is a FloatField
+            "average_rate": (i % 50) / 10,
+        }
+        for i in range(1, count + 1)
+    ]
+
+
+def measure(renderer, rows: list, repeat: int) -> dict:
+    from django.utils.text import compress_string
+
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        content = renderer.render(rows)
+        timings.append(time.perf_counter() - started)
+    started = time.perf_counter()
+    compressed = compress_string(content)
+    return {
+        "render_ms": round(min(timings) * 1000, 1),
+        "bytes": len(content),
+        "gzip_bytes": len(compressed),
+        "gzip_ms": round((time.perf_counter() - started) * 1000, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", default="10000,100000,1000000")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    setup_django()
+    from rest_framework.renderers import JSONRenderer
+
+    from api_cars.renderers import ColumnarJSONRenderer, FastJSONRenderer, orjson
+
+    renderers = {
+        "drf_json": JSONRenderer(),
+        "fast_json": FastJSONRenderer(),
+        "columnar": ColumnarJSONRenderer(),
+    }
+    results = []
+    for size in map(int, args.sizes.split(",")):
+        rows = build_rows(size)
+        for name, renderer in renderers.items():
+            results.append(
+                {"cars": size, "renderer": name, **measure(renderer, rows, args.repeat)}
+            )
+    print(json.dumps({"orjson": orjson is not None, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
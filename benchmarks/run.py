@@ -0,0 +1,232 @@
+"""
+Benchmark scenarios of the cars/rate API at several dataset sizes.
+
+Every size is seeded into a fresh test database (seed_data command), external api
+is replaced with local stub server, then each scenario sends requests one by one
+through Django test client and records latency and number of SQL queries.
+Results are printed (or written with --output) as JSON, compare two runs with
+benchmarks.compare:
+
+    python -m benchmarks.run --sizes 1000,10000 --output before.json
+"""
+import argparse
+import io
+import json
+import platform
+import random
+import statistics
+import subprocess
+import time
+from typing import Callable, NamedTuple
+
+from .common import BASE_DIR, setup_django
+
+PASSWORD = "benchmark-password"
+
+
+class Scenario(NamedTuple):
+    name: str
+    method: str
+    # (iteration number) -> (path, body)
+    request: Callable
+    authenticated: bool = True
+    # called before every request, not included in measured time
+    before: Callable = None
+
+
+def build_scenarios(car_ids: list) -> list:
+    from django.core.cache import caches
+
+    rng = random.Random(0)
+
+    def clear_caches(i):
+        for alias in ("default", "vpic"):
+            caches[alias].clear()
+
+    return [
+        Scenario(
+            "auth.obtain_token",
+            "post",
+            lambda i: (
+                "/api-token-auth/",
+                {"username": "benchmark", "password": PASSWORD},
+            ),
+            authenticated=False,
+        ),
+        Scenario("cars.list.page", "get", lambda i: ("/cars?limit=100", None)),
+        Scenario(
+            "cars.list.page.uncached",
+            "get",
+            lambda i: ("/cars?limit=100", None),
+            before=clear_caches,
+        ),
+        Scenario("cars.list.full", "get", lambda i: ("/cars", None)),
+        Scenario("popular.top", "get", lambda i: ("/popular?top=10", None)),
+        Scenario(
+            "popular.top.uncached",
+            "get",
+            lambda i: ("/popular?top=10", None),
+            before=clear_caches,
+        ),
+        # Computed from daily rollups of the last 7 days
+        Scenario(
+            "popular.window.uncached",
+            "get",
+            lambda i: ("/popular?window=7d&top=10", None),
+            before=clear_caches,
+        ),
+        Scenario(
+            "rate.create",
+            "post",
+            lambda i: (
+                "/rate",
+                {"car": rng.choice(car_ids), "rating": rng.randint(1, 5)},
+            ),
+        ),
+        # New make every request, so catalogue is always fetched from stub api
+        Scenario(
+            "cars.create.catalogue_miss",
+            "post",
+            lambda i: ("/cars", {"make_name": f"Miss {i}", "model_name": "Model 1"}),
+        ),
+        # Stub api knows 100 models per make, so catalogue is fetched once per 100 requests
+        Scenario(
+            "cars.create.catalogue_hit",
+            "post",
+            lambda i: (
+                "/cars",
+                {"make_name": f"Hit {i // 100}", "model_name": f"Model {i % 100}"},
+            ),
+        ),
+    ]
+
+
+def percentile(values: list, fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def run_scenario(scenario: Scenario, token: str, requests: int, warmup: int) -> dict:
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+    from rest_framework.test import APIClient
+
+    client = APIClient()
+    if scenario.authenticated:
+        client.credentials(HTTP_AUTHORIZATION=f"Bearer {token}")
+
+    latencies = []
+    queries = []
+    errors = 0
+    for i in range(warmup + requests):
+        if scenario.before:
+            scenario.before(i)
+        path, body = scenario.request(i)
+        with CaptureQueriesContext(connection) as captured:
+            started = time.perf_counter()
+            response = getattr(client, scenario.method)(path, body, format="json")
+            if response.streaming:
+                b"".join(response.streaming_content)
+            elapsed = time.perf_counter() - started
+        if i < warmup:
+            continue
+        latencies.append(elapsed)
+        queries.append(len(captured))
+        errors += response.status_code >= 400
+
+    return {
+        "scenario": scenario.name,
+        "requests": requests,
+        "errors": errors,
+        "throughput_rps": round(requests / sum(latencies), 1),
+        "p50_ms": round(percentile(latencies, 0.5) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "mean_ms": round(statistics.mean(latencies) * 1000, 3),
+        "queries_per_request": round(statistics.mean(queries), 2),
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=BASE_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--sizes", default="1000,10000", help="comma separated numbers of cars"
+    )
+    parser.add_argument("--ratings-per-car", type=int, default=10)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--scenarios", default="", help="comma separated names to run")
+    parser.add_argument("--stub-delay", type=float, default=0)
+    parser.add_argument("--output", help="write JSON results to this file")
+    args = parser.parse_args()
+
+    setup_django()
+
+    import django
+    from django.contrib.auth.models import User
+    from django.core.management import call_command
+    from django.db import connection
+    from django.test.utils import override_settings, setup_test_environment
+    from rest_framework.authtoken.models import Token
+
+    from cars.models import Car
+
+    from .stub_vpic import start_stub_server
+
+    setup_test_environment()
+    connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    server = start_stub_server(delay=args.stub_delay)
+    selected = set(filter(None, args.scenarios.split(",")))
+
+    results = []
+    try:
+        with override_settings(VPIC_API_URL=f"http://127.0.0.1:{server.server_port}"):
+            for size in map(int, args.sizes.split(",")):
+                call_command("flush", interactive=False, verbosity=0)
+                call_command(
+                    "seed_data",
+                    cars=size,
+                    ratings=size * args.ratings_per_car,
+                    stdout=io.StringIO(),
+                )
+                user = User.objects.create_user("benchmark", password=PASSWORD)
+                token = Token.objects.create(user=user).key
+                car_ids = list(Car.objects.values_list("id", flat=True))
+
+                for scenario in build_scenarios(car_ids):
+                    if selected and scenario.name not in selected:
+                        continue
+                    result = run_scenario(scenario, token, args.requests, args.warmup)
+                    results.append({"cars": size, **result})
+    finally:
+        server.shutdown()
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": int(time.time()),
+        "python": platform.python_version(),
+        "django": django.get_version(),
+        "database": connection.vendor,
+        "results": results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
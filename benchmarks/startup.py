@@ -0,0 +1,88 @@
+"""
+Boot time and per-request middleware overhead of settings modules.
+
+Every run starts a fresh interpreter which imports Django, loads the WSGI
+application (what a gunicorn worker does before accepting connections) and then
+sends unauthenticated requests, which are answered by authentication without
+touching database, so the time is spent in handler and middleware:
+
+    python -m benchmarks.startup --settings api_cars.settings,api_cars.settings_api
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from .common import BASE_DIR
+
+
+def child(requests: int) -> dict:
+    started = time.perf_counter()
+    from .common import setup_django
+
+    setup_django()
+    from django.core.wsgi import get_wsgi_application
+
+    get_wsgi_application()
+    boot = time.perf_counter() - started
+
+    from django.test import Client
+
+    client = Client()
+    latencies = []
+    for _ in range(requests):
+        request_started = time.perf_counter()
+        client.get("/cars")
+        latencies.append(time.perf_counter() - request_started)
+    return {
+        "boot_ms": boot * 1000,
+        "request_p50_us": statistics.median(latencies) * 1e6,
+        "modules": len(sys.modules),
+    }
+
+
+def measure(settings_module: str, runs: int, requests: int) -> dict:
+    env = {**os.environ, "DJANGO_SETTINGS_MODULE": settings_module}
+    results = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-m", "benchmarks.startup", "--child", str(requests)],
+            cwd=BASE_DIR,
+            env=env,
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout
+        results.append(json.loads(output.splitlines()[-1]))
+    return {
+        "settings": settings_module,
+        "boot_ms_p50": round(statistics.median(r["boot_ms"] for r in results), 1),
+        "request_us_p50": round(
+            statistics.median(r["request_p50_us"] for r in results), 1
+        ),
+        "modules": results[0]["modules"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--settings", default="api_cars.settings,api_cars.settings_api")
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--child", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        print(json.dumps(child(args.child)))
+        return
+    results = [
+        measure(module, args.runs, args.requests) for module in args.settings.split(",")
+    ]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+"""
+Stand-in for vPIC GetModelsForMake endpoint, answers every make with the same
+made-up catalogue after optional delay. Run standalone and point VPIC_API_URL to it:
+
+    python -m benchmarks.stub_vpic --port 8001 --delay 0.05
+"""
+import argparse
+
+from cars.testing import StubVPICServer, start_stub_vpic
+
+MODELS_PER_MAKE = 100
+
+
+def made_up_models(make: str) -> dict:
+    return {
+        "Count": MODELS_PER_MAKE,
+        "Results": [
+            {"Make_ID": 1, "Make_Name": make, "Model_ID": i, "Model_Name": f"Model {i}"}
+            for i in range(MODELS_PER_MAKE)
+        ],
+    }
+
+
+def start_stub_server(port: int = 0, delay: float = 0) -> StubVPICServer:
+    """
+    Serve stub api from a daemon thread, call shutdown() on returned server to stop it
+    """
+    return start_stub_vpic([(200, made_up_models, delay)], port)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--delay", type=float, default=0, help="seconds per response")
+    args = parser.parse_args()
+
+    server = StubVPICServer(("0.0.0.0", args.port), [(200, made_up_models, args.delay)])
+    print(f"Stub vPIC api listening on port {args.port}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,7 @@
 from django.contrib import admin
 
-from .models import Car
+from .models import Car, CarJob, CatalogueEntry
 
 admin.site.register(Car)
+admin.site.register(CarJob)
+admin.site.register(CatalogueEntry)
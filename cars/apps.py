@@ -1,5 +1,11 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class CarsConfig(AppConfig):
     name = "cars"
+
+    def ready(self):
+        from . import signals
+
+        post_migrate.connect(signals.create_trigram_indexes, sender=self)
@@ -0,0 +1,133 @@
+import hashlib
+import math
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.http import parse_etags, quote_etag
+from rest_framework import status
+
+from api_cars.db import get_read_database
+from api_cars.metrics import record_cache_lookup
+
+LISTING_GENERATION_KEY = "cars:listing-generation"
+# Time of the latest generation bump
+LISTING_CHANGED_AT_KEY = "cars:listing-changed-at"
+
+# Response headers kept along with cached payload
+CACHED_HEADERS = ("Link",)
+
+
+def get_listing_generation() -> int:
+    # Time based initial value, so generation never goes back after key eviction
+    cache.add(LISTING_GENERATION_KEY, time.time_ns(), timeout=None)
+    return cache.get(LISTING_GENERATION_KEY)
+
+
+def bump_listing_generation() -> None:
+    try:
+        cache.incr(LISTING_GENERATION_KEY)
+    except ValueError:
+        cache.add(LISTING_GENERATION_KEY, time.time_ns(), timeout=None)
+    cache.set(LISTING_CHANGED_AT_KEY, time.time(), settings.REPLICA_PIN_SECONDS)
+
+
+def listing_cache_timeout() -> int:
+    """
+    Seconds to cache a listing read from current database. Replicas may lag
+    behind a change for up to REPLICA_PIN_SECONDS, what they return meanwhile
+    is cached only until then, not for the whole CARS_LISTING_CACHE_TIMEOUT
+    """
+    if get_read_database() == DEFAULT_DB_ALIAS:
+        return settings.CARS_LISTING_CACHE_TIMEOUT
+    changed_at = cache.get(LISTING_CHANGED_AT_KEY)
+    if changed_at is None:
+        return settings.CARS_LISTING_CACHE_TIMEOUT
+    lag_window = changed_at + settings.REPLICA_PIN_SECONDS - time.time()
+    return min(settings.CARS_LISTING_CACHE_TIMEOUT, max(1, math.ceil(lag_window)))
+
+
+def invalidate_listings() -> None:
+    """
+    Make cached listings stale. When called inside a transaction it's repeated
+    after commit, so concurrent reads can't cache data from before the commit.
+    """
+    bump_listing_generation()
+    connection = transaction.get_connection()
+    if connection.in_atomic_block:
+        transaction.on_commit(bump_listing_generation)
+
+
+def listing_cache_key(request) -> str:
+    query = sorted(request.query_params.lists())
+    # Users pinned to primary after a write must not get listing cached from a lagging replica
+    source = "primary" if get_read_database() == DEFAULT_DB_ALIAS else "replica"
+    # Scheme and host too, cached Link header holds absolute urls
+    url = request.build_absolute_uri(request.path)
+    raw = f"{url}|{query}|{request.accepted_media_type}|{source}"
+    digest = hashlib.md5(raw.encode()).hexdigest()
+    return f"cars:listing:{get_listing_generation()}:{digest}"
+
+
+def not_modified(request, etag: str) -> bool:
+    if_none_match = request.META.get("HTTP_IF_NONE_MATCH")
+    if not if_none_match:
+        return False
+    # Weak comparison, gzipped responses carry weakened W/"..." ETag
+    etags = [
+        tag[2:] if tag.startswith("W/") else tag for tag in parse_etags(if_none_match)
+    ]
+    return "*" in etags or etag in etags
+
+
+def cache_listing(handler):
+    """
+    Cache rendered response of an APIView GET handler, per url and accepted media type,
+    until listing generation is bumped by a write. Answers If-None-Match with 304.
+    """
+
+    @wraps(handler)
+    def wrapper(self, request, *args, **kwargs):
+        # Browsable api pages are rendered per user, they are not worth caching
+        if getattr(request.accepted_renderer, "format", None) == "api":
+            return handler(self, request, *args, **kwargs)
+
+        key = listing_cache_key(request)
+        cached = cache.get(key)
+        record_cache_lookup("listing", hit=cached is not None)
+        if cached is None:
+            response = handler(self, request, *args, **kwargs)
+            if response.status_code != status.HTTP_200_OK:
+                return response
+
+            response.accepted_renderer = request.accepted_renderer
+            response.accepted_media_type = request.accepted_media_type
+            response.renderer_context = self.get_renderer_context()
+            response.render()
+            cached = {
+                "content": response.content,
+                "content_type": response["Content-Type"],
+                "etag": quote_etag(hashlib.md5(response.content).hexdigest()),
+                "headers": {
+                    header: response[header]
+                    for header in CACHED_HEADERS
+                    if response.has_header(header)
+                },
+            }
+            cache.set(key, cached, listing_cache_timeout())
+
+        if not_modified(request, cached["etag"]):
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(
+                cached["content"], content_type=cached["content_type"]
+            )
+            for header, value in cached["headers"].items():
+                response[header] = value
+        response["ETag"] = cached["etag"]
+        return response
+
+    return wrapper
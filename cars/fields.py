@@ -0,0 +1,51 @@
+from django.db import models
+from django.db.models.lookups import PostgresOperatorLookup
+
+
+def normalize_name(name: str) -> str:
+    """
+    Case and whitespace insensitive form of make/model name used for matching
+    """
+    return " ".join(name.split()).casefold()
+
+
+class NormalizedNameField(models.CharField):
+    """
+    Normalized copy of another name field of the model, filled on every save
+    (bulk_create included), so lookups can use a plain index instead of LOWER()
+    """
+
+    def __init__(self, *args, source: str = None, **kwargs) -> None:
+        self.source = source
+        kwargs.setdefault("editable", False)
+        super().__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        kwargs["source"] = self.source
+        kwargs.pop("editable", None)
+        return name, path, args, kwargs
+
+    def pre_save(self, model_instance, add):
+        value = normalize_name(getattr(model_instance, self.source) or "")
+        setattr(model_instance, self.attname, value)
+        return value
+
+
+class Similarity(models.Func):
+    """
+    PostgreSQL pg_trgm similarity (0..1) of a column and a string
+    """
+
+    function = "SIMILARITY"
+    output_field = models.FloatField()
+
+
+@NormalizedNameField.register_lookup
+class TrigramSimilar(PostgresOperatorLookup):
+    """
+    PostgreSQL pg_trgm similarity operator, served by trigram GIN index
+    """
+
+    lookup_name = "trigram_similar"
+    postgres_operator = "%%"
@@ -0,0 +1,137 @@
+"""
+Database backed queue of car creations verified by a worker (process_car_jobs command)
+instead of the request, so clients don't wait for external api.
+"""
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .cache import invalidate_listings
+from .models import Car, CarJob
+from .ranking import rank_new_cars
+from .utils import lookup_make_catalogue, normalize_name
+
+JOB_FIELDS = ["status", "error", "car", "run_after", "locked_at", "updated_at"]
+
+
+def enqueue_car_job(car_make: str, car_model: str, user=None) -> CarJob:
+    return CarJob.objects.create(
+        make_name=car_make, model_name=car_model, created_by=user
+    )
+
+
+def claim_jobs(limit: int) -> list:
+    """
+    Mark up to limit due jobs as running and return them. Rows locked by other
+    workers are skipped (on databases supporting SKIP LOCKED), so workers can run side by side.
+    """
+    now = timezone.now()
+    stale = now - timedelta(seconds=settings.CARS_JOB_LOCK_TIMEOUT)
+    with transaction.atomic():
+        jobs = list(
+            CarJob.objects.select_for_update(skip_locked=True)
+            .filter(
+                Q(status=CarJob.PENDING, run_after__lte=now)
+                | Q(status=CarJob.RUNNING, locked_at__lt=stale)
+            )
+            .order_by("id")[:limit]
+        )
+        CarJob.objects.filter(pk__in=[job.pk for job in jobs]).update(
+            status=CarJob.RUNNING, locked_at=now, attempts=F("attempts") + 1
+        )
+    for job in jobs:
+        job.status, job.locked_at, job.attempts = CarJob.RUNNING, now, job.attempts + 1
+    return jobs
+
+
+def retry_or_fail(job: CarJob, error: str, now) -> None:
+    job.error = error
+    job.locked_at = None
+    if job.attempts >= settings.CARS_JOB_MAX_ATTEMPTS:
+        job.status = CarJob.FAILED
+    else:
+        job.status = CarJob.PENDING
+        delay = settings.CARS_JOB_RETRY_DELAY * 2 ** (job.attempts - 1)
+        job.run_after = now + timedelta(seconds=delay)
+
+
+def process_car_jobs(batch_size: int) -> int:
+    """
+    Claim a batch of jobs, verify them with imported catalogue or one external api
+    lookup per make and create accepted cars at once. Returns number of processed jobs.
+    """
+    jobs = claim_jobs(batch_size)
+    if not jobs:
+        return 0
+
+    by_make = defaultdict(list)
+    for job in jobs:
+        by_make[normalize_name(job.make_name)].append(job)
+
+    now = timezone.now()
+    accepted = {}  # (make_key, model_key) -> job
+    for make_jobs in by_make.values():
+        catalogue = lookup_make_catalogue(
+            make_jobs[0].make_name,
+            (normalize_name(job.model_name) for job in make_jobs),
+        )
+        for job in make_jobs:
+            key = (normalize_name(job.make_name), normalize_name(job.model_name))
+            name = f"{job.make_name} {job.model_name}"
+            if catalogue.error:
+                retry_or_fail(job, catalogue.error, now)
+            elif key[1] not in catalogue.models:
+                job.status = CarJob.REJECTED
+                job.error = f"No matching result in external api for {name}"
+            elif key in accepted:
+                job.status = CarJob.REJECTED
+                job.error = f"Car {name} already exists!"
+            else:
+                accepted[key] = job
+
+    with transaction.atomic():
+        if accepted:
+            make_keys = {make_key for make_key, _ in accepted}
+            model_keys = {model_key for _, model_key in accepted}
+            cars = Car.objects.filter(make_key__in=make_keys, model_key__in=model_keys)
+            existing = set(cars.values_list("make_key", "model_key")) & accepted.keys()
+            Car.objects.bulk_create(
+                [
+                    Car(make_name=job.make_name, model_name=job.model_name)
+                    for key, job in accepted.items()
+                    if key not in existing
+                ],
+                batch_size=settings.CARS_BULK_BATCH_SIZE,
+                ignore_conflicts=True,
+            )
+            invalidate_listings()
+            for make_key, model_key, car_id in cars.values_list(
+                "make_key", "model_key", "id"
+            ):
+                job = accepted.get((make_key, model_key))
+                if job is None:
+                    continue
+                job.car_id = car_id
+                if (make_key, model_key) in existing:
+                    job.status = CarJob.REJECTED
+                    job.error = f"Car {job.make_name} {job.model_name} already exists!"
+                else:
+                    job.status = CarJob.CREATED
+            rank_new_cars(
+                [
+                    job.car_id
+                    for job in accepted.values()
+                    if job.status == CarJob.CREATED
+                ]
+            )
+
+        for job in jobs:
+            if job.status != CarJob.RUNNING:
+                job.locked_at = None
+            job.updated_at = now
+        CarJob.objects.bulk_update(jobs, JOB_FIELDS)
+    return len(jobs)
@@ -0,0 +1,120 @@
+import csv
+import json
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from cars.models import CatalogueEntry
+
+NAME_LENGTH = CatalogueEntry._meta.get_field("make_name").max_length
+
+
+def read_json(path: str):
+    """
+    vPIC response ({"Results": [...]}) or plain list of its items
+    """
+    with open(path, encoding="utf-8") as file:
+        try:
+            data = json.load(file)
+        except ValueError as e:
+            raise CommandError(f"Invalid JSON in {path}: {e}")
+    if isinstance(data, dict):
+        data = data.get("Results")
+    if not isinstance(data, list):
+        raise CommandError(f"{path} should hold a list of models or vPIC response")
+    yield from data
+
+
+def read_csv(path: str):
+    """
+    CSV with Make_Name and Model_Name (and optionally Make_ID, Model_ID) header columns
+    """
+    with open(path, encoding="utf-8", newline="") as file:
+        reader = csv.DictReader(file)
+        missing = {"Make_Name", "Model_Name"} - set(reader.fieldnames or ())
+        if missing:
+            raise CommandError(f"{path} misses {', '.join(sorted(missing))} column(s)")
+        yield from reader
+
+
+def to_id(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def build_entry(row) -> CatalogueEntry:
+    """
+    Catalogue entry from vPIC result row, None when the row is unusable
+    """
+    if not isinstance(row, dict):
+        return None
+    make_name = " ".join(str(row.get("Make_Name") or "").split())
+    model_name = " ".join(str(row.get("Model_Name") or "").split())
+    if not make_name or not model_name:
+        return None
+    if len(make_name) > NAME_LENGTH or len(model_name) > NAME_LENGTH:
+        return None
+    return CatalogueEntry(
+        make_id=to_id(row.get("Make_ID")),
+        make_name=make_name,
+        model_id=to_id(row.get("Model_ID")),
+        model_name=model_name,
+    )
+
+
+class Command(BaseCommand):
+    help = "Import vPIC make/model dump (JSON or CSV) used to validate cars offline"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path")
+        parser.add_argument(
+            "--format",
+            choices=["json", "csv"],
+            help="File format, guessed from extension by default",
+        )
+        parser.add_argument(
+            "--replace",
+            action="store_true",
+            help="Remove previously imported catalogue first",
+        )
+        parser.add_argument("--batch-size", type=int, default=5000)
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        file_format = options["format"] or (
+            "csv" if path.lower().endswith(".csv") else "json"
+        )
+        reader = read_csv if file_format == "csv" else read_json
+
+        rows = 0
+        skipped = 0
+        try:
+            with transaction.atomic():
+                if options["replace"]:
+                    CatalogueEntry.objects.all().delete()
+                before = CatalogueEntry.objects.count()
+                rows_iter = iter(reader(path))
+                while True:
+                    batch = list(islice(rows_iter, options["batch_size"]))
+                    if not batch:
+                        break
+                    rows += len(batch)
+                    entries = [entry for entry in map(build_entry, batch) if entry]
+                    skipped += len(batch) - len(entries)
+                    CatalogueEntry.objects.bulk_create(entries, ignore_conflicts=True)
+                imported = CatalogueEntry.objects.count() - before
+        except OSError as e:
+            raise CommandError(f"Can't read {path}: {e}")
+
+        if skipped:
+            self.stderr.write(
+                f"Skipped {skipped} row(s) with missing or too long make/model name"
+            )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Imported {imported} new make/model pair(s) from {rows} row(s)"
+            )
+        )
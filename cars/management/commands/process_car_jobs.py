@@ -0,0 +1,46 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from cars.jobs import process_car_jobs
+
+
+class Command(BaseCommand):
+    help = "Worker verifying pending car creations with external api and creating cars"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size", type=int, default=settings.CARS_JOB_BATCH_SIZE
+        )
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=1.0,
+            help="Seconds to wait when there are no due jobs",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Exit when there are no due jobs instead of waiting for more",
+        )
+
+    def handle(self, *args, **options):
+        total = 0
+        try:
+            while True:
+                processed = process_car_jobs(options["batch_size"])
+                total += processed
+                if processed:
+                    self.stdout.write(f"Processed {processed} job(s)")
+                elif options["once"]:
+                    break
+                else:
+                    time.sleep(options["poll_interval"])
+                    # Long running process doesn't get request_finished, drop expired
+                    # or broken persistent connections when idle instead
+                    close_old_connections()
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(self.style.SUCCESS(f"Processed {total} job(s) in total"))
@@ -0,0 +1,41 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from cars.ranking import recompute_rankings
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute confidence weighted scores of all cars used by GET /cars?order=score"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=10000)
+        parser.add_argument(
+            "--interval",
+            type=float,
+            help="Repeat every given number of seconds instead of running once",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            while True:
+                run, timings = recompute_rankings(options["batch_size"])
+                phases = ", ".join(
+                    f"{phase} {seconds:.2f}s" for phase, seconds in timings.items()
+                )
+                self.stdout.write(
+                    self.style.SUCCESS(
+                        f"Ranked {run.car_qty} car(s) in {sum(timings.values()):.2f}s"
+                        f" ({phases}), prior mean {run.prior_mean:.3f}"
+                        f" weight {run.prior_weight:g}"
+                    )
+                )
+                if options["interval"] is None:
+                    break
+                time.sleep(options["interval"])
+                close_old_connections()
+        except KeyboardInterrupt:
+            pass
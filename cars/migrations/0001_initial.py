@@ -0,0 +1,35 @@
+# Generated by Django 3.1.3 on 2026-10-18 16:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = []
+
+    operations = [
+        migrations.CreateModel(
+            name="Car",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("make_name", models.CharField(max_length=25)),
+                ("model_name", models.CharField(max_length=40)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name="car",
+            constraint=models.UniqueConstraint(
+                fields=("make_name", "model_name"), name="unique car name"
+            ),
+        ),
+    ]
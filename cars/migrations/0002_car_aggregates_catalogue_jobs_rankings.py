@@ -0,0 +1,258 @@
+# Generated by Django 3.1.3 on 2026-10-18 16:37
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+import cars.fields
+
+
+def fill_name_keys(apps, schema_editor):
+    """
+    Normalized names of existing cars, uniqueness moves over to them
+    """
+    Car = apps.get_model("cars", "Car")
+    existing = list(Car.objects.only("id", "make_name", "model_name"))
+    for car in existing:
+        car.make_key = cars.fields.normalize_name(car.make_name)
+        car.model_key = cars.fields.normalize_name(car.model_name)
+    Car.objects.bulk_update(existing, ["make_key", "model_key"], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("cars", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="CarJob",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("make_name", models.CharField(max_length=25)),
+                ("model_name", models.CharField(max_length=40)),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("pending", "Pending"),
+                            ("running", "Running"),
+                            ("created", "Created"),
+                            ("rejected", "Rejected"),
+                            ("failed", "Failed"),
+                        ],
+                        default="pending",
+                        max_length=10,
+                    ),
+                ),
+                ("error", models.TextField(blank=True)),
+                ("attempts", models.PositiveSmallIntegerField(default=0)),
+                ("run_after", models.DateTimeField(default=django.utils.timezone.now)),
+                ("locked_at", models.DateTimeField(blank=True, null=True)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name="CarRanking",
+            fields=[
+                (
+                    "car",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="ranking",
+                        serialize=False,
+                        to="cars.car",
+                    ),
+                ),
+                ("score", models.FloatField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name="CatalogueEntry",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("make_id", models.PositiveIntegerField(blank=True, null=True)),
+                ("make_name", models.CharField(max_length=100)),
+                ("model_id", models.PositiveIntegerField(blank=True, null=True)),
+                ("model_name", models.CharField(max_length=100)),
+                (
+                    "make_key",
+                    cars.fields.NormalizedNameField(max_length=100, source="make_name"),
+                ),
+                (
+                    "model_key",
+                    cars.fields.NormalizedNameField(
+                        max_length=100, source="model_name"
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name_plural": "catalogue entries",
+            },
+        ),
+        migrations.CreateModel(
+            name="RankingRun",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("prior_mean", models.FloatField()),
+                ("prior_weight", models.FloatField()),
+                ("car_qty", models.PositiveIntegerField()),
+                ("duration", models.FloatField()),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.RemoveConstraint(
+            model_name="car",
+            name="unique car name",
+        ),
+        migrations.AddField(
+            model_name="car",
+            name="aggregated_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="car",
+            name="average_rate",
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name="car",
+            name="last_rated_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="car",
+            name="make_key",
+            field=cars.fields.NormalizedNameField(
+                db_index=True, default="", max_length=100, source="make_name"
+            ),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name="car",
+            name="model_key",
+            field=cars.fields.NormalizedNameField(
+                db_index=True, default="", max_length=100, source="model_name"
+            ),
+            preserve_default=False,
+        ),
+        migrations.RunPython(fill_name_keys, migrations.RunPython.noop),
+        migrations.AddField(
+            model_name="car",
+            name="rating_qty",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="car",
+            name="rating_sum",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="car",
+            name="stars_1",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="car",
+            name="stars_2",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="car",
+            name="stars_3",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="car",
+            name="stars_4",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="car",
+            name="stars_5",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name="car",
+            index=models.Index(
+                fields=["-average_rate", "-id"], name="car_average_rate_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="car",
+            index=models.Index(
+                fields=["-rating_qty", "-id"], name="car_rating_qty_idx"
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="car",
+            constraint=models.UniqueConstraint(
+                fields=("make_key", "model_key"), name="unique car name"
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="catalogueentry",
+            constraint=models.UniqueConstraint(
+                fields=("make_key", "model_key"), name="unique catalogue entry"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="carranking",
+            index=models.Index(fields=["-score", "-car"], name="carranking_score_idx"),
+        ),
+        migrations.AddField(
+            model_name="carjob",
+            name="car",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                to="cars.car",
+            ),
+        ),
+        migrations.AddField(
+            model_name="carjob",
+            name="created_by",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                to=settings.AUTH_USER_MODEL,
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="carjob",
+            index=models.Index(
+                fields=["status", "run_after"], name="carjob_status_idx"
+            ),
+        ),
+    ]
@@ -1,16 +1,165 @@
+from django.conf import settings
 from django.db import models
+from django.utils import timezone
+
+from .fields import NormalizedNameField
 
 
 class Car(models.Model):
     make_name = models.CharField(max_length=25)
     model_name = models.CharField(max_length=40)
+    # Case and whitespace insensitive names, for uniqueness and GET /cars/search.
+    # On PostgreSQL db_index adds varchar_pattern_ops index used by prefix search,
+    # trigram indexes are created by cars.signals.create_trigram_indexes
+    make_key = NormalizedNameField(max_length=100, source="make_name", db_index=True)
+    model_key = NormalizedNameField(max_length=100, source="model_name", db_index=True)
+
+    # Denormalized rating aggregates, maintained by rate.utils.record_ratings
+    rating_qty = models.PositiveIntegerField(default=0)
+    rating_sum = models.PositiveIntegerField(default=0)
+    average_rate = models.FloatField(default=0)
+    stars_1 = models.PositiveIntegerField(default=0)
+    stars_2 = models.PositiveIntegerField(default=0)
+    stars_3 = models.PositiveIntegerField(default=0)
+    stars_4 = models.PositiveIntegerField(default=0)
+    stars_5 = models.PositiveIntegerField(default=0)
+    # Time of the latest rating, Last-Modified of GET /cars/<id>
+    last_rated_at = models.DateTimeField(null=True, blank=True)
+    # Time the aggregates were last written. Unlike last_rated_at it isn't
+    # backdated by ratings stored late (write-behind flushes)
+    aggregated_at = models.DateTimeField(null=True, blank=True)
 
     class Meta:
         constraints = [
             models.UniqueConstraint(
-                fields=["make_name", "model_name"], name="unique car name"
+                fields=["make_key", "model_key"], name="unique car name"
             )
         ]
+        indexes = [
+            # Orderings (and keyset pagination) of GET /cars and GET /popular
+            models.Index(fields=["-average_rate", "-id"], name="car_average_rate_idx"),
+            models.Index(fields=["-rating_qty", "-id"], name="car_rating_qty_idx"),
+        ]
 
     def __str__(self) -> str:
         return f"{self.make_name} {self.model_name}"
+
+    @property
+    def histogram(self) -> dict:
+        return {star: getattr(self, f"stars_{star}") for star in range(1, 6)}
+
+
+class CatalogueEntry(models.Model):
+    """
+    Make/model pair known to vPIC, imported by import_vpic_catalogue command
+    so cars can be validated without calling external api
+    """
+
+    make_id = models.PositiveIntegerField(null=True, blank=True)
+    make_name = models.CharField(max_length=100)
+    model_id = models.PositiveIntegerField(null=True, blank=True)
+    model_name = models.CharField(max_length=100)
+    make_key = NormalizedNameField(max_length=100, source="make_name")
+    model_key = NormalizedNameField(max_length=100, source="model_name")
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["make_key", "model_key"], name="unique catalogue entry"
+            )
+        ]
+        verbose_name_plural = "catalogue entries"
+
+    def __str__(self) -> str:
+        return f"{self.make_name} {self.model_name}"
+
+    def as_vpic_result(self) -> dict:
+        """
+        Same shape as item of vPIC GetModelsForMake results
+        """
+        return {
+            "Make_ID": self.make_id,
+            "Make_Name": self.make_name,
+            "Model_ID": self.model_id,
+            "Model_Name": self.model_name,
+        }
+
+
+class CarJob(models.Model):
+    """
+    Pending car creation, verified against external api by process_car_jobs worker
+    """
+
+    PENDING = "pending"
+    RUNNING = "running"
+    CREATED = "created"
+    REJECTED = "rejected"
+    FAILED = "failed"
+    STATUS_CHOICES = [
+        (PENDING, "Pending"),
+        (RUNNING, "Running"),
+        (CREATED, "Created"),
+        (REJECTED, "Rejected"),
+        (FAILED, "Failed"),
+    ]
+
+    make_name = models.CharField(max_length=25)
+    model_name = models.CharField(max_length=40)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    car = models.ForeignKey(Car, null=True, blank=True, on_delete=models.SET_NULL)
+    error = models.TextField(blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    # Pending job isn't picked up before this time, used to back off after api errors
+    run_after = models.DateTimeField(default=timezone.now)
+    # Set when claimed by a worker, running jobs with old lock are claimed again
+    locked_at = models.DateTimeField(null=True, blank=True)
+    created_by = models.ForeignKey(
+        settings.AUTH_USER_MODEL, null=True, blank=True, on_delete=models.CASCADE
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["status", "run_after"], name="carjob_status_idx"),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.make_name} {self.model_name}: {self.status}"
+
+
+class CarRanking(models.Model):
+    """
+    Confidence weighted (Bayesian average) score of a car, ordering of GET /cars?order=score.
+    Rebuilt by recompute_rankings command, kept up to date by new ratings in between.
+    """
+
+    car = models.OneToOneField(
+        Car, primary_key=True, on_delete=models.CASCADE, related_name="ranking"
+    )
+    score = models.FloatField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["-score", "-car"], name="carranking_score_idx"),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.car_id}: {self.score:.3f}"
+
+
+class RankingRun(models.Model):
+    """
+    Full recompute of car rankings with prior it used, the latest prior
+    scores ratings added until the next run
+    """
+
+    prior_mean = models.FloatField()
+    prior_weight = models.FloatField()
+    car_qty = models.PositiveIntegerField()
+    # Seconds spent on the recompute
+    duration = models.FloatField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self) -> str:
+        return f"{self.created_at:%Y-%m-%d %H:%M}: {self.car_qty} cars"
@@ -0,0 +1,136 @@
+import base64
+import json
+import math
+from typing import Optional, Sequence
+
+from django.conf import settings
+from django.db.models import Q, QuerySet
+from rest_framework.exceptions import ValidationError
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+# Range of 64-bit integer columns, larger values overflow database drivers
+MAX_CURSOR_INT = 2 ** 63 - 1
+
+
+def is_cursor_number(value) -> bool:
+    if isinstance(value, bool):
+        return False
+    if isinstance(value, int):
+        return abs(value) <= MAX_CURSOR_INT
+    return isinstance(value, float) and math.isfinite(value)
+
+
+class KeysetPagination:
+    """
+    Cursor pagination over (ordering field, id) in descending order, backed by
+    composite index on both columns, so every page costs the same regardless of depth.
+
+    Body stays a plain list, link to the next page is sent in "Link" header.
+    Without limit (and CARS_PAGE_DEFAULT_LIMIT unset) whole list is returned.
+    """
+
+    limit_query_param = "limit"
+    cursor_query_param = "cursor"
+    fields_query_param = "fields"
+
+    def __init__(self, ordering: str, fields: Sequence[str]) -> None:
+        self.ordering = ordering
+        self.fields = list(fields)
+        self.next_cursor: Optional[str] = None
+        self.request: Optional[Request] = None
+
+    def get_limit(self, request: Request) -> Optional[int]:
+        limit = request.query_params.get(self.limit_query_param)
+        if limit is None:
+            return settings.CARS_PAGE_DEFAULT_LIMIT
+        try:
+            limit = int(limit)
+        except ValueError:
+            raise ValidationError({self.limit_query_param: "Expected integer"})
+        if limit < 1:
+            raise ValidationError({self.limit_query_param: "Expected positive integer"})
+        return min(limit, settings.CARS_PAGE_MAX_LIMIT)
+
+    def get_fields(self, request: Request) -> list:
+        fields = request.query_params.get(self.fields_query_param)
+        if not fields:
+            return self.fields
+        fields = [field.strip() for field in fields.split(",") if field.strip()]
+        unknown = set(fields) - set(self.fields)
+        if unknown:
+            raise ValidationError(
+                {
+                    self.fields_query_param: f"Unknown fields: {', '.join(sorted(unknown))}"
+                }
+            )
+        return fields
+
+    def decode_cursor(self, cursor: str) -> tuple:
+        try:
+            value, pk = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        except (TypeError, ValueError):
+            raise ValidationError({self.cursor_query_param: "Invalid cursor"})
+        # Ordering fields are never null, cursors only hold numbers the database can compare
+        if not (
+            is_cursor_number(value) and is_cursor_number(pk) and isinstance(pk, int)
+        ):
+            raise ValidationError({self.cursor_query_param: "Invalid cursor"})
+        return value, pk
+
+    @staticmethod
+    def encode_cursor(value, pk: int) -> str:
+        return base64.urlsafe_b64encode(json.dumps([value, pk]).encode()).decode()
+
+    def paginate_queryset(
+        self, queryset: QuerySet, request: Request, limit: Optional[int] = None
+    ) -> list:
+        """
+        Return requested page as list of dicts, explicit limit disables next page link
+        """
+        self.request = request
+        fields = self.get_fields(request)
+        paginated = limit is None
+        if paginated:
+            limit = self.get_limit(request)
+
+        queryset = queryset.order_by(f"-{self.ordering}", "-id")
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            value, pk = self.decode_cursor(cursor)
+            queryset = queryset.filter(
+                Q(**{f"{self.ordering}__lt": value})
+                | Q(**{self.ordering: value, "id__lt": pk})
+            )
+
+        if limit is None:
+            return list(queryset.values(*fields))
+
+        # Cursor is built from ordering field and id, even if they are not requested
+        extra = [key for key in ("id", self.ordering) if key not in fields]
+        rows = list(queryset.values(*fields, *extra)[: limit + 1])
+        if paginated and len(rows) > limit:
+            last = rows[limit - 1]
+            self.next_cursor = self.encode_cursor(last[self.ordering], last["id"])
+        rows = rows[:limit]
+        for row in rows:
+            for key in extra:
+                del row[key]
+        return rows
+
+    def get_next_link(self) -> Optional[str]:
+        if self.next_cursor is None:
+            return None
+        return replace_query_param(
+            self.request.build_absolute_uri(),
+            self.cursor_query_param,
+            self.next_cursor,
+        )
+
+    def get_paginated_response(self, data: list) -> Response:
+        headers = {}
+        next_link = self.get_next_link()
+        if next_link:
+            headers["Link"] = f'<{next_link}>; rel="next"'
+        return Response(data, headers=headers)
@@ -0,0 +1,182 @@
+"""
+Confidence weighted ranking of cars (CarRanking table) served by GET /cars?order=score.
+
+Score of a car is its average rating pulled towards the mean of all ratings,
+(w * m + rating_sum) / (w + rating_qty), so a single 5 star rating doesn't
+outrank thousands of 4.9 averages. recompute_rankings scores every car at once
+with NumPy from per car aggregates. New cars and new ratings score their car
+right away, using the prior of the last recompute.
+"""
+import time
+from datetime import timedelta
+from itertools import chain
+from typing import Iterable, Tuple
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, connections, router, transaction
+from django.db.models import ExpressionWrapper, FloatField, OuterRef, Subquery, Value
+from django.utils import timezone
+
+from .cache import invalidate_listings
+from .models import Car, CarRanking, RankingRun
+
+PRIOR_CACHE_KEY = "cars:ranking-prior"
+# Seconds workers keep using prior of the previous recompute (with per-process cache)
+PRIOR_CACHE_TIMEOUT = 60
+# Mean of the prior until rankings are computed for the first time
+DEFAULT_PRIOR_MEAN = 3.0
+# Aggregates written shortly before a recompute started may be committed only after
+# its load, in transactions running meanwhile, so such cars are rescored as well
+RESCORE_OVERLAP = timedelta(minutes=1)
+
+
+def bayesian_scores(
+    counts: np.ndarray, sums: np.ndarray, prior_mean: float, prior_weight: float
+) -> np.ndarray:
+    return (prior_weight * prior_mean + sums) / (prior_weight + counts)
+
+
+def get_ranking_prior() -> Tuple[float, float]:
+    """
+    (mean, weight) of the last recompute
+    """
+    prior = cache.get(PRIOR_CACHE_KEY)
+    if prior is None:
+        run = RankingRun.objects.order_by("-id").first()
+        if run is None:
+            return DEFAULT_PRIOR_MEAN, settings.RANKING_PRIOR_WEIGHT
+        prior = (run.prior_mean, run.prior_weight)
+        cache.set(PRIOR_CACHE_KEY, prior, PRIOR_CACHE_TIMEOUT)
+    return prior
+
+
+def score_expression(prior_mean: float, prior_weight: float):
+    """
+    Score of CarRanking row's car computed in SQL from the car's current aggregates
+    """
+    car = Car.objects.filter(pk=OuterRef("car_id"))
+    return ExpressionWrapper(
+        (Value(prior_weight * prior_mean) + Subquery(car.values("rating_sum")))
+        / (Value(prior_weight) + Subquery(car.values("rating_qty"))),
+        output_field=FloatField(),
+    )
+
+
+def update_car_score(car_id: int) -> None:
+    """
+    Rescore a car after its aggregates changed, one UPDATE for ranked cars
+    """
+    prior_mean, prior_weight = get_ranking_prior()
+    ranking = CarRanking.objects.filter(car_id=car_id)
+    if ranking.update(score=score_expression(prior_mean, prior_weight)):
+        return
+    qty, total = Car.objects.values_list("rating_qty", "rating_sum").get(pk=car_id)
+    score = (prior_weight * prior_mean + total) / (prior_weight + qty)
+    try:
+        # Savepoint, losing the race for the first score doesn't break the transaction
+        with transaction.atomic():
+            CarRanking.objects.create(car_id=car_id, score=score)
+    except IntegrityError:
+        ranking.update(score=score_expression(prior_mean, prior_weight))
+
+
+def rank_new_cars(car_ids: Iterable[int]) -> None:
+    """
+    Score just created cars, so they are listed by order=score before the next
+    recompute. Cars created with ORM save are ranked by cars.signals, call it
+    after bulk_create
+    """
+    prior_mean, prior_weight = get_ranking_prior()
+    CarRanking.objects.bulk_create(
+        [
+            CarRanking(
+                car_id=car_id,
+                score=(prior_weight * prior_mean + total) / (prior_weight + qty),
+            )
+            for car_id, qty, total in Car.objects.filter(pk__in=car_ids).values_list(
+                "id", "rating_qty", "rating_sum"
+            )
+        ],
+        ignore_conflicts=True,
+    )
+
+
+def load_rating_arrays() -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Ids (ascending), rating counts and rating sums of every car, streamed into flat arrays
+    """
+    rows = (
+        Car.objects.order_by("id")
+        .values_list("id", "rating_qty", "rating_sum")
+        .iterator(chunk_size=settings.CARS_EXPORT_CHUNK_SIZE)
+    )
+    data = np.fromiter(chain.from_iterable(rows), dtype=np.int64).reshape(-1, 3)
+    return data[:, 0], data[:, 1], data[:, 2]
+
+
+def upsert_scores(car_ids: list, scores: list) -> None:
+    """
+    Insert or replace scores with multi-row INSERT ... ON CONFLICT statements
+    (PostgreSQL and SQLite 3.24+), as many rows per statement as the database takes
+    """
+    connection = connections[router.db_for_write(CarRanking)]
+    table = connection.ops.quote_name(CarRanking._meta.db_table)
+    step = connection.ops.bulk_batch_size(["car_id", "score"], car_ids)
+    with connection.cursor() as cursor:
+        for start in range(0, len(car_ids), step):
+            rows = list(
+                zip(car_ids[start : start + step], scores[start : start + step])
+            )
+            cursor.execute(
+                f"INSERT INTO {table} (car_id, score) VALUES "
+                + ", ".join(["(%s, %s)"] * len(rows))
+                + " ON CONFLICT (car_id) DO UPDATE SET score = EXCLUDED.score",
+                list(chain.from_iterable(rows)),
+            )
+
+
+def recompute_rankings(batch_size: int) -> Tuple[RankingRun, dict]:
+    """
+    Score every car and store the scores, returns the run and seconds spent per
+    phase (load, score, store).
+
+    Scores are upserted in batches of batch_size cars, each in its own short
+    transaction, so ratings of other cars aren't blocked while the table is written.
+    Rows of deleted cars are deleted along with them.
+    """
+    timings = {}
+    started = time.perf_counter()
+    started_at = timezone.now()
+    ids, counts, sums = load_rating_arrays()
+    timings["load"] = time.perf_counter() - started
+
+    phase = time.perf_counter()
+    rating_qty = int(counts.sum())
+    prior_mean = float(sums.sum()) / rating_qty if rating_qty else DEFAULT_PRIOR_MEAN
+    prior_weight = settings.RANKING_PRIOR_WEIGHT
+    scores = bayesian_scores(counts, sums, prior_mean, prior_weight)
+    timings["score"] = time.perf_counter() - phase
+
+    phase = time.perf_counter()
+    # New prior first, ratings arriving meanwhile are scored with it as well
+    run = RankingRun.objects.create(
+        prior_mean=prior_mean, prior_weight=prior_weight, car_qty=len(ids), duration=0
+    )
+    cache.set(PRIOR_CACHE_KEY, (prior_mean, prior_weight), PRIOR_CACHE_TIMEOUT)
+    for start in range(0, len(ids), batch_size):
+        batch_ids = ids[start : start + batch_size].tolist()
+        with transaction.atomic():
+            upsert_scores(batch_ids, scores[start : start + batch_size].tolist())
+            # Cars whose aggregates changed since they were loaded
+            CarRanking.objects.filter(
+                car__id__range=(batch_ids[0], batch_ids[-1]),
+                car__aggregated_at__gte=started_at - RESCORE_OVERLAP,
+            ).update(score=score_expression(prior_mean, prior_weight))
+    invalidate_listings()
+    timings["store"] = time.perf_counter() - phase
+
+    run.duration = time.perf_counter() - started
+    run.save(update_fields=["duration"])
+    return run, timings
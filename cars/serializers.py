@@ -1,9 +1,44 @@
 from rest_framework import serializers
 
-from .models import Car
+from .models import Car, CarJob
 
 
 class CarSerializer(serializers.ModelSerializer):
     class Meta:
         model = Car
         fields = ["id", "make_name", "model_name"]
+
+
+class CarDetailSerializer(serializers.ModelSerializer):
+    """
+    Car with its rating summary, read from denormalized aggregates
+    """
+
+    histogram = serializers.ReadOnlyField()
+
+    class Meta:
+        model = Car
+        fields = [
+            "id",
+            "make_name",
+            "model_name",
+            "average_rate",
+            "rating_qty",
+            "histogram",
+            "last_rated_at",
+        ]
+
+
+class CarJobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = CarJob
+        fields = [
+            "id",
+            "status",
+            "make_name",
+            "model_name",
+            "car",
+            "error",
+            "created_at",
+            "updated_at",
+        ]
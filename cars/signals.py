@@ -0,0 +1,44 @@
+from django.conf import settings
+from django.db import connections
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .cache import invalidate_listings
+from .models import Car
+from .ranking import rank_new_cars
+
+
+@receiver(post_save, sender=Car)
+@receiver(post_delete, sender=Car)
+def car_changed(sender, **kwargs):
+    invalidate_listings()
+
+
+@receiver(post_save, sender=Car)
+def car_created(sender, instance, created, **kwargs):
+    if created:
+        rank_new_cars([instance.pk])
+
+
+# GIN indexes backing fuzzy matching of GET /cars/search, PostgreSQL only
+TRIGRAM_INDEXES = {
+    "car_make_key_trgm_idx": "make_key",
+    "car_model_key_trgm_idx": "model_key",
+}
+
+
+def create_trigram_indexes(using, **kwargs):
+    """
+    post_migrate handler, there is no portable way to declare these in Car.Meta
+    """
+    connection = connections[using]
+    # Without fuzzy search the extension (which may not be installed) isn't needed
+    if connection.vendor != "postgresql" or not settings.CARS_SEARCH_FUZZY:
+        return
+    with connection.cursor() as cursor:
+        cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        for name, column in TRIGRAM_INDEXES.items():
+            cursor.execute(
+                f"CREATE INDEX IF NOT EXISTS {name} ON {Car._meta.db_table} "
+                f"USING gin ({column} gin_trgm_ops)"
+            )
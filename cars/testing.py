@@ -0,0 +1,71 @@
+"""
+Stand-in for vPIC GetModelsForMake endpoint, used by tests and benchmarks
+"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote, urlparse
+
+
+class StubVPICHandler(BaseHTTPRequestHandler):
+    """
+    Serves responses queued on the server as (status, body, delay), repeating
+    the last one. Body can be a function of the requested make.
+    """
+
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately, don't let Nagle delay the body
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        server = self.server
+        make = unquote(urlparse(self.path).path.rsplit("/", 1)[-1])
+        with server.lock:
+            server.paths.append(self.path)
+            status_code, body, delay = (
+                server.responses.pop(0)
+                if len(server.responses) > 1
+                else server.responses[0]
+            )
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+        time.sleep(delay)
+        with server.lock:
+            server.in_flight -= 1
+        payload = json.dumps(body(make) if callable(body) else body).encode()
+        self.send_response(status_code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        try:
+            self.wfile.write(payload)
+        except ConnectionError:
+            pass  # client gave up waiting, e.g. read timeout
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubVPICServer(ThreadingHTTPServer):
+    """
+    Stub api server, keeps requested paths and the most requests handled at once
+    """
+
+    def __init__(self, address, responses: list) -> None:
+        super().__init__(address, StubVPICHandler)
+        self.responses = responses
+        self.paths = []
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+
+def start_stub_vpic(responses: list, port: int = 0) -> StubVPICServer:
+    """
+    Serve stub api on localhost from a daemon thread, call shutdown() and
+    server_close() on returned server to stop it
+    """
+    server = StubVPICServer(("127.0.0.1", port), responses)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -1,12 +1,49 @@
+import asyncio
+import base64
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+from datetime import timedelta
 from unittest import mock
 
+from asgiref.sync import async_to_sync
 from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError
+from django.test import RequestFactory, SimpleTestCase, override_settings
 from django.urls import reverse
+from django.utils import timezone
+from django.utils.http import http_date
 from rest_framework import status
+from rest_framework.authtoken.models import Token
 from rest_framework.test import APITestCase
 
-from .models import Car
-from .utils import ResponseData
+from api_cars.db import is_pinned
+from rate.models import RateDailyStats
+from rate.utils import record_ratings
+
+from . import ranking
+from .jobs import enqueue_car_job
+from .models import Car, CarJob, CarRanking, CatalogueEntry
+from .testing import start_stub_vpic
+from .utils import (
+    CatalogueData,
+    ResponseData,
+    acall_external_car_api,
+    async_catalogue_flights,
+    call_external_car_api,
+    catalogue_cache_key,
+    catalogue_flights,
+    catalogue_stats,
+    get_async_vpic_client,
+    get_models_for_make,
+    get_vpic_client,
+)
+from .views import car_create_async
 
 
 class CarAPITests(APITestCase):
@@ -160,6 +197,318 @@ class CarAPITests(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+class CarPaginationTests(APITestCase):
+    def setUp(self) -> None:
+        """
+        Auxiliary test objects and functions
+        """
+        self.cars = [
+            Car.objects.create(
+                make_name="test",
+                model_name=f"car {i}",
+                average_rate=rate,
+                rating_qty=qty,
+            )
+            for i, (rate, qty) in enumerate([(5, 1), (3, 7), (3, 2), (1, 9), (0, 0)])
+        ]
+        test_user = User.objects.create_user(username="foo")  # Used for bearer auth
+        self.client.force_authenticate(user=test_user)
+
+    def fetch_all_pages(self, url):
+        pages = []
+        while url:
+            response = self.client.get(url, format="json")
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            pages.append(response.json())
+            url = response.get("Link", "").partition(">")[0].lstrip("<")
+        return pages
+
+    def test_car_get_pages(self):
+        """
+        Positive test case
+        Following next links visits every car once in average_rate order
+        """
+        pages = self.fetch_all_pages(reverse("cars-list") + "?limit=2&fields=id")
+        self.assertEqual([len(page) for page in pages], [2, 2, 1])
+        self.assertEqual(
+            [car["id"] for page in pages for car in page],
+            [self.cars[i].id for i in (0, 2, 1, 3, 4)],
+        )
+        self.assertDictEqual({"id": self.cars[0].id}, pages[0][0])
+
+    def test_car_popular_pages(self):
+        """
+        Positive test case
+        Following next links visits every car once in rating_qty order
+        """
+        pages = self.fetch_all_pages(reverse("cars-popular") + "?limit=3")
+        self.assertEqual(
+            [car["rating_qty"] for page in pages for car in page], [9, 7, 2, 1, 0]
+        )
+
+    def test_car_popular_top(self):
+        """
+        Positive test case
+        Top mode returns N most popular cars without next link
+        """
+        response = self.client.get(reverse("cars-popular") + "?top=2", format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn("Link", response)
+        self.assertEqual(
+            [car["id"] for car in response.json()], [self.cars[3].id, self.cars[1].id]
+        )
+
+    def test_car_popular_invalid_top(self):
+        """
+        Negative test case
+        Top which is not a positive integer should result in 400_BAD_REQUEST
+        """
+        for top in ("0", "x", "\u00b2"):
+            response = self.client.get(reverse("cars-popular"), {"top": top})
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_car_get_invalid_params(self):
+        """
+        Negative test case
+        Unknown fields, bad limit or cursor should result in 400_BAD_REQUEST
+        """
+        for query in ("fields=id,password", "limit=0", "limit=x", "cursor=abc"):
+            response = self.client.get(f"{reverse('cars-list')}?{query}", format="json")
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        # Decodable cursors with values of wrong types or out of integer range
+        for value in (
+            [None, 1],
+            ["abc", 1],
+            [1, "x"],
+            [1, 1.5],
+            [1, 2 ** 64],
+            [True, 1],
+        ):
+            cursor = base64.urlsafe_b64encode(json.dumps(value).encode()).decode()
+            for order in ("", "&order=score"):
+                response = self.client.get(
+                    f"{reverse('cars-list')}?cursor={cursor}{order}", format="json"
+                )
+                self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class CarRankingTests(APITestCase):
+    def setUp(self) -> None:
+        """
+        Auxiliary test objects and functions
+        """
+        self.cars = [
+            Car.objects.create(
+                make_name="test",
+                model_name=f"car {i}",
+                rating_qty=qty,
+                rating_sum=total,
+                average_rate=total / qty if qty else 0,
+            )
+            for i, (qty, total) in enumerate([(1, 5), (100, 490), (0, 0), (4, 8)])
+        ]
+        test_user = User.objects.create_user(username="foo")  # Used for bearer auth
+        self.client.force_authenticate(user=test_user)
+        self.url = reverse("cars-list") + "?order=score"
+
+    def recompute(self):
+        out = io.StringIO()
+        call_command("recompute_rankings", stdout=out)
+        return out.getvalue()
+
+    def test_cars_ordered_by_score(self):
+        """
+        Positive test case
+        Many high ratings outrank a single 5 star one, pages follow precomputed order
+        """
+        self.assertIn("Ranked 4 car(s)", self.recompute())
+
+        response = self.client.get(self.url, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [car["id"] for car in response.json()],
+            [self.cars[i].id for i in (1, 0, 2, 3)],
+        )
+        # Prior mean of all 503 stars in 105 ratings, weight 10
+        self.assertAlmostEqual(response.json()[1]["score"], (10 * 503 / 105 + 5) / 11)
+
+        response = self.client.get(self.url + "&limit=3&fields=id", format="json")
+        next_page = response["Link"].partition(">")[0].lstrip("<")
+        response = self.client.get(next_page, format="json")
+        self.assertEqual(response.json(), [{"id": self.cars[3].id}])
+
+    def test_rating_updates_score(self):
+        """
+        Positive test case
+        New rating rescores its car right away, also one not ranked yet
+        """
+        self.recompute()
+        new_car = Car.objects.create(make_name="test", model_name="new car")
+        for car in (self.cars[2], new_car):
+            response = self.client.post(
+                reverse("rate-car"), {"car": car.pk, "rating": 1}, format="json"
+            )
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        prior_mean = 503 / 105
+        for car in (self.cars[2], new_car):
+            self.assertAlmostEqual(
+                CarRanking.objects.get(car=car).score, (10 * prior_mean + 1) / 11
+            )
+
+    def test_new_car_ranked_on_creation(self):
+        """
+        Positive test case
+        Cars created after the last recompute are listed right away, with prior mean score,
+        recompute in small batches rescores all of them
+        """
+        self.recompute()
+        new_car = Car.objects.create(make_name="test", model_name="new car")
+        response = self.client.get(self.url, format="json")
+        scores = {car["id"]: car["score"] for car in response.json()}
+        self.assertAlmostEqual(scores[new_car.id], 503 / 105)
+
+        self.cars[1].delete()
+        call_command("recompute_rankings", batch_size=2, stdout=io.StringIO())
+        self.assertEqual(CarRanking.objects.count(), 4)
+        self.assertAlmostEqual(
+            CarRanking.objects.get(car=self.cars[0]).score, (10 * 13 / 5 + 5) / 11
+        )
+
+    def test_recompute_rescores_late_ratings(self):
+        """
+        Positive test case
+        Rating stored while recompute runs is kept in the score, also when it
+        is backdated (flushed from write-behind buffer)
+        """
+        load_rating_arrays = ranking.load_rating_arrays
+
+        def load_then_rate():
+            arrays = load_rating_arrays()
+            record_ratings(
+                self.cars[2].pk, [1], rated_at=timezone.now() - timedelta(days=1)
+            )
+            return arrays
+
+        with mock.patch("cars.ranking.load_rating_arrays", side_effect=load_then_rate):
+            self.recompute()
+        self.assertAlmostEqual(
+            CarRanking.objects.get(car=self.cars[2]).score, (10 * 503 / 105 + 1) / 11
+        )
+
+    def test_invalid_order(self):
+        """
+        Negative test case
+        Unknown order should result in 400_BAD_REQUEST
+        """
+        response = self.client.get(reverse("cars-list") + "?order=name", format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class CarListingCacheTests(APITestCase):
+    def setUp(self) -> None:
+        """
+        Auxiliary test objects and functions
+        """
+        self.test_car = Car.objects.create(make_name="test", model_name="car")
+        test_user = User.objects.create_user(username="foo")  # Used for bearer auth
+        self.client.force_authenticate(user=test_user)
+
+    def test_listing_served_from_cache(self):
+        """
+        Positive test case
+        Repeated request is answered without touching database
+        """
+        for url in (reverse("cars-list"), reverse("cars-popular") + "?top=1"):
+            first = self.client.get(url, format="json")
+            with self.assertNumQueries(0):
+                second = self.client.get(url, format="json")
+            self.assertEqual(first.content, second.content)
+            self.assertEqual(first["ETag"], second["ETag"])
+
+    def test_listing_not_modified(self):
+        """
+        Positive test case
+        Client sending current ETag gets 304_NOT_MODIFIED without body
+        """
+        url = reverse("cars-list")
+        etag = self.client.get(url, format="json")["ETag"]
+        response = self.client.get(url, format="json", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response.content, b"")
+
+    def test_listing_cached_per_origin(self):
+        """
+        Positive test case
+        Pagination links of a cached listing point to the scheme and host it was requested on
+        """
+        Car.objects.create(make_name="other", model_name="car")
+        url = reverse("cars-list") + "?limit=1"
+        self.client.get(url, format="json")
+        for secure, host in ((True, "testserver"), (False, "localhost")):
+            response = self.client.get(
+                url, format="json", secure=secure, HTTP_HOST=host
+            )
+            scheme = "https" if secure else "http"
+            self.assertIn(f"<{scheme}://{host}/cars?", response["Link"])
+
+    def test_listing_invalidated_by_rate(self):
+        """
+        Positive test case
+        New rating makes cached listings stale
+        """
+        url = reverse("cars-list")
+        etag = self.client.get(url, format="json")["ETag"]
+
+        data = {"car": self.test_car.id, "rating": 4}
+        self.client.post(reverse("rate-car"), data, format="json")
+
+        response = self.client.get(url, format="json", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertEqual(response.json()[0]["average_rate"], 4)
+
+
+class CarExportAPITests(APITestCase):
+    def setUp(self) -> None:
+        """
+        Auxiliary test objects and functions
+        """
+        self.url = reverse("cars-export")
+        test_user = User.objects.create_user(username="foo")  # Used for bearer auth
+        self.client.force_authenticate(user=test_user)
+
+    def export(self, query=""):
+        response = self.client.get(self.url + query)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        return b"".join(response.streaming_content).decode()
+
+    @override_settings(CARS_EXPORT_CHUNK_SIZE=2)
+    def test_car_export(self):
+        """
+        Positive test case
+        Export streams same rows as GET /cars, as JSON array or NDJSON
+        """
+        self.assertEqual(json.loads(self.export()), [])
+
+        for i in range(5):
+            Car.objects.create(make_name="test", model_name=f"car {i}", average_rate=i)
+        expected = self.client.get(reverse("cars-list"), format="json").json()
+
+        self.assertEqual(json.loads(self.export()), expected)
+        lines = self.export("?output=ndjson").splitlines()
+        self.assertEqual([json.loads(line) for line in lines], expected)
+
+    def test_car_export_invalid_output(self):
+        """
+        Negative test case
+        Unknown output should result in 400_BAD_REQUEST
+        """
+        response = self.client.get(self.url + "?output=xml")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
 class CarPopularAPITests(APITestCase):
     def setUp(self) -> None:
         """
@@ -200,3 +549,908 @@ class CarPopularAPITests(APITestCase):
 
         response = self.client.get(self.url, format="json")
         self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_car_popular_window(self):
+        """
+        Positive test case
+        With window only ratings of its days count, cars without them are left out
+        """
+        other_car = Car.objects.create(make_name="other", model_name="car")
+        today = timezone.now().date()
+        RateDailyStats.objects.create(car=self.test_car, day=today, rating_qty=1)
+        RateDailyStats.objects.create(
+            car=self.test_car, day=today - timedelta(days=10), rating_qty=5
+        )
+        RateDailyStats.objects.create(
+            car=other_car, day=today - timedelta(days=6), rating_qty=2
+        )
+
+        response = self.client.get(self.url, {"window": "7d"}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [(car["id"], car["window_rating_qty"]) for car in response.json()],
+            [(other_car.id, 2), (self.test_car.id, 1)],
+        )
+
+        response = self.client.get(self.url, {"window": "7d", "limit": 1})
+        self.assertEqual([car["id"] for car in response.json()], [other_car.id])
+        next_url = response["Link"].split(";")[0].strip("<>")
+        response = self.client.get(next_url)
+        self.assertEqual([car["id"] for car in response.json()], [self.test_car.id])
+
+        response = self.client.get(self.url, {"window": "1d"}, format="json")
+        self.assertEqual([car["id"] for car in response.json()], [self.test_car.id])
+
+    def test_car_popular_invalid_window(self):
+        """
+        Negative test case
+        Window which is not a number of days should result in 400_BAD_REQUEST
+        """
+        for window in ("7", "0d", "1w", "10000d"):
+            response = self.client.get(self.url, {"window": window}, format="json")
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class CarStatsAPITests(APITestCase):
+    def setUp(self) -> None:
+        """
+        Auxiliary test objects and functions
+        """
+        self.test_car = Car.objects.create(make_name="test", model_name="car")
+        self.url = reverse("cars-stats", args=[self.test_car.id])
+        test_user = User.objects.create_user(username="foo")  # Used for bearer auth
+        self.client.force_authenticate(user=test_user)
+
+    def test_car_stats(self):
+        """
+        Positive test case
+        All time stats come from car aggregates, windowed ones from rollups of window days
+        """
+        for rating in (5, 5, 1):
+            self.client.post(
+                reverse("rate-car"), {"car": self.test_car.id, "rating": rating}
+            )
+        RateDailyStats.objects.create(
+            car=self.test_car,
+            day=timezone.now().date() - timedelta(days=7),
+            rating_qty=1,
+            rating_sum=3,
+            stars_3=1,
+        )
+
+        data = self.client.get(self.url, format="json").json()
+        self.assertEqual(data["rating_qty"], 3)
+        self.assertAlmostEqual(data["average_rate"], 11 / 3)
+        self.assertEqual(data["histogram"], {"1": 1, "2": 0, "3": 0, "4": 0, "5": 2})
+
+        data = self.client.get(self.url, {"window": "7d"}, format="json").json()
+        self.assertEqual(data["window"], "7d")
+        self.assertEqual(data["rating_qty"], 3)
+
+        data = self.client.get(self.url, {"window": "8d"}, format="json").json()
+        self.assertEqual(data["rating_qty"], 4)
+        self.assertAlmostEqual(data["average_rate"], 14 / 4)
+        self.assertEqual(data["histogram"], {"1": 1, "2": 0, "3": 1, "4": 0, "5": 2})
+
+    def test_car_stats_not_found(self):
+        """
+        Negative test case
+        Stats of not existing car, also one with id out of database range, should
+        result in 404_NOT_FOUND
+        """
+        for pk in (self.test_car.id + 1, 99999999999999999999):
+            response = self.client.get(reverse("cars-stats", args=[pk]))
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class CarDetailAPITests(APITestCase):
+    def setUp(self) -> None:
+        """
+        Auxiliary test objects and functions
+        """
+        self.test_car = Car.objects.create(make_name="test", model_name="car")
+        self.url = reverse("cars-detail", args=[self.test_car.id])
+        test_user = User.objects.create_user(username="foo")  # Used for bearer auth
+        self.client.force_authenticate(user=test_user)
+
+    def rate(self, rating):
+        data = {"car": self.test_car.id, "rating": rating}
+        response = self.client.post(reverse("rate-car"), data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def test_car_detail(self):
+        """
+        Positive test case
+        Car comes with its rating summary and time of the latest rating
+        """
+        response = self.client.get(self.url, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(response.has_header("Last-Modified"))
+
+        self.rate(5)
+        self.rate(2)
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url, format="json")
+        data = response.json()
+        self.assertEqual(data["rating_qty"], 2)
+        self.assertEqual(data["average_rate"], 3.5)
+        self.assertEqual(data["histogram"], {"1": 0, "2": 1, "3": 0, "4": 0, "5": 1})
+        self.test_car.refresh_from_db()
+        self.assertEqual(
+            response["Last-Modified"],
+            http_date(self.test_car.last_rated_at.timestamp()),
+        )
+
+    def test_car_detail_conditional_get(self):
+        """
+        Positive test case
+        Unchanged car is answered with 304_NOT_MODIFIED until it's rated again
+        """
+        self.rate(5)
+        response = self.client.get(self.url, format="json")
+        etag, last_modified = response["ETag"], response["Last-Modified"]
+
+        response = self.client.get(self.url, format="json", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        response = self.client.get(
+            self.url, format="json", HTTP_IF_MODIFIED_SINCE=last_modified
+        )
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        self.rate(1)
+        response = self.client.get(self.url, format="json", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_car_detail_not_found(self):
+        """
+        Negative test case
+        Not existing car, also one with id out of database range, should result
+        in 404_NOT_FOUND
+        """
+        for pk in (self.test_car.id + 1, 99999999999999999999):
+            response = self.client.get(reverse("cars-detail", args=[pk]))
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_car_get_many(self):
+        """
+        Positive test case
+        Cars given by ids are returned in requested order, not existing ones left out
+        """
+        other_car = Car.objects.create(make_name="other", model_name="car")
+        ids = f"{other_car.id},{self.test_car.id + 100},{self.test_car.id}"
+        response = self.client.get(reverse("cars-list"), {"ids": ids}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.json()
+        self.assertEqual([car["id"] for car in data], [other_car.id, self.test_car.id])
+        self.assertEqual(data[0]["histogram"], {str(star): 0 for star in range(1, 6)})
+
+    def test_car_get_many_invalid_ids(self):
+        """
+        Negative test case
+        Ids which are not positive integers should result in 400_BAD_REQUEST
+        """
+        for ids in ("", "1,a", "0", "99999999999999999999", str(2 ** 31)):
+            response = self.client.get(reverse("cars-list"), {"ids": ids})
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class CarSearchAPITests(APITestCase):
+    def setUp(self) -> None:
+        """
+        Auxiliary test objects and functions
+        """
+        self.url = reverse("cars-search")
+        test_user = User.objects.create_user(username="foo")  # Used for bearer auth
+        self.client.force_authenticate(user=test_user)
+        self.model_s = Car.objects.create(
+            make_name="Tesla", model_name="Model S", rating_qty=1, average_rate=5
+        )
+        self.model_x = Car.objects.create(
+            make_name="Tesla", model_name="Model X", rating_qty=2
+        )
+        self.rover = Car.objects.create(make_name="Land Rover", model_name="Defender")
+
+    def search(self, **params):
+        response = self.client.get(self.url, params, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [car["id"] for car in response.json()]
+
+    def test_car_search(self):
+        """
+        Positive test case
+        Make, model or both prefixes match regardless of case, most rated first
+        """
+        self.assertEqual(self.search(q="TES"), [self.model_x.id, self.model_s.id])
+        self.assertEqual(self.search(q="model s"), [self.model_s.id])
+        self.assertEqual(
+            self.search(q="tesla  MODEL"), [self.model_x.id, self.model_s.id]
+        )
+        self.assertEqual(self.search(q="land rover def"), [self.rover.id])
+        self.assertEqual(self.search(q="tes", limit=1), [self.model_x.id])
+        self.assertEqual(self.search(q="audi"), [])
+
+        response = self.client.get(self.url, {"q": "model s"}, format="json")
+        self.assertDictEqual(
+            {
+                "id": self.model_s.id,
+                "make_name": "Tesla",
+                "model_name": "Model S",
+                "average_rate": 5,
+                "rating_qty": 1,
+            },
+            response.json()[0],
+        )
+
+    def test_car_search_invalid_params(self):
+        """
+        Negative test case
+        Missing phrase or invalid limit should result in 400_BAD_REQUEST
+        """
+        for params in (
+            {},
+            {"q": "  "},
+            {"q": "tesla", "limit": "0"},
+            {"q": "tesla", "limit": "\u00b2"},
+        ):
+            response = self.client.get(self.url, params, format="json")
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_car_names_case_insensitive_unique(self):
+        """
+        Negative test case
+        Car differing only in letter case or whitespace can't be added twice
+        """
+        with self.assertRaises(IntegrityError):
+            Car.objects.create(make_name="TESLA", model_name="model  s")
+
+
+class CarAsyncAPITests(APITestCase):
+    def setUp(self) -> None:
+        """
+        Auxiliary test objects and functions
+        """
+        test_user = User.objects.create_user(username="foo")
+        token = Token.objects.create(user=test_user)
+        self.auth_header = f"Bearer {token.key}"
+
+    def post(self, data, auth_header=None):
+        request = RequestFactory().post(
+            reverse("cars-async"),
+            data if isinstance(data, str) else json.dumps(data),
+            content_type="application/json",
+            HTTP_AUTHORIZATION=auth_header or self.auth_header,
+        )
+        # async_to_sync runs ORM calls of the view in this thread, inside test transaction
+        return async_to_sync(car_create_async)(request)
+
+    @mock.patch("cars.views.acall_external_car_api", new_callable=mock.AsyncMock)
+    def test_car_async_post(self, api_call_mock):
+        """
+        Positive test case
+        Car existing in external api is created, second time it's a conflict
+        """
+        car_data = {"make_name": "Tesla", "model_name": "Roadster"}
+        api_call_mock.return_value = ResponseData(
+            error="", status=status.HTTP_200_OK, data=[{"Model_ID": 2071}]
+        )
+
+        response = self.post(car_data)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        Car.objects.get(make_name="Tesla", model_name="Roadster")
+
+        response = self.post(car_data)
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+
+    @override_settings(DATABASE_REPLICAS=["default"])
+    @mock.patch("cars.views.acall_external_car_api", new_callable=mock.AsyncMock)
+    def test_car_async_post_pins_to_primary(self, api_call_mock):
+        """
+        Positive test case
+        Author of a created car reads from primary like after POST /cars
+        """
+        api_call_mock.return_value = ResponseData(
+            error="", status=status.HTTP_200_OK, data=[{"Model_ID": 2071}]
+        )
+        response = self.post({"make_name": "Tesla", "model_name": "Roadster"})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertTrue(is_pinned(User.objects.get(username="foo")))
+
+    @mock.patch("cars.views.acall_external_car_api", new_callable=mock.AsyncMock)
+    def test_car_async_post_not_found(self, api_call_mock):
+        """
+        Negative test case
+        Car missing in external api results in 404_NOT_FOUND
+        """
+        api_call_mock.return_value = ResponseData(
+            error="", status=status.HTTP_200_OK, data=[]
+        )
+        response = self.post({"make_name": "Tesla", "model_name": "abc456"})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_car_async_post_invalid_params(self):
+        """
+        Negative test case
+        Invalid keys or body should result in 400_BAD_REQUEST
+        """
+        response = self.post({"abc_name": "Tesla", "model_name": "Roadster"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.post("not json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_car_async_post_fail_auth(self):
+        """
+        Negative test case
+        Post with invalid token should result in 401_UNAUTHORIZED error
+        """
+        car_data = {"make_name": "Tesla", "model_name": "Roadster"}
+        response = self.post(car_data, auth_header="Bearer abc")
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class CarBulkAPITests(APITestCase):
+    def setUp(self) -> None:
+        """
+        Auxiliary test objects and functions
+        """
+        self.url = reverse("cars-bulk")
+        test_user = User.objects.create_user(username="foo")  # Used for bearer auth
+        self.client.force_authenticate(user=test_user)
+
+    @mock.patch("cars.utils.get_models_for_make")
+    def test_car_bulk_post(self, catalogue_mock):
+        """
+        Positive test case
+        Every make is looked up once, every item gets its own result
+        """
+        Car.objects.create(make_name="Tesla", model_name="Model S")
+        catalogue_mock.side_effect = lambda make: {
+            "Tesla": CatalogueData(
+                error="",
+                status=status.HTTP_200_OK,
+                models={"roadster": [{}], "model s": [{}]},
+            ),
+            "Audi": CatalogueData(
+                error="Server Error",
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                models={},
+            ),
+        }[make]
+        cars = [
+            {"make_name": "Tesla", "model_name": "Roadster"},
+            {"make_name": "Tesla", "model_name": "Model S"},
+            {"make_name": "Tesla", "model_name": "ROADSTER"},
+            {"make_name": "Tesla", "model_name": "abc456"},
+            {"make_name": "Audi", "model_name": "A4"},
+            {"abc_name": "Tesla"},
+            {"make_name": "TESLA", "model_name": "model  s"},
+        ]
+
+        response = self.client.post(self.url, cars, format="json")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(catalogue_mock.call_count, 2)
+
+        data = response.json()
+        self.assertEqual(data["created"], 1)
+        self.assertEqual(
+            [result["result"] for result in data["results"]],
+            [
+                "created",
+                "duplicate",
+                "duplicate",
+                "not_found",
+                "error",
+                "invalid",
+                "duplicate",
+            ],
+        )
+        roadster = Car.objects.get(make_name="Tesla", model_name="Roadster")
+        self.assertEqual(data["results"][0]["id"], roadster.id)
+        self.assertEqual(Car.objects.count(), 2)
+
+    def test_car_bulk_post_invalid_body(self):
+        """
+        Negative test case
+        Body which is not a list of cars should result in 400_BAD_REQUEST
+        """
+        car_data = {"make_name": "Tesla", "model_name": "Roadster"}
+        response = self.client.post(self.url, car_data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.client.post(self.url, [], format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_car_bulk_post_fail_auth(self):
+        """
+        Negative test case
+        Post without bearer token should result in 401_UNAUTHORIZED error
+        """
+        self.client.force_authenticate(user=None)
+        car_data = [{"make_name": "Tesla", "model_name": "Roadster"}]
+        response = self.client.post(self.url, car_data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class CarJobTests(APITestCase):
+    def setUp(self) -> None:
+        """
+        Auxiliary test objects and functions
+        """
+        self.url = reverse("cars-list")
+        self.test_user = User.objects.create_user(
+            username="foo"
+        )  # Used for bearer auth
+        self.client.force_authenticate(user=self.test_user)
+        self.tesla = CatalogueData(
+            error="", status=status.HTTP_200_OK, models={"roadster": [{}]}
+        )
+
+    def post_async(self, car_data):
+        return self.client.post(
+            self.url, car_data, format="json", HTTP_PREFER="respond-async"
+        )
+
+    @mock.patch("cars.utils.get_models_for_make")
+    @mock.patch("cars.views.call_external_car_api")
+    def test_car_post_async(self, api_mock, catalogue_mock):
+        """
+        Positive test case
+        Car is queued without external api call, worker creates it and job reports the car
+        """
+        catalogue_mock.return_value = self.tesla
+        car_data = {"make_name": "Tesla", "model_name": "Roadster"}
+
+        response = self.post_async(car_data)
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertFalse(api_mock.called)
+        self.assertFalse(Car.objects.exists())
+        job_url = reverse("cars-job", args=[response.json()["job"]])
+        self.assertEqual(response["Location"], job_url)
+        self.assertEqual(self.client.get(job_url).json()["status"], CarJob.PENDING)
+
+        call_command("process_car_jobs", once=True, stdout=io.StringIO())
+
+        car = Car.objects.get(make_name="Tesla", model_name="Roadster")
+        data = self.client.get(job_url).json()
+        self.assertEqual(data["status"], CarJob.CREATED)
+        self.assertEqual(data["car"], car.id)
+
+    @mock.patch("cars.utils.get_models_for_make")
+    def test_process_car_jobs_batches_by_make(self, catalogue_mock):
+        """
+        Positive test case
+        External api is asked once per make, unknown and repeated cars are rejected
+        """
+        catalogue_mock.return_value = self.tesla
+        for model in ("Roadster", "Roadster", "abc456"):
+            self.post_async({"make_name": "Tesla", "model_name": model})
+
+        call_command("process_car_jobs", once=True, stdout=io.StringIO())
+
+        self.assertEqual(catalogue_mock.call_count, 1)
+        self.assertEqual(
+            list(CarJob.objects.order_by("id").values_list("status", flat=True)),
+            [CarJob.CREATED, CarJob.REJECTED, CarJob.REJECTED],
+        )
+        self.assertEqual(Car.objects.count(), 1)
+
+    @mock.patch("cars.utils.get_models_for_make")
+    def test_process_car_jobs_api_error(self, catalogue_mock):
+        """
+        Negative test case
+        External api error puts the job back with a delay, until attempts run out
+        """
+        catalogue_mock.return_value = CatalogueData(
+            error="Server Error",
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            models={},
+        )
+        self.post_async({"make_name": "Tesla", "model_name": "Roadster"})
+
+        with self.settings(CARS_JOB_MAX_ATTEMPTS=2, CARS_JOB_RETRY_DELAY=0):
+            call_command("process_car_jobs", once=True, stdout=io.StringIO())
+
+        job = CarJob.objects.get()
+        self.assertEqual(job.status, CarJob.FAILED)
+        self.assertEqual(job.attempts, 2)
+        self.assertEqual(job.error, "Server Error")
+        self.assertFalse(Car.objects.exists())
+
+    def test_car_post_async_existing_car(self):
+        """
+        Negative test case
+        Car already present in database is rejected right away with 409_CONFLICT
+        """
+        Car.objects.create(make_name="Tesla", model_name="Roadster")
+        response = self.post_async({"make_name": "Tesla", "model_name": "Roadster"})
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertFalse(CarJob.objects.exists())
+
+    def test_car_job_other_user(self):
+        """
+        Negative test case
+        Jobs of other users and ids out of database range are not visible, 404_NOT_FOUND
+        """
+        job = CarJob.objects.create(make_name="Tesla", model_name="Roadster")
+        for pk in (job.pk, 99999999999999999999):
+            response = self.client.get(reverse("cars-job", args=[pk]))
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+TESLA_MODELS = {
+    "Results": [
+        {
+            "Make_ID": 441,
+            "Make_Name": "Tesla",
+            "Model_ID": 1685,
+            "Model_Name": "Model S",
+        },
+        {
+            "Make_ID": 441,
+            "Make_Name": "Tesla",
+            "Model_ID": 2071,
+            "Model_Name": "Roadster",
+        },
+    ]
+}
+
+
+class CatalogueImportTests(APITestCase):
+    def setUp(self) -> None:
+        """
+        Auxiliary test objects and functions
+        """
+        self.url = reverse("cars-list")
+        test_user = User.objects.create_user(username="foo")  # Used for bearer auth
+        self.client.force_authenticate(user=test_user)
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def write_file(self, name, content):
+        path = os.path.join(self.tmp.name, name)
+        with open(path, "w") as file:
+            file.write(content)
+        return path
+
+    def import_catalogue(self, path, **options):
+        call_command(
+            "import_vpic_catalogue",
+            path,
+            stdout=io.StringIO(),
+            stderr=io.StringIO(),
+            **options,
+        )
+
+    def test_import_json_and_csv(self):
+        """
+        Positive test case
+        Both vPIC JSON response and CSV dump are imported, repeated pairs only once
+        """
+        self.import_catalogue(self.write_file("tesla.json", json.dumps(TESLA_MODELS)))
+        self.import_catalogue(
+            self.write_file(
+                "audi.csv",
+                "Make_ID,Make_Name,Model_ID,Model_Name\n"
+                "482,Audi,3129,A4\n"
+                "441,TESLA, 2071 ,roadster\n"
+                ",Audi,,\n",
+            )
+        )
+
+        self.assertEqual(CatalogueEntry.objects.count(), 3)
+        entry = CatalogueEntry.objects.get(make_key="audi", model_key="a4")
+        self.assertEqual((entry.make_id, entry.model_id), (482, 3129))
+
+        self.import_catalogue(self.write_file("audi.json", "[]"), replace=True)
+        self.assertFalse(CatalogueEntry.objects.exists())
+
+    def test_import_invalid_file(self):
+        """
+        Negative test case
+        Malformed file or missing columns abort the import
+        """
+        with self.assertRaises(CommandError):
+            self.import_catalogue(self.write_file("bad.json", "{"))
+        with self.assertRaises(CommandError):
+            self.import_catalogue(self.write_file("bad.csv", "Make,Model\nAudi,A4\n"))
+
+    @mock.patch("cars.views.call_external_car_api")
+    def test_car_post_local_catalogue(self, api_call_mock):
+        """
+        Positive test case
+        Car found in imported catalogue is created without calling external api,
+        regardless of letter case
+        """
+        self.import_catalogue(self.write_file("tesla.json", json.dumps(TESLA_MODELS)))
+        car_data = {"make_name": "tesla", "model_name": "ROADSTER"}
+
+        response = self.client.post(self.url, car_data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertFalse(api_call_mock.called)
+
+    @mock.patch("cars.views.call_external_car_api")
+    def test_car_post_local_catalogue_miss(self, api_call_mock):
+        """
+        Positive test case
+        Car missing from imported catalogue is looked up in external api,
+        unless only local catalogue should be used
+        """
+        api_call_mock.return_value = ResponseData(
+            error="", status=status.HTTP_200_OK, data=[{"Model_Name": "A4"}]
+        )
+        car_data = {"make_name": "Audi", "model_name": "A4"}
+
+        with self.settings(VPIC_VALIDATION_BACKEND="local"):
+            response = self.client.post(self.url, car_data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertFalse(api_call_mock.called)
+
+        response = self.client.post(self.url, car_data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        api_call_mock.assert_called_once_with("Audi", "A4")
+
+    @mock.patch("cars.utils.get_models_for_make")
+    def test_bulk_and_jobs_local_catalogue(self, catalogue_mock):
+        """
+        Positive test case
+        Bulk creation and queued cars use imported catalogue too, with local backend
+        cars missing there are rejected without calling external api
+        """
+        self.import_catalogue(self.write_file("tesla.json", json.dumps(TESLA_MODELS)))
+        with self.settings(VPIC_VALIDATION_BACKEND="local"):
+            response = self.client.post(
+                reverse("cars-bulk"),
+                [
+                    {"make_name": "tesla", "model_name": "ROADSTER"},
+                    {"make_name": "Tesla", "model_name": "Model X"},
+                ],
+                format="json",
+            )
+            self.assertEqual(
+                [result["result"] for result in response.json()["results"]],
+                ["created", "not_found"],
+            )
+
+            job = enqueue_car_job("Tesla", "Model S")
+            call_command("process_car_jobs", once=True, stdout=io.StringIO())
+            job.refresh_from_db()
+            self.assertEqual(job.status, CarJob.CREATED)
+        self.assertFalse(catalogue_mock.called)
+
+
+class ExternalCarAPITests(SimpleTestCase):
+    client_config = {
+        "CONNECT_TIMEOUT": 1,
+        "READ_TIMEOUT": 0.2,
+        "RETRIES": 0,
+        "BACKOFF_FACTOR": 0,
+        "POOL_MAXSIZE": 2,
+        "ASYNC_POOL_MAXSIZE": 10,
+        "FAILURE_THRESHOLD": 2,
+        "RESET_TIMEOUT": 60,
+    }
+
+    def setUp(self) -> None:
+        """
+        Auxiliary test objects and functions
+        """
+        self.server = start_stub_vpic([(status.HTTP_200_OK, TESLA_MODELS, 0)])
+
+        settings_override = override_settings(
+            VPIC_API_URL=f"http://127.0.0.1:{self.server.server_port}",
+            VPIC_CLIENT=self.client_config,
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        caches["vpic"].clear()
+        catalogue_stats.reset()
+
+    def tearDown(self) -> None:
+        get_vpic_client().close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_repeated_make_served_from_cache(self):
+        """
+        Positive test case
+        Second lookup of the same make (in any letter case) doesn't call external api
+        """
+        first = call_external_car_api("Tesla", "model s")
+        second = call_external_car_api("TESLA", "Roadster")
+        missing = call_external_car_api("tesla ", "Cybertruck")
+
+        self.assertEqual(self.server.paths, ["/GetModelsForMake/Tesla?format=json"])
+        self.assertEqual(first.data[0]["Model_ID"], 1685)
+        self.assertEqual(second.data[0]["Model_ID"], 2071)
+        self.assertEqual(missing.data, [])
+        self.assertDictEqual({"hits": 2, "misses": 1}, catalogue_stats.snapshot())
+
+    def test_errors_are_not_cached(self):
+        """
+        Negative test case
+        Failed external api response should not be stored in cache
+        """
+        self.server.responses = [
+            (status.HTTP_404_NOT_FOUND, {}, 0),
+            (status.HTTP_200_OK, TESLA_MODELS, 0),
+        ]
+        response = call_external_car_api("Tesla", "Roadster")
+        self.assertEqual(response.status, status.HTTP_404_NOT_FOUND)
+
+        response = call_external_car_api("Tesla", "Roadster")
+        self.assertEqual(response.status, status.HTTP_200_OK)
+        self.assertEqual(len(self.server.paths), 2)
+
+    @override_settings(VPIC_CLIENT={**client_config, "RETRIES": 2})
+    def test_retry_server_error(self):
+        """
+        Positive test case
+        Temporary external api failure is retried
+        """
+        self.server.responses = [
+            (status.HTTP_503_SERVICE_UNAVAILABLE, {}, 0),
+            (status.HTTP_200_OK, TESLA_MODELS, 0),
+        ]
+        response = call_external_car_api("Tesla", "Roadster")
+        self.assertEqual(response.status, status.HTTP_200_OK)
+        self.assertEqual(len(self.server.paths), 2)
+
+    def test_read_timeout(self):
+        """
+        Negative test case
+        Slow external api doesn't block the caller longer than read timeout
+        """
+        self.server.responses = [(status.HTTP_200_OK, TESLA_MODELS, 1)]
+        started = time.monotonic()
+        response = call_external_car_api("Tesla", "Roadster")
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertEqual(response.status, status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    def test_circuit_breaker_fails_fast(self):
+        """
+        Negative test case
+        After FAILURE_THRESHOLD failures in a row calls are rejected with 503
+        without reaching external api
+        """
+        self.server.responses = [(status.HTTP_500_INTERNAL_SERVER_ERROR, {}, 0)]
+        for make in ("Tesla", "Audi"):
+            response = call_external_car_api(make, "Roadster")
+            self.assertEqual(response.status, status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        response = call_external_car_api("BMW", "Roadster")
+        self.assertEqual(response.status, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(len(self.server.paths), 2)
+
+    def test_concurrent_lookups_share_call(self):
+        """
+        Positive test case
+        Concurrent lookups of one make in a process wait for a single external api call
+        """
+        self.server.responses = [(status.HTTP_200_OK, TESLA_MODELS, 0.1)]
+        shared = catalogue_flights.shared
+        barrier = threading.Barrier(5)
+        responses = []
+
+        def lookup(make):
+            barrier.wait()
+            responses.append(call_external_car_api(make, "Roadster"))
+
+        threads = [
+            threading.Thread(target=lookup, args=(make,))
+            for make in ("Tesla", "TESLA", "tesla", "Tesla ", "tesla")
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(self.server.paths), 1)
+        self.assertEqual(catalogue_flights.shared - shared, 4)
+        for response in responses:
+            self.assertEqual(response.data[0]["Model_ID"], 2071)
+
+    def test_lookup_of_other_worker_awaited(self):
+        """
+        Positive test case
+        Make being fetched by another worker (holding lock in shared cache)
+        is taken from cache once that worker stores it
+        """
+        key = catalogue_cache_key("Tesla")
+        caches["vpic"].add(f"{key}:lock", 1, 5)
+
+        def other_worker():
+            time.sleep(0.1)
+            caches["vpic"].set(key, {"roadster": TESLA_MODELS["Results"][1:]})
+            caches["vpic"].delete(f"{key}:lock")
+
+        threading.Thread(target=other_worker).start()
+        response = call_external_car_api("Tesla", "Roadster")
+        self.assertEqual(response.data[0]["Model_ID"], 2071)
+        self.assertEqual(self.server.paths, [])
+
+    @override_settings(VPIC_SINGLE_FLIGHT_TIMEOUT=0.2)
+    def test_stuck_lookup_timeout(self):
+        """
+        Negative test case
+        Lock of a worker which doesn't finish blocks others at most VPIC_SINGLE_FLIGHT_TIMEOUT
+        """
+        caches["vpic"].add(f"{catalogue_cache_key('Tesla')}:lock", 1, 60)
+        started = time.monotonic()
+        response = get_models_for_make("Tesla")
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertEqual(response.status, status.HTTP_200_OK)
+        self.assertEqual(len(self.server.paths), 1)
+
+    def test_async_client_concurrent_lookups(self):
+        """
+        Positive test case
+        Async client waits for many external api responses at the same time
+        """
+        self.server.responses = [(status.HTTP_200_OK, TESLA_MODELS, 0.15)]
+
+        async def lookup_many():
+            try:
+                return await asyncio.gather(
+                    *[acall_external_car_api(f"Tesla{i}", "Roadster") for i in range(5)]
+                )
+            finally:
+                await get_async_vpic_client().aclose()
+
+        responses = asyncio.run(lookup_many())
+        self.assertEqual(len(self.server.paths), 5)
+        self.assertEqual(self.server.max_in_flight, 5)
+        for response in responses:
+            self.assertEqual(response.data[0]["Model_ID"], 2071)
+
+    def test_async_concurrent_lookups_share_call(self):
+        """
+        Positive test case
+        Concurrent async lookups of one make wait for a single external api call
+        """
+        self.server.responses = [(status.HTTP_200_OK, TESLA_MODELS, 0.1)]
+        shared = async_catalogue_flights.shared
+
+        async def lookup_many():
+            try:
+                return await asyncio.gather(
+                    *[
+                        acall_external_car_api(make, "Roadster")
+                        for make in ("Tesla", "TESLA", "tesla", "Tesla ")
+                    ]
+                )
+            finally:
+                await get_async_vpic_client().aclose()
+
+        responses = asyncio.run(lookup_many())
+        self.assertEqual(len(self.server.paths), 1)
+        self.assertEqual(async_catalogue_flights.shared - shared, 3)
+        for response in responses:
+            self.assertEqual(response.data[0]["Model_ID"], 2071)
+
+    def test_async_client_circuit_breaker(self):
+        """
+        Negative test case
+        Async client fails fast with 503 once breaker is open
+        """
+        self.server.responses = [(status.HTTP_500_INTERNAL_SERVER_ERROR, {}, 0)]
+
+        async def lookup_many():
+            try:
+                return [
+                    await acall_external_car_api(make, "Roadster")
+                    for make in ("Tesla", "Audi", "BMW")
+                ]
+            finally:
+                await get_async_vpic_client().aclose()
+
+        responses = asyncio.run(lookup_many())
+        self.assertEqual(
+            [response.status for response in responses],
+            [
+                status.HTTP_500_INTERNAL_SERVER_ERROR,
+                status.HTTP_500_INTERNAL_SERVER_ERROR,
+                status.HTTP_503_SERVICE_UNAVAILABLE,
+            ],
+        )
+        self.assertEqual(len(self.server.paths), 2)
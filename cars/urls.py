@@ -1,8 +1,25 @@
 from django.urls import path
 
-from .views import CarAPIView, CarPopularAPIView
+from .views import (
+    CarAPIView,
+    CarBulkAPIView,
+    CarDetailAPIView,
+    CarExportAPIView,
+    CarJobAPIView,
+    CarPopularAPIView,
+    CarSearchAPIView,
+    CarStatsAPIView,
+    car_create_async,
+)
 
 urlpatterns = [
     path("cars", CarAPIView.as_view(), name="cars-list"),
+    path("cars/async", car_create_async, name="cars-async"),
+    path("cars/bulk", CarBulkAPIView.as_view(), name="cars-bulk"),
+    path("cars/export", CarExportAPIView.as_view(), name="cars-export"),
+    path("cars/search", CarSearchAPIView.as_view(), name="cars-search"),
+    path("cars/jobs/<int:pk>", CarJobAPIView.as_view(), name="cars-job"),
+    path("cars/<int:pk>", CarDetailAPIView.as_view(), name="cars-detail"),
+    path("cars/<int:pk>/stats", CarStatsAPIView.as_view(), name="cars-stats"),
     path("popular", CarPopularAPIView.as_view(), name="cars-popular"),
 ]
@@ -1,9 +1,26 @@
+import asyncio
 import os
-from typing import NamedTuple
+import threading
+import time
+import weakref
+from typing import Iterable, NamedTuple, Optional
+from urllib.parse import quote
 
+import httpx
 import requests
-from requests import api
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from requests.adapters import HTTPAdapter
 from rest_framework import status
+from urllib3.util.retry import Retry
+
+from api_cars.metrics import registry, timed_external_call
+
+from .fields import normalize_name
+from .models import CatalogueEntry
 
 
 class ResponseData(NamedTuple):
@@ -12,22 +29,598 @@ class ResponseData(NamedTuple):
     data: list
 
 
-def call_external_car_api(car_make: str, car_model: str) -> ResponseData:
-    api_url = f"https://vpic.nhtsa.dot.gov/api/vehicles/GetModelsForMake/{car_make}?format=json"
+class CatalogueData(NamedTuple):
+    error: str
+    status: int
+    models: dict  # normalized model name -> matching vPIC results
+
+
+class CatalogueStats:
+    """
+    Process wide hit/miss counters of the make -> models catalogue cache
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def hit(self) -> None:
+        with self._lock:
+            self.hits += 1
+
+    def miss(self) -> None:
+        with self._lock:
+            self.misses += 1
+
+    def reset(self) -> None:
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses}
+
+
+catalogue_stats = CatalogueStats()
+
+
+def collect_catalogue_stats() -> dict:
+    stats = catalogue_stats.snapshot()
+    return {
+        "cache_requests_total": {
+            (("cache", "vpic_catalogue"), ("result", "hit")): stats["hits"],
+            (("cache", "vpic_catalogue"), ("result", "miss")): stats["misses"],
+        },
+        "vpic_lookups_coalesced_total": {
+            (): catalogue_flights.shared + async_catalogue_flights.shared
+        },
+    }
+
+
+registry.add_collector(collect_catalogue_stats)
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class CircuitBreaker:
+    """
+    Stops calling a failing service for reset_timeout seconds after
+    failure_threshold consecutive failures, then lets a single trial call through.
+    """
+
+    def __init__(self, failure_threshold: int, reset_timeout: float) -> None:
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+
+    @property
+    def is_open(self) -> bool:
+        with self._lock:
+            return self._opened_at is not None
+
+    def before_call(self) -> None:
+        with self._lock:
+            if self._opened_at is None:
+                return
+            if time.monotonic() - self._opened_at < self.reset_timeout:
+                raise CircuitOpenError()
+            # Half open, push the deadline so concurrent callers keep failing fast
+            self._opened_at = time.monotonic()
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+
+
+class SingleFlight:
+    """
+    At most one call per key runs at a time, concurrent callers of the same key
+    wait for it and share its result. A caller which waited longer than timeout
+    (or whose leader raised) makes the call itself.
+    """
+
+    class Call:
+        def __init__(self) -> None:
+            self.done = threading.Event()
+            self.result = None
+            self.ok = False
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.shared = 0  # calls answered by another caller's result
+
+    def do(self, key, func, timeout: float):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = self.Call()
+        if not leader:
+            if call.done.wait(timeout) and call.ok:
+                with self._lock:
+                    self.shared += 1
+                return call.result
+            return func()
+
+        try:
+            call.result = func()
+            call.ok = True
+            return call.result
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+
+class AsyncSingleFlight:
+    """
+    SingleFlight for coroutines of one event loop. Shared call keeps running
+    when the caller which started it is cancelled.
+    """
+
+    def __init__(self) -> None:
+        self._calls = {}
+        self.shared = 0
+
+    async def do(self, key, func):
+        task = self._calls.get(key)
+        if task is None:
+            task = self._calls[key] = asyncio.ensure_future(func())
+            task.add_done_callback(lambda _: self._calls.pop(key, None))
+        else:
+            self.shared += 1
+        return await asyncio.shield(task)
+
+
+RETRY_STATUSES = (
+    status.HTTP_500_INTERNAL_SERVER_ERROR,
+    status.HTTP_502_BAD_GATEWAY,
+    status.HTTP_503_SERVICE_UNAVAILABLE,
+    status.HTTP_504_GATEWAY_TIMEOUT,
+)
+
+
+class VPICClient:
+    """
+    Keep-alive client of vPIC external api with connection pool, timeouts,
+    retries with backoff and circuit breaker. One instance per process, see get_vpic_client.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        connect_timeout: float,
+        read_timeout: float,
+        retries: int,
+        backoff_factor: float,
+        pool_maxsize: int,
+        failure_threshold: int,
+        reset_timeout: float,
+    ) -> None:
+        self.base_url = base_url.rstrip("/")
+        self.timeout = (connect_timeout, read_timeout)
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=RETRY_STATUSES,
+            allowed_methods=("GET",),
+            raise_on_status=False,
+        )
+        self.session = requests.Session()
+        self.session.mount(
+            self.base_url,
+            HTTPAdapter(
+                pool_connections=1, pool_maxsize=pool_maxsize, max_retries=retry
+            ),
+        )
+
+    @classmethod
+    def from_settings(cls) -> "VPICClient":
+        config = settings.VPIC_CLIENT
+        return cls(
+            base_url=settings.VPIC_API_URL,
+            connect_timeout=config["CONNECT_TIMEOUT"],
+            read_timeout=config["READ_TIMEOUT"],
+            retries=config["RETRIES"],
+            backoff_factor=config["BACKOFF_FACTOR"],
+            pool_maxsize=config["POOL_MAXSIZE"],
+            failure_threshold=config["FAILURE_THRESHOLD"],
+            reset_timeout=config["RESET_TIMEOUT"],
+        )
+
+    def get(self, path: str, **params) -> requests.Response:
+        """
+        GET given api path, raises CircuitOpenError without calling api when breaker is open
+        """
+        self.breaker.before_call()
+        try:
+            with timed_external_call("vpic"):
+                response = self.session.get(
+                    f"{self.base_url}/{path}", params=params, timeout=self.timeout
+                )
+        except requests.exceptions.RequestException:
+            self.breaker.record_failure()
+            raise
+        if response.status_code >= status.HTTP_500_INTERNAL_SERVER_ERROR:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        return response
+
+    def close(self) -> None:
+        self.session.close()
+
+
+class AsyncVPICClient:
+    """
+    asyncio counterpart of VPICClient, keeps many concurrent lookups on one
+    connection pool. Bound to event loop, see get_async_vpic_client.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        connect_timeout: float,
+        read_timeout: float,
+        retries: int,
+        backoff_factor: float,
+        pool_maxsize: int,
+        failure_threshold: int,
+        reset_timeout: float,
+    ) -> None:
+        self.base_url = base_url.rstrip("/")
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.client = httpx.AsyncClient(
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            limits=httpx.Limits(
+                max_connections=pool_maxsize, max_keepalive_connections=pool_maxsize
+            ),
+        )
+
+    @classmethod
+    def from_settings(cls) -> "AsyncVPICClient":
+        config = settings.VPIC_CLIENT
+        return cls(
+            base_url=settings.VPIC_API_URL,
+            connect_timeout=config["CONNECT_TIMEOUT"],
+            read_timeout=config["READ_TIMEOUT"],
+            retries=config["RETRIES"],
+            backoff_factor=config["BACKOFF_FACTOR"],
+            pool_maxsize=config["ASYNC_POOL_MAXSIZE"],
+            failure_threshold=config["FAILURE_THRESHOLD"],
+            reset_timeout=config["RESET_TIMEOUT"],
+        )
+
+    async def get(self, path: str, **params) -> httpx.Response:
+        """
+        GET given api path, raises CircuitOpenError without calling api when breaker is open
+        """
+        self.breaker.before_call()
+        for attempt in range(self.retries + 1):
+            if attempt:
+                await asyncio.sleep(self.backoff_factor * 2 ** (attempt - 1))
+            try:
+                with timed_external_call("vpic"):
+                    response = await self.client.get(
+                        f"{self.base_url}/{path}", params=params
+                    )
+            except httpx.TransportError:
+                if attempt < self.retries:
+                    continue
+                self.breaker.record_failure()
+                raise
+            if response.status_code not in RETRY_STATUSES:
+                break
+
+        if response.status_code >= status.HTTP_500_INTERNAL_SERVER_ERROR:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        return response
+
+    async def aclose(self) -> None:
+        await self.client.aclose()
+
+
+_vpic_client: Optional[VPICClient] = None
+_vpic_client_lock = threading.Lock()
+
 
+def get_vpic_client() -> VPICClient:
+    global _vpic_client
+    if _vpic_client is None:
+        with _vpic_client_lock:
+            if _vpic_client is None:
+                _vpic_client = VPICClient.from_settings()
+    return _vpic_client
+
+
+_async_vpic_clients = weakref.WeakKeyDictionary()
+
+
+def get_async_vpic_client() -> AsyncVPICClient:
+    loop = asyncio.get_running_loop()
+    client = _async_vpic_clients.get(loop)
+    if client is None:
+        client = _async_vpic_clients[loop] = AsyncVPICClient.from_settings()
+    return client
+
+
+@receiver(setting_changed)
+def reset_vpic_client(setting, **kwargs):
+    global _vpic_client
+    if setting in ("VPIC_API_URL", "VPIC_CLIENT"):
+        with _vpic_client_lock:
+            if _vpic_client is not None:
+                _vpic_client.close()
+            _vpic_client = None
+        _async_vpic_clients.clear()
+
+
+def catalogue_cache_key(car_make: str) -> str:
+    # quote() keeps keys free of spaces, which memcached rejects
+    return f"models-for-make:{quote(normalize_name(car_make))}"
+
+
+def get_cached_catalogue(car_make: str) -> Optional[CatalogueData]:
+    models = caches["vpic"].get(catalogue_cache_key(car_make))
+    if models is None:
+        catalogue_stats.miss()
+        return None
+    catalogue_stats.hit()
+    return CatalogueData(error="", status=status.HTTP_200_OK, models=models)
+
+
+def store_catalogue(car_make: str, results: list) -> CatalogueData:
+    models = {}
+    for car in results:
+        models.setdefault(normalize_name(car.get("Model_Name", "")), []).append(car)
+
+    caches["vpic"].set(catalogue_cache_key(car_make), models)
+    return CatalogueData(error="", status=status.HTTP_200_OK, models=models)
+
+
+CIRCUIT_OPEN = CatalogueData(
+    error="External api is unavailable, try again later",
+    status=status.HTTP_503_SERVICE_UNAVAILABLE,
+    models={},
+)
+
+
+# Seconds between checks of a waiting worker whether another one fetched the make
+SINGLE_FLIGHT_POLL_INTERVAL = 0.05
+
+catalogue_flights = SingleFlight()
+async_catalogue_flights = AsyncSingleFlight()
+
+
+def get_models_for_make(car_make: str) -> CatalogueData:
+    """
+    Fetch all models of given make from vPIC external api, indexed by normalized name.
+    Successful results are kept in "vpic" cache, so repeated makes don't leave the process.
+    Concurrent lookups of the same make share one external api call.
+    """
+    catalogue = get_cached_catalogue(car_make)
+    if catalogue is not None:
+        return catalogue
+
+    return catalogue_flights.do(
+        normalize_name(car_make),
+        lambda: fetch_models_once(car_make),
+        settings.VPIC_SINGLE_FLIGHT_TIMEOUT,
+    )
+
+
+def lock_catalogue_fetch(car_make: str) -> bool:
+    """
+    Claim fetching of the make among workers sharing "vpic" cache
+    """
+    key = catalogue_cache_key(car_make)
+    return caches["vpic"].add(f"{key}:lock", 1, settings.VPIC_SINGLE_FLIGHT_TIMEOUT)
+
+
+def get_fetched_catalogue(
+    car_make: str, errors: bool = True
+) -> Optional[CatalogueData]:
+    """
+    Result of the make fetched by another worker, None while there is none
+    """
+    key = catalogue_cache_key(car_make)
+    models = caches["vpic"].get(key)
+    if models is not None:
+        return CatalogueData(error="", status=status.HTTP_200_OK, models=models)
+    failed = caches["vpic"].get(f"{key}:error") if errors else None
+    if failed is not None:
+        return CatalogueData(error=failed[0], status=failed[1], models={})
+    return None
+
+
+def unlock_catalogue_fetch(car_make: str, catalogue: Optional[CatalogueData]) -> None:
+    """
+    Release the make for other workers, with the result (None when fetch raised)
+    """
+    key = catalogue_cache_key(car_make)
+    if catalogue is not None and catalogue.error:
+        # For workers waiting now only (shortest timeout memcached keeps),
+        # errors are not cached
+        caches["vpic"].set(f"{key}:error", (catalogue.error, catalogue.status), 1)
+    caches["vpic"].delete(f"{key}:lock")
+
+
+def fetch_models_once(car_make: str) -> CatalogueData:
+    """
+    Fetch models of the make, unless another worker sharing "vpic" cache already
+    does. Then wait for its result, up to VPIC_SINGLE_FLIGHT_TIMEOUT seconds.
+    """
+    deadline = time.monotonic() + settings.VPIC_SINGLE_FLIGHT_TIMEOUT
+    locked = lock_catalogue_fetch(car_make)
+    while not locked and time.monotonic() < deadline:
+        time.sleep(SINGLE_FLIGHT_POLL_INTERVAL)
+        catalogue = get_fetched_catalogue(car_make)
+        if catalogue is not None:
+            return catalogue
+        # Lock is gone without result when its holder died
+        locked = lock_catalogue_fetch(car_make)
+    if not locked:
+        return fetch_models_for_make(car_make)
+
+    catalogue = None
     try:
-        req = requests.request("GET", url=api_url)
+        # Fetched by another worker between our cache miss and lock
+        catalogue = get_fetched_catalogue(car_make, errors=False)
+        if catalogue is None:
+            catalogue = fetch_models_for_make(car_make)
+    finally:
+        unlock_catalogue_fetch(car_make, catalogue)
+    return catalogue
+
+
+def fetch_models_for_make(car_make: str) -> CatalogueData:
+    try:
+        req = get_vpic_client().get(f"GetModelsForMake/{car_make}", format="json")
+    except CircuitOpenError:
+        return CIRCUIT_OPEN
     except requests.exceptions.RequestException as e:
-        return ResponseData(
-            error=f"{e}", status=status.HTTP_500_INTERNAL_SERVER_ERROR, data=[]
+        return CatalogueData(
+            error=f"{e}", status=status.HTTP_500_INTERNAL_SERVER_ERROR, models={}
+        )
+    if req.status_code != status.HTTP_200_OK:
+        return CatalogueData(error=req.reason, status=req.status_code, models={})
+
+    return store_catalogue(car_make, req.json().get("Results"))
+
+
+async def aget_models_for_make(car_make: str) -> CatalogueData:
+    """
+    Async version of get_models_for_make
+    """
+    catalogue = await sync_to_async(get_cached_catalogue, thread_sensitive=False)(
+        car_make
+    )
+    if catalogue is not None:
+        return catalogue
+
+    return await async_catalogue_flights.do(
+        normalize_name(car_make), lambda: afetch_models_once(car_make)
+    )
+
+
+async def afetch_models_once(car_make: str) -> CatalogueData:
+    """
+    Async version of fetch_models_once
+    """
+    lock = sync_to_async(lock_catalogue_fetch, thread_sensitive=False)
+    fetched = sync_to_async(get_fetched_catalogue, thread_sensitive=False)
+    deadline = time.monotonic() + settings.VPIC_SINGLE_FLIGHT_TIMEOUT
+    locked = await lock(car_make)
+    while not locked and time.monotonic() < deadline:
+        await asyncio.sleep(SINGLE_FLIGHT_POLL_INTERVAL)
+        catalogue = await fetched(car_make)
+        if catalogue is not None:
+            return catalogue
+        locked = await lock(car_make)
+    if not locked:
+        return await afetch_models_for_make(car_make)
+
+    catalogue = None
+    try:
+        catalogue = await fetched(car_make, errors=False)
+        if catalogue is None:
+            catalogue = await afetch_models_for_make(car_make)
+    finally:
+        await sync_to_async(unlock_catalogue_fetch, thread_sensitive=False)(
+            car_make, catalogue
+        )
+    return catalogue
+
+
+async def afetch_models_for_make(car_make: str) -> CatalogueData:
+    try:
+        req = await get_async_vpic_client().get(
+            f"GetModelsForMake/{car_make}", format="json"
+        )
+    except CircuitOpenError:
+        return CIRCUIT_OPEN
+    except httpx.HTTPError as e:
+        # Some httpx errors (e.g. timeouts) come without message
+        return CatalogueData(
+            error=f"{e}" or e.__class__.__name__,
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            models={},
         )
     if req.status_code != status.HTTP_200_OK:
-        return ResponseData(error=req.reason, status=req.status_code, data=[])
-
-    resp = req.json()
-    result = [
-        car
-        for car in resp.get("Results")
-        if car.get("Model_Name", "").capitalize() == car_model.capitalize()
-    ]
+        return CatalogueData(error=req.reason_phrase, status=req.status_code, models={})
+
+    return await sync_to_async(store_catalogue, thread_sensitive=False)(
+        car_make, req.json().get("Results")
+    )
+
+
+def match_model(catalogue: CatalogueData, car_model: str) -> ResponseData:
+    if catalogue.error:
+        return ResponseData(error=catalogue.error, status=catalogue.status, data=[])
+
+    result = catalogue.models.get(normalize_name(car_model), [])
     return ResponseData(error="", status=status.HTTP_200_OK, data=result)
+
+
+def call_external_car_api(car_make: str, car_model: str) -> ResponseData:
+    return match_model(get_models_for_make(car_make), car_model)
+
+
+async def acall_external_car_api(car_make: str, car_model: str) -> ResponseData:
+    return match_model(await aget_models_for_make(car_make), car_model)
+
+
+def lookup_make_catalogue(car_make: str, model_keys: Iterable[str]) -> CatalogueData:
+    """
+    Catalogue of a make for validating several of its models (normalized names)
+    at once, according to VPIC_VALIDATION_BACKEND like lookup_local_catalogue:
+    imported catalogue first (one query), external api when any model is missing there
+    """
+    backend = settings.VPIC_VALIDATION_BACKEND
+    if backend != "remote":
+        model_keys = set(model_keys)
+        models = {}
+        for entry in CatalogueEntry.objects.filter(
+            make_key=normalize_name(car_make), model_key__in=model_keys
+        ):
+            models.setdefault(entry.model_key, []).append(entry.as_vpic_result())
+        if backend == "local" or model_keys <= models.keys():
+            return CatalogueData(error="", status=status.HTTP_200_OK, models=models)
+    return get_models_for_make(car_make)
+
+
+def lookup_local_catalogue(car_make: str, car_model: str) -> Optional[ResponseData]:
+    """
+    Validate car against imported catalogue according to VPIC_VALIDATION_BACKEND.
+    None means external api should be asked.
+    """
+    backend = settings.VPIC_VALIDATION_BACKEND
+    if backend == "remote":
+        return None
+    entries = CatalogueEntry.objects.filter(
+        make_key=normalize_name(car_make), model_key=normalize_name(car_model)
+    )
+    data = [entry.as_vpic_result() for entry in entries]
+    if data or backend == "local":
+        return ResponseData(error="", status=status.HTTP_200_OK, data=data)
+    return None
@@ -1,38 +1,139 @@
+import hashlib
+import json
+from collections import defaultdict
+from itertools import islice
+
 import requests
-from django.db import IntegrityError
-from django.db.models import Avg, Count
-from django.db.models.functions import Coalesce
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import IntegrityError, connections
+from django.db.models import Case, F, IntegerField, Q, Sum, Value, When
+from django.db.models.functions import Greatest
+from django.http import JsonResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
 from rest_framework import status
+from rest_framework.exceptions import APIException
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.request import Request
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 from rest_framework.views import APIView
 
-from .models import Car
-from .serializers import CarSerializer
-from .utils import call_external_car_api
+from api_cars.db import pin_to_primary, pin_user, read_from_replica
+from rate.utils import window_start, window_stats
+
+from .cache import cache_listing, invalidate_listings
+from .fields import Similarity
+from .jobs import enqueue_car_job
+from .models import Car, CarJob, CarRanking
+from .pagination import KeysetPagination
+from .ranking import rank_new_cars
+from .serializers import CarDetailSerializer, CarJobSerializer, CarSerializer
+from .utils import (
+    acall_external_car_api,
+    call_external_car_api,
+    lookup_local_catalogue,
+    lookup_make_catalogue,
+    normalize_name,
+)
+
+# Largest id of AutoField, greater values are no car ids (and overflow SQLite driver)
+MAX_CAR_ID = 2 ** 31 - 1
 
 
 class CarAPIView(APIView):
     permission_classes = (IsAuthenticated,)
 
+    @read_from_replica
+    @cache_listing
     def get(self, request):
-        cars = Car.objects.annotate(
-            average_rate=Coalesce(Avg("rate__rating"), 0)
-        ).order_by("-average_rate")
-        return Response(cars.values())
+        if "ids" in request.query_params:
+            return self.get_many(request)
+        order = request.query_params.get("order")
+        if order == "score":
+            return self.get_ranked(request)
+        if order is not None:
+            return Response(
+                data={"error": "order should be score"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        paginator = KeysetPagination(
+            ordering="average_rate",
+            fields=("id", "make_name", "model_name", "average_rate"),
+        )
+        cars = paginator.paginate_queryset(Car.objects.all(), request)
+        return paginator.get_paginated_response(cars)
+
+    def get_ranked(self, request):
+        """
+        Cars by confidence weighted score, read in order from precomputed ranking table
+        """
+        rankings = CarRanking.objects.annotate(
+            id=F("car_id"),
+            make_name=F("car__make_name"),
+            model_name=F("car__model_name"),
+            average_rate=F("car__average_rate"),
+            rating_qty=F("car__rating_qty"),
+        )
+        paginator = KeysetPagination(
+            ordering="score",
+            fields=(
+                "id",
+                "make_name",
+                "model_name",
+                "average_rate",
+                "rating_qty",
+                "score",
+            ),
+        )
+        cars = paginator.paginate_queryset(rankings, request)
+        return paginator.get_paginated_response(cars)
+
+    def get_many(self, request):
+        """
+        Details of cars given by "ids" (e.g. 1,2,3) in one query, in requested order.
+        Not existing ids are left out.
+        """
+        try:
+            ids = [int(pk) for pk in request.query_params["ids"].split(",")]
+        except ValueError:
+            ids = []
+        if not ids or min(ids) < 1 or max(ids) > MAX_CAR_ID:
+            return Response(
+                data={"error": "ids should be comma separated car ids"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        if len(ids) > settings.CARS_PAGE_MAX_LIMIT:
+            return Response(
+                data={
+                    "error": f"At most {settings.CARS_PAGE_MAX_LIMIT} ids per request"
+                },
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        cars = Car.objects.in_bulk(ids)
+        ordered = [cars[pk] for pk in dict.fromkeys(ids) if pk in cars]
+        return Response(data=CarDetailSerializer(ordered, many=True).data)
 
+    @pin_to_primary
     def post(self, request):
         serializer = CarSerializer(data=request.data)
         if not serializer.is_valid():
             return Response(
-                data={"error": f"Invalid Parameters"},
+                data={"error": "Invalid Parameters"},
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
         car_make = serializer.validated_data.get("make_name")
         car_model = serializer.validated_data.get("model_name")
 
-        req = call_external_car_api(car_make, car_model)
+        if "respond-async" in request.headers.get("Prefer", ""):
+            return self.post_async(request, car_make, car_model)
+
+        req = lookup_local_catalogue(car_make, car_model)
+        if req is None:
+            req = call_external_car_api(car_make, car_model)
 
         if req.error:
             return Response(data={"error": f"{req.error}"}, status=req.status)
@@ -57,12 +158,455 @@ class CarAPIView(APIView):
                 status=status.HTTP_404_NOT_FOUND,
             )
 
+    def post_async(self, request, car_make, car_model):
+        """
+        Queue the car for process_car_jobs worker and answer right away with job to poll
+        """
+        if Car.objects.filter(
+            make_key=normalize_name(car_make), model_key=normalize_name(car_model)
+        ).exists():
+            return Response(
+                data={"error": f"Car {car_make} {car_model} already exists!"},
+                status=status.HTTP_409_CONFLICT,
+            )
+        job = enqueue_car_job(car_make, car_model, user=request.user)
+        return Response(
+            data={"job": job.pk, "status": job.status},
+            status=status.HTTP_202_ACCEPTED,
+            headers={"Location": reverse("cars-job", args=[job.pk])},
+        )
+
+
+class CarJobAPIView(APIView):
+    """
+    Status of a car creation queued with "Prefer: respond-async", visible to its author only
+    """
+
+    permission_classes = (IsAuthenticated,)
+
+    def get(self, request, pk):
+        # Jobs have AutoField ids as well
+        job = (
+            CarJob.objects.filter(pk=pk, created_by=request.user).first()
+            if pk <= MAX_CAR_ID
+            else None
+        )
+        if job is None:
+            return Response(
+                data={"error": f"Job {pk} does not exist"},
+                status=status.HTTP_404_NOT_FOUND,
+            )
+        return Response(data=CarJobSerializer(job).data)
+
+
+class CarExportAPIView(APIView):
+    """
+    Stream whole catalogue ordered like GET /cars, either as JSON array (default)
+    or as newline delimited JSON with ?output=ndjson. Rows are read with a
+    server side cursor, so memory use doesn't depend on number of cars.
+    """
+
+    permission_classes = (IsAuthenticated,)
+    fields = ("id", "make_name", "model_name", "average_rate")
+
+    def get(self, request):
+        output = request.query_params.get("output", "json")
+        if output not in ("json", "ndjson"):
+            return Response(
+                data={"error": "output should be either json or ndjson"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        rows = (
+            Car.objects.order_by("-average_rate", "-id")
+            .values(*self.fields)
+            .iterator(chunk_size=settings.CARS_EXPORT_CHUNK_SIZE)
+        )
+        if output == "ndjson":
+            content, content_type = self.iter_ndjson(rows), "application/x-ndjson"
+        else:
+            content, content_type = self.iter_json_array(rows), "application/json"
+        return StreamingHttpResponse(content, content_type=content_type)
+
+    @staticmethod
+    def iter_chunks(rows):
+        while True:
+            chunk = list(islice(rows, settings.CARS_EXPORT_CHUNK_SIZE))
+            if not chunk:
+                return
+            yield [json.dumps(row, separators=(",", ":")) for row in chunk]
+
+    def iter_ndjson(self, rows):
+        for chunk in self.iter_chunks(rows):
+            yield ("\n".join(chunk) + "\n").encode()
+
+    def iter_json_array(self, rows):
+        separator = "["
+        for chunk in self.iter_chunks(rows):
+            yield (separator + ",".join(chunk)).encode()
+            separator = ","
+        yield b"[]" if separator == "[" else b"]"
+
 
 class CarPopularAPIView(APIView):
     permission_classes = (IsAuthenticated,)
 
+    @read_from_replica
+    @cache_listing
     def get(self, request):
-        cars = Car.objects.annotate(rating_qty=Count("rate__rating")).order_by(
-            "-rating_qty"
+        """
+        Cars with most ratings first, "top" query param returns only N most popular.
+        With "window" (e.g. 7d) only ratings of last days count, read from daily rollups.
+        """
+        cars = Car.objects.all()
+        paginator = KeysetPagination(
+            ordering="rating_qty",
+            fields=("id", "make_name", "model_name", "rating_qty"),
+        )
+        window = request.query_params.get("window")
+        if window is not None:
+            try:
+                since = window_start(window)
+            except ValueError as e:
+                return Response(
+                    data={"error": f"{e}"}, status=status.HTTP_400_BAD_REQUEST
+                )
+            cars = cars.filter(daily_stats__day__gte=since).annotate(
+                window_rating_qty=Sum("daily_stats__rating_qty")
+            )
+            paginator = KeysetPagination(
+                ordering="window_rating_qty",
+                fields=("id", "make_name", "model_name", "window_rating_qty"),
+            )
+
+        top = request.query_params.get("top")
+        if top is not None:
+            try:
+                top = int(top)
+            except ValueError:
+                top = 0
+            if top < 1:
+                return Response(
+                    data={"error": "top should be a positive integer"},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+            top = min(top, settings.CARS_PAGE_MAX_LIMIT)
+        cars = paginator.paginate_queryset(cars, request, limit=top)
+        return paginator.get_paginated_response(cars)
+
+
+class CarDetailAPIView(APIView):
+    """
+    Car with its rating summary. Carries ETag and Last-Modified (time of the latest
+    rating), so polling clients get 304 Not Modified until the car is rated again.
+    """
+
+    permission_classes = (IsAuthenticated,)
+
+    def get(self, request, pk):
+        car = Car.objects.filter(pk=pk).first() if pk <= MAX_CAR_ID else None
+        if car is None:
+            return Response(
+                data={"error": f"Car {pk} does not exist"},
+                status=status.HTTP_404_NOT_FOUND,
+            )
+
+        data = CarDetailSerializer(car).data
+        raw = f"{json.dumps(data, sort_keys=True)}|{request.accepted_media_type}"
+        etag = quote_etag(hashlib.md5(raw.encode()).hexdigest())
+        # HTTP dates have one second resolution
+        last_modified = car.last_rated_at and int(car.last_rated_at.timestamp())
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified
+        )
+        if response is None:
+            response = Response(data=data)
+        response["ETag"] = etag
+        if last_modified:
+            response["Last-Modified"] = http_date(last_modified)
+        return response
+
+
+class CarSearchAPIView(APIView):
+    """
+    Cars whose make, model or "make model" start with "q" (ignoring case and extra
+    whitespace), most rated first. On PostgreSQL misspelled names are matched too,
+    ranked by trigram similarity after prefix matches.
+    """
+
+    permission_classes = (IsAuthenticated,)
+    fields = ("id", "make_name", "model_name", "average_rate", "rating_qty")
+
+    @staticmethod
+    def prefix_filter(query: str) -> Q:
+        condition = Q(make_key__startswith=query) | Q(model_key__startswith=query)
+        # "land rover disc" may be make "land rover" with model "disc..." or make "land"
+        words = query.split(" ")
+        for split in range(1, len(words)):
+            condition |= Q(
+                make_key=" ".join(words[:split]),
+                model_key__startswith=" ".join(words[split:]),
+            )
+        return condition
+
+    @cache_listing
+    def get(self, request):
+        query = normalize_name(request.query_params.get("q", ""))[:100]
+        if not query:
+            return Response(
+                data={"error": "q should be a non empty search phrase"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        try:
+            limit = int(
+                request.query_params.get("limit", settings.CARS_SEARCH_DEFAULT_LIMIT)
+            )
+        except ValueError:
+            limit = 0
+        if limit < 1:
+            return Response(
+                data={"error": "limit should be a positive integer"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        limit = min(limit, settings.CARS_PAGE_MAX_LIMIT)
+
+        prefix = self.prefix_filter(query)
+        cars = Car.objects.all()
+        if settings.CARS_SEARCH_FUZZY and connections[cars.db].vendor == "postgresql":
+            cars = (
+                cars.filter(
+                    prefix
+                    | Q(make_key__trigram_similar=query)
+                    | Q(model_key__trigram_similar=query)
+                )
+                .annotate(
+                    prefix=Case(
+                        When(prefix, then=Value(1)),
+                        default=Value(0),
+                        output_field=IntegerField(),
+                    ),
+                    similarity=Greatest(
+                        Similarity("make_key", Value(query)),
+                        Similarity("model_key", Value(query)),
+                    ),
+                )
+                .order_by("-prefix", "-similarity", "-rating_qty", "-id")
+            )
+        else:
+            cars = cars.filter(prefix).order_by("-rating_qty", "-id")
+        return Response(list(cars.values(*self.fields)[:limit]))
+
+
+class CarStatsAPIView(APIView):
+    """
+    Rating count, average and star histogram of a car, all time or
+    within "window" (e.g. 7d) computed from daily rollups
+    """
+
+    permission_classes = (IsAuthenticated,)
+
+    def get(self, request, pk):
+        car = Car.objects.filter(pk=pk).first() if pk <= MAX_CAR_ID else None
+        if car is None:
+            return Response(
+                data={"error": f"Car {pk} does not exist"},
+                status=status.HTTP_404_NOT_FOUND,
+            )
+
+        window = request.query_params.get("window")
+        if window is None:
+            stats = {
+                "rating_qty": car.rating_qty,
+                "average_rate": car.average_rate,
+                "histogram": car.histogram,
+            }
+        else:
+            try:
+                stats = window_stats(car.pk, window_start(window))
+            except ValueError as e:
+                return Response(
+                    data={"error": f"{e}"}, status=status.HTTP_400_BAD_REQUEST
+                )
+        return Response(
+            data={
+                "id": car.pk,
+                "make_name": car.make_name,
+                "model_name": car.model_name,
+                "window": window,
+                **stats,
+            }
+        )
+
+
+def authenticate(request):
+    """
+    Run DRF authentication classes outside of APIView, returns user or None
+    """
+    drf_request = Request(
+        request,
+        authenticators=[auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES],
+    )
+    try:
+        user = drf_request.user
+    except APIException:
+        return None
+    return user if user and user.is_authenticated else None
+
+
+async def car_create_async(request):
+    """
+    ASGI native version of POST /cars, waiting for external api doesn't hold a worker thread.
+    Served by any deployment, but only ASGI one (uvicorn workers) runs lookups concurrently.
+    """
+    if request.method != "POST":
+        return JsonResponse(
+            data={"error": f"Method {request.method} not allowed"},
+            status=status.HTTP_405_METHOD_NOT_ALLOWED,
+        )
+    user = await sync_to_async(authenticate)(request)
+    if user is None:
+        return JsonResponse(
+            data={"detail": "Authentication credentials were not provided."},
+            status=status.HTTP_401_UNAUTHORIZED,
+        )
+
+    try:
+        data = json.loads(request.body)
+    except ValueError:
+        data = None
+    serializer = CarSerializer(data=data if isinstance(data, dict) else {})
+    if not serializer.is_valid():
+        return JsonResponse(
+            data={"error": "Invalid Parameters"},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+
+    car_make = serializer.validated_data.get("make_name")
+    car_model = serializer.validated_data.get("model_name")
+
+    req = await sync_to_async(lookup_local_catalogue)(car_make, car_model)
+    if req is None:
+        req = await acall_external_car_api(car_make, car_model)
+
+    if req.error:
+        return JsonResponse(data={"error": f"{req.error}"}, status=req.status)
+
+    if not req.data:
+        return JsonResponse(
+            data={
+                "error": f"No matching result in external api for {car_make} {car_model}"
+            },
+            status=status.HTTP_404_NOT_FOUND,
+        )
+    try:
+        await sync_to_async(serializer.save)()
+    except IntegrityError:
+        return JsonResponse(
+            data={"error": f"Car {car_make} {car_model} already exists!"},
+            status=status.HTTP_409_CONFLICT,
+        )
+    # Like pin_to_primary of POST /cars
+    await sync_to_async(pin_user)(user)
+    return JsonResponse(
+        data={"result": f"Added {car_make} {car_model} to database"},
+        status=status.HTTP_201_CREATED,
+    )
+
+
+# Token authenticated, there is no session to protect from CSRF
+car_create_async.csrf_exempt = True
+
+
+class CarBulkAPIView(APIView):
+    """
+    Add many cars at once, external api is asked once per make (for makes whose
+    models aren't all in imported catalogue, see VPIC_VALIDATION_BACKEND).
+    Each item gets its own result: created, duplicate, not_found, invalid or error.
+    """
+
+    permission_classes = (IsAuthenticated,)
+
+    @pin_to_primary
+    def post(self, request):
+        items = request.data
+        if not isinstance(items, list) or not items:
+            return Response(
+                data={"error": "Expected non empty list of cars"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        if len(items) > settings.CARS_BULK_MAX_ITEMS:
+            return Response(
+                data={
+                    "error": f"At most {settings.CARS_BULK_MAX_ITEMS} cars per request"
+                },
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        results = [None] * len(items)
+        by_make = defaultdict(list)
+        for index, item in enumerate(items):
+            serializer = CarSerializer(data=item if isinstance(item, dict) else {})
+            if not serializer.is_valid():
+                results[index] = {"result": "invalid", "error": serializer.errors}
+                continue
+            car = (
+                serializer.validated_data["make_name"],
+                serializer.validated_data["model_name"],
+            )
+            results[index] = {"make_name": car[0], "model_name": car[1]}
+            by_make[normalize_name(car[0])].append((index, car))
+
+        accepted = {}  # (make_key, model_key) -> (index, car) of first occurrence
+        for cars in by_make.values():
+            catalogue = lookup_make_catalogue(
+                cars[0][1][0], (normalize_name(car[1]) for _, car in cars)
+            )
+            for index, car in cars:
+                key = (normalize_name(car[0]), normalize_name(car[1]))
+                if catalogue.error:
+                    results[index].update(result="error", error=catalogue.error)
+                elif key[1] not in catalogue.models:
+                    results[index]["result"] = "not_found"
+                elif key in accepted:
+                    results[index]["result"] = "duplicate"
+                else:
+                    accepted[key] = (index, car)
+
+        if accepted:
+            make_keys = {make_key for make_key, _ in accepted}
+            model_keys = {model_key for _, model_key in accepted}
+            cars = Car.objects.filter(make_key__in=make_keys, model_key__in=model_keys)
+            existing = set(cars.values_list("make_key", "model_key")) & accepted.keys()
+            Car.objects.bulk_create(
+                [
+                    Car(make_name=make, model_name=model)
+                    for key, (_, (make, model)) in accepted.items()
+                    if key not in existing
+                ],
+                batch_size=settings.CARS_BULK_BATCH_SIZE,
+                ignore_conflicts=True,
+            )
+            invalidate_listings()
+            for make_key, model_key, car_id in cars.values_list(
+                "make_key", "model_key", "id"
+            ):
+                key = (make_key, model_key)
+                if key not in accepted:
+                    continue
+                results[accepted[key][0]].update(
+                    id=car_id,
+                    result="duplicate" if key in existing else "created",
+                )
+            rank_new_cars(
+                [
+                    results[index]["id"]
+                    for index, _ in accepted.values()
+                    if results[index].get("result") == "created"
+                ]
+            )
+
+        created = sum(1 for result in results if result.get("result") == "created")
+        return Response(
+            data={"created": created, "results": results},
+            status=status.HTTP_201_CREATED if created else status.HTTP_200_OK,
         )
-        return Response(cars.values())
@@ -11,4 +11,7 @@ then
     echo "PostgreSQL started"
 fi
 
+# Gunicorn doesn't run system checks, refuse to start with misconfigured cache
+python manage.py check || exit 1
+
 exec "$@"
\ No newline at end of file
@@ -0,0 +1,30 @@
+"""
+Gunicorn settings of production deployment, every value can be overridden with
+environment variable (or command line option).
+
+Every worker thread keeps its own persistent database connection (SQL_CONN_MAX_AGE),
+so the database (or pgbouncer) has to accept GUNICORN_WORKERS * GUNICORN_THREADS
+connections per container.
+"""
+import multiprocessing
+import os
+
+cpu_count = multiprocessing.cpu_count()
+
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:8000")
+
+# Threaded workers overlap database and external api waits of requests
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "gthread")
+workers = int(os.environ.get("GUNICORN_WORKERS", cpu_count * 2 + 1))
+threads = int(os.environ.get("GUNICORN_THREADS", 4))
+
+# External api lookups may take up to a few read timeouts with retries
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 60))
+graceful_timeout = int(os.environ.get("GUNICORN_GRACEFUL_TIMEOUT", 30))
+keepalive = int(os.environ.get("GUNICORN_KEEPALIVE", 5))
+
+# Recycle workers now and then, jitter keeps them from restarting all at once
+max_requests = int(os.environ.get("GUNICORN_MAX_REQUESTS", 10000))
+max_requests_jitter = int(os.environ.get("GUNICORN_MAX_REQUESTS_JITTER", 1000))
+
+accesslog = os.environ.get("GUNICORN_ACCESSLOG", "-")
@@ -1,5 +1,7 @@
 from django.contrib import admin
 
-from .models import Rate
+from .models import Rate, RateDailyStats, RateFlush
 
 admin.site.register(Rate)
+admin.site.register(RateDailyStats)
+admin.site.register(RateFlush)
@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class RateConfig(AppConfig):
     name = "rate"
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,262 @@
+"""
+Write-behind buffer of ratings (RATE_WRITE_BEHIND), see README for durability notes.
+
+Every worker process appends accepted ratings as JSON lines to its own segment file
+in RATE_SPOOL_DIR. After RATE_SPOOL_ROTATE_SECONDS the writer closes the segment
+and renames it to "*.ready", flush_rating_buffer command then stores each ready
+segment in one transaction together with a RateFlush row named after the segment.
+The segment is deleted only after commit, so a crash in between replays it,
+and the RateFlush row makes the replay a no-op.
+"""
+import atexit
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import IntegrityError, transaction
+from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from cars.models import Car
+
+from .models import Rate, RateFlush
+from .utils import store_rates
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_SUFFIX = ".log"
+READY_SUFFIX = ".ready"
+# Segments which can't be stored are moved aside, so they don't block the ones behind
+FAILED_SUFFIX = ".failed"
+# Extra seconds after rotation period before a segment is considered abandoned
+# by a dead writer, covers clock differences and writers paused mid-append
+STALE_GRACE = 5
+
+
+class RatingSpool:
+    """
+    Append only segment files of one process, thread safe
+    """
+
+    def __init__(self, directory, fsync: bool, rotate_seconds: float) -> None:
+        self.directory = Path(directory)
+        self.fsync = fsync
+        self.rotate_seconds = rotate_seconds
+        self._lock = threading.Lock()
+        self._fd: Optional[int] = None
+        self._path: Optional[Path] = None
+        self._opened = 0.0
+        self._pid = os.getpid()
+
+    def _open(self) -> None:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        name = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex}"
+        self._path = self.directory / f"{name}{ACTIVE_SUFFIX}"
+        self._fd = os.open(self._path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        self._opened = time.time()
+        self._pid = os.getpid()
+
+    def _rotate(self) -> None:
+        if self._fd is None:
+            return
+        os.close(self._fd)
+        self._fd = None
+        try:
+            os.rename(self._path, self._path.with_suffix(READY_SUFFIX))
+        except FileNotFoundError:
+            # Already claimed by flush_rating_buffer as abandoned
+            pass
+
+    def append(self, car_id: int, rating: int, created_at: datetime) -> None:
+        line = json.dumps(
+            {"car": car_id, "rating": rating, "created_at": created_at.isoformat()}
+        )
+        with self._lock:
+            if self._fd is not None and self._pid != os.getpid():
+                # Forked worker must not share parent's segment
+                self._fd = None
+            expired = time.time() - self._opened > self.rotate_seconds
+            if self._fd is not None and expired:
+                self._rotate()
+            if self._fd is None:
+                self._open()
+            # Single write() of an O_APPEND file, lines of threads don't interleave
+            os.write(self._fd, (line + "\n").encode())
+            if self.fsync:
+                os.fsync(self._fd)
+
+    def close(self) -> None:
+        """
+        Hand current segment over to flush_rating_buffer right away
+        """
+        with self._lock:
+            if self._pid == os.getpid():
+                self._rotate()
+
+
+_spool = None
+_spool_lock = threading.Lock()
+
+
+def get_rating_spool() -> RatingSpool:
+    global _spool
+    if _spool is None:
+        with _spool_lock:
+            if _spool is None:
+                _spool = RatingSpool(
+                    settings.RATE_SPOOL_DIR,
+                    fsync=settings.RATE_SPOOL_FSYNC,
+                    rotate_seconds=settings.RATE_SPOOL_ROTATE_SECONDS,
+                )
+                atexit.register(_spool.close)
+    return _spool
+
+
+@receiver(setting_changed)
+def reset_rating_spool(setting, **kwargs):
+    global _spool
+    if setting.startswith("RATE_SPOOL_"):
+        if _spool is not None:
+            _spool.close()
+        _spool = None
+
+
+def buffer_rating(car_id: int, rating: int) -> None:
+    get_rating_spool().append(car_id, rating, timezone.now())
+
+
+def ready_segments(directory) -> List[Path]:
+    """
+    Segments ready to flush, oldest first. Active segments which weren't
+    rotated in time (their writer died) are claimed as ready as well.
+    """
+    directory = Path(directory)
+    if not directory.is_dir():
+        return []
+    stale_before = time.time() - settings.RATE_SPOOL_ROTATE_SECONDS - STALE_GRACE
+    for path in directory.glob(f"*{ACTIVE_SUFFIX}"):
+        try:
+            if path.stat().st_mtime < stale_before:
+                os.rename(path, path.with_suffix(READY_SUFFIX))
+        except FileNotFoundError:
+            pass
+    segments = []
+    for path in directory.glob(f"*{READY_SUFFIX}"):
+        try:
+            segments.append((path.stat().st_mtime, path))
+        except FileNotFoundError:
+            pass
+    return [path for _, path in sorted(segments)]
+
+
+def read_segment(path: Path) -> Tuple[List[Rate], int]:
+    """
+    Rates of a segment and number of unreadable lines (e.g. torn by a crash mid-write)
+    """
+    rates = []
+    skipped = 0
+    with open(path, encoding="utf-8") as file:
+        for line in file:
+            try:
+                item = json.loads(line)
+                created_at = parse_datetime(item["created_at"])
+                rates.append(
+                    Rate(
+                        car_id=int(item["car"]),
+                        rating=int(item["rating"]),
+                        created_at=created_at,
+                    )
+                )
+            except (ValueError, KeyError, TypeError):
+                skipped += 1
+    return rates, skipped
+
+
+def store_segment(path: Path) -> List[Rate]:
+    """
+    Store rates of existing cars from a segment together with its RateFlush row,
+    returns stored rates
+    """
+    rates, skipped = read_segment(path)
+    if skipped:
+        logger.warning("Skipped %d unreadable line(s) of %s", skipped, path.name)
+
+    car_ids = set(
+        Car.objects.filter(pk__in={rate.car_id for rate in rates}).values_list(
+            "pk", flat=True
+        )
+    )
+    stored = [
+        rate
+        for rate in rates
+        if rate.car_id in car_ids and rate.created_at and 1 <= rate.rating <= 5
+    ]
+    if len(stored) != len(rates):
+        logger.warning(
+            "Dropped %d rating(s) of deleted cars or out of range from %s",
+            len(rates) - len(stored),
+            path.name,
+        )
+
+    with transaction.atomic():
+        RateFlush.objects.create(batch_id=path.stem, rating_qty=len(stored))
+        if stored:
+            store_rates(stored)
+    return stored
+
+
+def flush_segment(path: Path) -> int:
+    """
+    Store ratings of one segment exactly once and delete it, returns number of stored rates
+    """
+    for attempt in range(2):
+        try:
+            stored = store_segment(path)
+            break
+        except FileNotFoundError:
+            # Flushed and deleted by another flusher meanwhile
+            return 0
+        except IntegrityError:
+            if RateFlush.objects.filter(batch_id=path.stem).exists():
+                # Flushed before, crashed (or raced another flusher) before deleting the file
+                logger.info("Segment %s was already flushed", path.name)
+                stored = []
+                break
+            if attempt:
+                logger.exception(
+                    "Segment %s can't be stored, moved aside as %s",
+                    path.name,
+                    path.with_suffix(FAILED_SUFFIX).name,
+                )
+                try:
+                    os.rename(path, path.with_suffix(FAILED_SUFFIX))
+                except FileNotFoundError:
+                    pass
+                return 0
+            # E.g. a car deleted after the lookup, retried with cars looked up again
+    try:
+        path.unlink()
+    except FileNotFoundError:
+        pass
+    return len(stored)
+
+
+def flush_rating_buffer() -> Tuple[int, int]:
+    """
+    Flush every ready segment, returns numbers of segments and stored rates
+    """
+    segments = ready_segments(settings.RATE_SPOOL_DIR)
+    stored = 0
+    for path in segments:
+        stored += flush_segment(path)
+    return len(segments), stored
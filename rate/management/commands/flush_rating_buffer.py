@@ -0,0 +1,52 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.utils import timezone
+
+from rate.buffer import flush_rating_buffer
+from rate.models import RateFlush
+
+
+class Command(BaseCommand):
+    help = (
+        "Store ratings buffered by write-behind POST /rate, replaying unflushed spool"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=1.0,
+            help="Seconds between flushes",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Flush ready segments once and exit",
+        )
+        parser.add_argument(
+            "--keep-days",
+            type=int,
+            default=7,
+            help="Days to remember flushed segments for, to ignore their replays",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            while True:
+                segments, stored = flush_rating_buffer()
+                if segments:
+                    self.stdout.write(
+                        f"Stored {stored} rating(s) from {segments} segment(s)"
+                    )
+                RateFlush.objects.filter(
+                    flushed_at__lt=timezone.now() - timedelta(days=options["keep_days"])
+                ).delete()
+                if options["once"]:
+                    break
+                time.sleep(options["interval"])
+                close_old_connections()
+        except KeyboardInterrupt:
+            pass
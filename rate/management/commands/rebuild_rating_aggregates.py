@@ -0,0 +1,146 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count, Max, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from cars.cache import invalidate_listings
+from cars.models import Car
+from rate.models import Rate, RateDailyStats
+
+AGGREGATE_FIELDS = [
+    "rating_qty",
+    "rating_sum",
+    "average_rate",
+    "stars_1",
+    "stars_2",
+    "stars_3",
+    "stars_4",
+    "stars_5",
+    "last_rated_at",
+]
+
+
+def compute_aggregates() -> dict:
+    """
+    Compute rating aggregates for every rated car straight from rate_rate
+    """
+    rows = Rate.objects.values("car").annotate(
+        rating_qty=Count("id"),
+        rating_sum=Sum("rating"),
+        last_rated_at=Max("created_at"),
+        **{f"stars_{star}": Count("id", filter=Q(rating=star)) for star in range(1, 6)},
+    )
+    aggregates = {}
+    for row in rows.order_by():
+        car_id = row.pop("car")
+        row["average_rate"] = row["rating_sum"] / row["rating_qty"]
+        aggregates[car_id] = row
+    return aggregates
+
+
+ROLLUP_FIELDS = ["rating_qty", "rating_sum"] + [f"stars_{star}" for star in range(1, 6)]
+
+
+def compute_daily_aggregates() -> dict:
+    """
+    Compute per car per day rollups straight from rate_rate, keyed by (car id, day)
+    """
+    rows = (
+        Rate.objects.annotate(day=TruncDate("created_at"))
+        .values("car", "day")
+        .annotate(
+            rating_qty=Count("id"),
+            rating_sum=Sum("rating"),
+            **{
+                f"stars_{star}": Count("id", filter=Q(rating=star))
+                for star in range(1, 6)
+            },
+        )
+    )
+    return {(row.pop("car"), row.pop("day")): row for row in rows.order_by()}
+
+
+def rebuild_daily_aggregates(batch_size: int, verify: bool) -> int:
+    """
+    Bring rollups in line with rates, returns number of stale (or missing/extra) rows
+    """
+    expected = compute_daily_aggregates()
+    stale = []
+    extra = []
+    for rollup in RateDailyStats.objects.select_for_update().iterator():
+        row = expected.pop((rollup.car_id, rollup.day), None)
+        if row is None:
+            extra.append(rollup.pk)
+        elif any(getattr(rollup, field) != row[field] for field in ROLLUP_FIELDS):
+            for field in ROLLUP_FIELDS:
+                setattr(rollup, field, row[field])
+            stale.append(rollup)
+    missing = [
+        RateDailyStats(car_id=car_id, day=day, **row)
+        for (car_id, day), row in expected.items()
+    ]
+    if not verify:
+        RateDailyStats.objects.filter(pk__in=extra).delete()
+        RateDailyStats.objects.bulk_update(stale, ROLLUP_FIELDS, batch_size=batch_size)
+        RateDailyStats.objects.bulk_create(missing, batch_size=batch_size)
+    return len(stale) + len(extra) + len(missing)
+
+
+class Command(BaseCommand):
+    help = "Rebuild (or verify) denormalized per-car rating aggregates and daily rollups from rates"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--verify",
+            action="store_true",
+            help="Only report cars whose stored aggregates differ, do not write",
+        )
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        empty = {field: 0 for field in AGGREGATE_FIELDS}
+        empty["last_rated_at"] = None
+        with transaction.atomic():
+            aggregates = compute_aggregates()
+            cars = Car.objects.select_for_update().only("id", *AGGREGATE_FIELDS)
+
+            stale = []
+            for car in cars.iterator():
+                expected = aggregates.get(car.id, empty)
+                if any(
+                    getattr(car, field) != expected[field] for field in AGGREGATE_FIELDS
+                ):
+                    for field in AGGREGATE_FIELDS:
+                        setattr(car, field, expected[field])
+                    stale.append(car)
+
+            stale_rollups = rebuild_daily_aggregates(
+                options["batch_size"], verify=options["verify"]
+            )
+
+            if options["verify"]:
+                for car in stale:
+                    self.stderr.write(f"Stale aggregates for car {car.id}")
+                if stale:
+                    raise CommandError(f"{len(stale)} car(s) have stale aggregates")
+                if stale_rollups:
+                    raise CommandError(f"{stale_rollups} daily rollup(s) are stale")
+                self.stdout.write(self.style.SUCCESS("All aggregates up to date"))
+                return
+
+            now = timezone.now()
+            for car in stale:
+                car.aggregated_at = now
+            Car.objects.bulk_update(
+                stale,
+                AGGREGATE_FIELDS + ["aggregated_at"],
+                batch_size=options["batch_size"],
+            )
+            invalidate_listings()
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Rebuilt aggregates for {len(stale)} car(s) "
+                f"and {stale_rollups} daily rollup(s)"
+            )
+        )
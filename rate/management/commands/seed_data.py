@@ -0,0 +1,64 @@
+import random
+from datetime import timedelta
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from cars.models import Car
+from rate.models import Rate
+
+
+class Command(BaseCommand):
+    help = "Seed database with made-up cars and ratings, e.g. for benchmarks"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--cars", type=int, default=1000)
+        parser.add_argument("--ratings", type=int, default=10000)
+        parser.add_argument(
+            "--days", type=int, default=30, help="Ratings are spread over last N days"
+        )
+        parser.add_argument("--batch-size", type=int, default=5000)
+        parser.add_argument(
+            "--seed", type=int, default=0, help="Random seed, same seed gives same data"
+        )
+
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+        batch_size = options["batch_size"]
+
+        first = Car.objects.count()
+        for start in range(first, first + options["cars"], batch_size):
+            stop = min(start + batch_size, first + options["cars"])
+            Car.objects.bulk_create(
+                [
+                    Car(make_name=f"Make {i % 500}", model_name=f"Model {i}")
+                    for i in range(start, stop)
+                ]
+            )
+
+        car_ids = list(Car.objects.values_list("id", flat=True))
+        now = timezone.now()
+        period = timedelta(days=options["days"]).total_seconds()
+        if car_ids:
+            for start in range(0, options["ratings"], batch_size):
+                size = min(batch_size, options["ratings"] - start)
+                # Skewed towards first cars, so /popular has clear leaders
+                Rate.objects.bulk_create(
+                    [
+                        Rate(
+                            car_id=car_ids[int(len(car_ids) * rng.random() ** 2)],
+                            rating=rng.randint(1, 5),
+                            created_at=now - timedelta(seconds=rng.random() * period),
+                        )
+                        for _ in range(size)
+                    ]
+                )
+
+        call_command("rebuild_rating_aggregates", stdout=self.stdout)
+        call_command("recompute_rankings", stdout=self.stdout)
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Seeded {options['cars']} car(s) and {options['ratings']} rating(s)"
+            )
+        )
@@ -0,0 +1,81 @@
+# Generated by Django 3.1.3 on 2026-10-18 16:37
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("cars", "0002_car_aggregates_catalogue_jobs_rankings"),
+        ("rate", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RateFlush",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("batch_id", models.CharField(max_length=255, unique=True)),
+                ("rating_qty", models.PositiveIntegerField(default=0)),
+                ("flushed_at", models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name="rate",
+            name="created_at",
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.CreateModel(
+            name="RateDailyStats",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("day", models.DateField()),
+                ("rating_qty", models.PositiveIntegerField(default=0)),
+                ("rating_sum", models.PositiveIntegerField(default=0)),
+                ("stars_1", models.PositiveIntegerField(default=0)),
+                ("stars_2", models.PositiveIntegerField(default=0)),
+                ("stars_3", models.PositiveIntegerField(default=0)),
+                ("stars_4", models.PositiveIntegerField(default=0)),
+                ("stars_5", models.PositiveIntegerField(default=0)),
+                (
+                    "car",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="daily_stats",
+                        to="cars.car",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name_plural": "rate daily stats",
+            },
+        ),
+        migrations.AddIndex(
+            model_name="ratedailystats",
+            index=models.Index(fields=["day"], name="ratedailystats_day_idx"),
+        ),
+        migrations.AddConstraint(
+            model_name="ratedailystats",
+            constraint=models.UniqueConstraint(
+                fields=("car", "day"), name="unique car day"
+            ),
+        ),
+    ]
@@ -1,5 +1,6 @@
 from django.core.validators import MaxValueValidator, MinValueValidator
 from django.db import models
+from django.utils import timezone
 
 from cars.models import Car
 
@@ -9,6 +10,50 @@ class Rate(models.Model):
     rating = models.IntegerField(
         validators=[MinValueValidator(1), MaxValueValidator(5)]
     )
+    created_at = models.DateTimeField(default=timezone.now)
 
     def __str__(self) -> str:
         return f"{self.car}: {self.rating} stars"
+
+
+class RateDailyStats(models.Model):
+    """
+    Per car per day (UTC) rollup of ratings, maintained by rate.utils.record_ratings,
+    so time windowed stats read one row per car and day instead of every rate
+    """
+
+    car = models.ForeignKey(Car, on_delete=models.CASCADE, related_name="daily_stats")
+    day = models.DateField()
+    rating_qty = models.PositiveIntegerField(default=0)
+    rating_sum = models.PositiveIntegerField(default=0)
+    stars_1 = models.PositiveIntegerField(default=0)
+    stars_2 = models.PositiveIntegerField(default=0)
+    stars_3 = models.PositiveIntegerField(default=0)
+    stars_4 = models.PositiveIntegerField(default=0)
+    stars_5 = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["car", "day"], name="unique car day")
+        ]
+        indexes = [
+            # Windowed GET /popular reads all cars of recent days
+            models.Index(fields=["day"], name="ratedailystats_day_idx"),
+        ]
+        verbose_name_plural = "rate daily stats"
+
+    def __str__(self) -> str:
+        return f"{self.car} on {self.day}: {self.rating_qty} rate(s)"
+
+
+class RateFlush(models.Model):
+    """
+    Spool segment already stored by flush_rating_buffer, makes replays after a crash no-ops
+    """
+
+    batch_id = models.CharField(max_length=255, unique=True)
+    rating_qty = models.PositiveIntegerField(default=0)
+    flushed_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self) -> str:
+        return f"{self.batch_id}: {self.rating_qty} rate(s)"
@@ -0,0 +1,34 @@
+import json
+
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+
+
+class NDJSONParser(BaseParser):
+    """
+    Parses newline delimited JSON lazily, one item per line, so request body
+    is never held in memory as a whole. Lines which are not valid JSON
+    (or not valid in request encoding) are yielded as ParseError instances
+    to be reported per item.
+    """
+
+    media_type = "application/x-ndjson"
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get("encoding", settings.DEFAULT_CHARSET)
+        return self._iter_lines(stream, encoding)
+
+    @staticmethod
+    def _iter_lines(stream, encoding):
+        # Decoded line by line, so an invalid byte spoils its line only
+        for line in stream:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                # UnicodeDecodeError is a ValueError too
+                yield json.loads(line.decode(encoding))
+            except ValueError as exc:
+                yield ParseError(f"JSON parse error - {exc}")
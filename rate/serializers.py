@@ -7,3 +7,14 @@ class RateSerializer(serializers.ModelSerializer):
     class Meta:
         model = Rate
         fields = ["id", "car", "rating"]
+
+
+class RateBatchItemSerializer(serializers.Serializer):
+    """
+    Validates single item of a batch without touching database,
+    existence of cars is checked for the whole chunk at once
+    """
+
+    # Car ids are AutoField, greater values would overflow database driver
+    car = serializers.IntegerField(min_value=1, max_value=2 ** 31 - 1)
+    rating = serializers.IntegerField(min_value=1, max_value=5)
@@ -0,0 +1,12 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from cars.cache import invalidate_listings
+
+from .models import Rate
+
+
+@receiver(post_save, sender=Rate)
+@receiver(post_delete, sender=Rate)
+def rate_changed(sender, **kwargs):
+    invalidate_listings()
@@ -1,11 +1,24 @@
+import json
+import os
+import tempfile
+from io import StringIO
+from pathlib import Path
+from unittest import mock
+
 from django.contrib.auth.models import User
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError
+from django.test import override_settings
 from django.urls import reverse
+from django.utils import timezone
 from rest_framework import status
 from rest_framework.test import APITestCase
 
 from cars.models import Car
 
-from .models import Rate
+from .buffer import get_rating_spool
+from .models import Rate, RateDailyStats, RateFlush
+from .utils import store_rates
 
 
 class RateAPITests(APITestCase):
@@ -31,6 +44,25 @@ class RateAPITests(APITestCase):
         self.assertEqual(Rate.objects.get().car, self.test_car)
         self.assertEqual(Rate.objects.get().rating, 5)
 
+    def test_rate_post_updates_aggregates(self):
+        """
+        Positive test case
+        Every added rating should be reflected in car's denormalized aggregates
+        """
+        for rating in (5, 4, 5):
+            data = {"car": self.test_car.id, "rating": rating}
+            response = self.client.post(self.url, data, format="json")
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        self.test_car.refresh_from_db()
+        self.assertEqual(self.test_car.rating_qty, 3)
+        self.assertEqual(self.test_car.rating_sum, 14)
+        self.assertAlmostEqual(self.test_car.average_rate, 14 / 3)
+        self.assertDictEqual({1: 0, 2: 0, 3: 0, 4: 1, 5: 2}, self.test_car.histogram)
+        rollup = RateDailyStats.objects.get(car=self.test_car)
+        self.assertEqual(rollup.day, timezone.now().date())
+        self.assertEqual((rollup.rating_qty, rollup.stars_4, rollup.stars_5), (3, 1, 2))
+
     def test_rate_post_invalid_car_id(self):
         """
         Negative test case
@@ -82,3 +114,278 @@ class RateAPITests(APITestCase):
         data = {"car": self.test_car.id, "rating": 5}
         response = self.client.post(self.url, data, format="json")
         self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class RebuildRatingAggregatesTests(APITestCase):
+    def setUp(self) -> None:
+        """
+        Auxiliary test objects and functions
+        """
+        self.test_car = Car.objects.create(make_name="test", model_name="car")
+        Rate.objects.create(car=self.test_car, rating=2)
+        Rate.objects.create(car=self.test_car, rating=3)
+
+    def test_verify_reports_stale_aggregates(self):
+        """
+        Negative test case
+        Rates inserted behind the API's back leave aggregates stale
+        """
+        with self.assertRaises(CommandError):
+            call_command("rebuild_rating_aggregates", verify=True, stderr=StringIO())
+
+    def test_rebuild_aggregates(self):
+        """
+        Positive test case
+        Rebuild recomputes aggregates from rates, after which verify passes
+        """
+        call_command("rebuild_rating_aggregates", stdout=StringIO())
+
+        self.test_car.refresh_from_db()
+        self.assertEqual(self.test_car.rating_qty, 2)
+        self.assertEqual(self.test_car.rating_sum, 5)
+        self.assertEqual(self.test_car.average_rate, 2.5)
+        self.assertEqual(self.test_car.stars_2, 1)
+        self.assertEqual(self.test_car.stars_3, 1)
+        rollup = RateDailyStats.objects.get(car=self.test_car)
+        self.assertEqual((rollup.rating_qty, rollup.rating_sum), (2, 5))
+
+        call_command("rebuild_rating_aggregates", verify=True, stdout=StringIO())
+
+
+class SeedDataTests(APITestCase):
+    def test_seed_data(self):
+        """
+        Positive test case
+        Seeded ratings are reflected in aggregates of seeded cars
+        """
+        call_command("seed_data", cars=20, ratings=300, stdout=StringIO())
+        self.assertEqual(Car.objects.count(), 20)
+        self.assertEqual(Rate.objects.count(), 300)
+        self.assertEqual(sum(Car.objects.values_list("rating_qty", flat=True)), 300)
+        call_command("rebuild_rating_aggregates", verify=True, stdout=StringIO())
+
+
+class RateBatchAPITests(APITestCase):
+    def setUp(self) -> None:
+        """
+        Auxiliary test objects and functions
+        """
+        self.test_car = Car.objects.create(make_name="test", model_name="car")
+        self.other_car = Car.objects.create(make_name="other", model_name="car")
+        self.url = reverse("rate-car")
+        test_user = User.objects.create_user(username="foo")  # Used for bearer auth
+        self.client.force_authenticate(user=test_user)
+
+    @override_settings(RATE_BATCH_CHUNK_SIZE=2)
+    def test_rate_post_batch(self):
+        """
+        Positive test case
+        Valid items of the array are stored, invalid ones reported by index
+        """
+        data = [
+            {"car": self.test_car.id, "rating": 5},
+            {"car": self.other_car.id, "rating": 1},
+            {"car": self.other_car.id + 1, "rating": 5},
+            {"car": self.test_car.id, "rating": 6},
+            {"car": 2 ** 70, "rating": 5},
+            {"car": self.test_car.id, "rating": 3},
+        ]
+        response = self.client.post(self.url, data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.json()["created"], 3)
+        self.assertEqual(
+            [error["index"] for error in response.json()["errors"]], [2, 3, 4]
+        )
+        self.assertEqual(Rate.objects.count(), 3)
+
+        self.test_car.refresh_from_db()
+        self.assertEqual(self.test_car.rating_qty, 2)
+        self.assertEqual(self.test_car.average_rate, 4)
+
+    def test_rate_post_ndjson_stream(self):
+        """
+        Positive test case
+        Ratings can be streamed as newline delimited JSON
+        """
+        body = "\n".join(
+            [
+                json.dumps({"car": self.test_car.id, "rating": 4}),
+                "not json",
+                json.dumps({"car": self.test_car.id, "rating": 2}),
+                "",
+            ]
+        )
+        response = self.client.post(self.url, body, content_type="application/x-ndjson")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.json()["created"], 2)
+        self.assertEqual(response.json()["errors"][0]["index"], 1)
+
+        self.test_car.refresh_from_db()
+        self.assertEqual(self.test_car.rating_qty, 2)
+        self.assertEqual(self.test_car.stars_4, 1)
+
+    def test_rate_post_ndjson_invalid_encoding(self):
+        """
+        Negative test case
+        Line which is not valid UTF-8 is reported as an invalid item
+        """
+        line = json.dumps({"car": self.test_car.id, "rating": 4}).encode()
+        body = b"\n".join([line, b'{"car": "\xff"}', line])
+        response = self.client.post(self.url, body, content_type="application/x-ndjson")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.json()["created"], 2)
+        self.assertEqual(response.json()["errors"][0]["index"], 1)
+
+    def test_rate_post_batch_all_invalid(self):
+        """
+        Negative test case
+        Batch without any valid item should result in 400_BAD_REQUEST
+        """
+        data = [{"car": self.test_car.id, "rating": 0}]
+        response = self.client.post(self.url, data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Rate.objects.count(), 0)
+
+    def test_rate_post_not_object_or_array(self):
+        """
+        Negative test case
+        JSON body which is neither object nor array should result in 400_BAD_REQUEST
+        """
+        for body in ("5", "null", '"5"'):
+            response = self.client.post(self.url, body, content_type="application/json")
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Rate.objects.count(), 0)
+
+
+class RateWriteBehindTests(APITestCase):
+    def setUp(self) -> None:
+        """
+        Auxiliary test objects and functions
+        """
+        self.test_car = Car.objects.create(make_name="test", model_name="car")
+        self.url = reverse("rate-car")
+        test_user = User.objects.create_user(username="foo")  # Used for bearer auth
+        self.client.force_authenticate(user=test_user)
+        spool_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(spool_dir.cleanup)
+        self.spool_dir = Path(spool_dir.name)
+        settings = override_settings(
+            RATE_WRITE_BEHIND=True,
+            RATE_SPOOL_DIR=spool_dir.name,
+            RATE_SPOOL_FSYNC=False,
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def flush(self):
+        get_rating_spool().close()
+        call_command("flush_rating_buffer", once=True, stdout=StringIO())
+
+    def test_rate_post_write_behind(self):
+        """
+        Positive test case
+        Ratings are accepted into the spool and stored with aggregates by the flusher
+        """
+        for rating in (5, 4, 5):
+            data = {"car": self.test_car.id, "rating": rating}
+            response = self.client.post(self.url, data, format="json")
+            self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertFalse(Rate.objects.exists())
+
+        self.flush()
+
+        self.assertEqual(Rate.objects.count(), 3)
+        self.test_car.refresh_from_db()
+        self.assertEqual(self.test_car.rating_qty, 3)
+        self.assertEqual(self.test_car.rating_sum, 14)
+        self.assertEqual(RateDailyStats.objects.get(car=self.test_car).rating_qty, 3)
+        self.assertEqual(RateFlush.objects.get().rating_qty, 3)
+        self.assertEqual(os.listdir(self.spool_dir), [])
+
+    def test_rate_post_write_behind_invalid(self):
+        """
+        Negative test case
+        Invalid ratings are rejected before reaching the spool
+        """
+        data = {"car": self.test_car.id + 1, "rating": 5}
+        response = self.client.post(self.url, data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(os.listdir(self.spool_dir), [])
+
+    def test_flush_replay(self):
+        """
+        Positive test case
+        Segment left behind after its commit is not stored twice,
+        abandoned active segment is recovered and its torn last line skipped
+        """
+        created_at = "2021-01-01T10:00:00+00:00"
+        line = json.dumps(
+            {"car": self.test_car.id, "rating": 5, "created_at": created_at}
+        )
+        (self.spool_dir / "flushed.ready").write_text(line + "\n")
+        RateFlush.objects.create(batch_id="flushed", rating_qty=1)
+        abandoned = self.spool_dir / "abandoned.log"
+        abandoned.write_text(line + "\n" + line[:10])
+        os.utime(abandoned, (0, 0))
+
+        with self.assertLogs("rate.buffer", "WARNING"):
+            self.flush()
+
+        rate = Rate.objects.get()
+        self.assertEqual(rate.created_at.year, 2021)
+        self.assertEqual(RateDailyStats.objects.get().day.isoformat(), "2021-01-01")
+        self.assertEqual(os.listdir(self.spool_dir), [])
+
+    def test_flush_deleted_car(self):
+        """
+        Negative test case
+        Ratings of a deleted car are dropped, segment failing to store anyway
+        is moved aside without blocking the ones behind it
+        """
+        deleted_car = Car.objects.create(make_name="deleted", model_name="car")
+        deleted_car_id = deleted_car.id
+        deleted_car.delete()
+        created_at = "2021-01-01T10:00:00+00:00"
+        lines = [
+            json.dumps({"car": car_id, "rating": 5, "created_at": created_at})
+            for car_id in (self.test_car.id, deleted_car_id)
+        ]
+        (self.spool_dir / "deleted.ready").write_text("\n".join(lines) + "\n")
+        with self.assertLogs("rate.buffer", "WARNING"):
+            self.flush()
+        self.assertEqual(Rate.objects.get().car, self.test_car)
+        self.assertEqual(os.listdir(self.spool_dir), [])
+
+        (self.spool_dir / "broken.ready").write_text(lines[0] + "\n")
+        os.utime(self.spool_dir / "broken.ready", (0, 0))
+        (self.spool_dir / "later.ready").write_text(lines[0] + "\n")
+
+        def fail_broken(rates):
+            if RateFlush.objects.filter(batch_id="broken").exists():
+                raise IntegrityError("FOREIGN KEY constraint failed")
+            store_rates(rates)
+
+        with mock.patch("rate.buffer.store_rates", side_effect=fail_broken):
+            with self.assertLogs("rate.buffer", "ERROR"):
+                self.flush()
+
+        self.assertEqual(Rate.objects.count(), 2)
+        self.assertEqual(os.listdir(self.spool_dir), ["broken.failed"])
+        self.assertFalse(RateFlush.objects.filter(batch_id="broken").exists())
+
+    @mock.patch("rate.buffer.socket.gethostname", return_value="h" * 64)
+    def test_flush_long_hostname(self, gethostname_mock):
+        """
+        Positive test case
+        Segment of a host with the longest possible name (64 characters) fits RateFlush.batch_id
+        """
+        data = {"car": self.test_car.id, "rating": 5}
+        self.client.post(self.url, data, format="json")
+
+        self.flush()
+
+        batch_id = RateFlush.objects.get().batch_id
+        self.assertTrue(batch_id.startswith("h" * 64))
+        self.assertLessEqual(
+            len(batch_id), RateFlush._meta.get_field("batch_id").max_length
+        )
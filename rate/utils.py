@@ -0,0 +1,195 @@
+import re
+from collections import Counter, defaultdict
+from datetime import date, datetime, timedelta
+from itertools import islice
+from typing import Iterable, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, FloatField, Sum, Value
+from django.db.models.functions import Cast, Coalesce, Greatest
+from django.utils import timezone
+
+from cars.cache import invalidate_listings
+from cars.models import Car
+from cars.ranking import update_car_score
+
+from .models import Rate, RateDailyStats
+from .serializers import RateBatchItemSerializer
+
+
+def record_ratings(
+    car_id: int, ratings: Iterable[int], rated_at: Optional[datetime] = None
+) -> None:
+    """
+    Apply new ratings, given (latest) time of which (now by default), to the
+    denormalized aggregates of a single car and to its rollup of that day.
+
+    Issues one UPDATE of the car, its ranking score and its rollup (plus INSERT
+    for the first rating of the day) regardless of the number of ratings, so it
+    should be called inside the same transaction which inserts the Rate rows.
+    """
+    counts = Counter(ratings)
+    if not counts:
+        return
+
+    rated_at = rated_at or timezone.now()
+    qty = sum(counts.values())
+    total = sum(star * n for star, n in counts.items())
+    updates = {
+        # Coalesce, as GREATEST of SQLite is NULL when any argument is
+        "last_rated_at": Greatest(
+            Coalesce(F("last_rated_at"), Value(rated_at)), Value(rated_at)
+        ),
+        "rating_qty": F("rating_qty") + qty,
+        "rating_sum": F("rating_sum") + total,
+        "aggregated_at": timezone.now(),
+        # Right hand side expressions see the values from before the update
+        "average_rate": Cast(F("rating_sum") + total, FloatField())
+        / (F("rating_qty") + qty),
+    }
+    for star, n in counts.items():
+        updates[f"stars_{star}"] = F(f"stars_{star}") + n
+
+    Car.objects.filter(pk=car_id).update(**updates)
+    update_car_score(car_id)
+    record_daily_ratings(car_id, rated_at.date(), counts)
+
+
+def record_daily_ratings(car_id: int, day: date, counts: Counter) -> None:
+    qty = sum(counts.values())
+    total = sum(star * n for star, n in counts.items())
+    updates = {
+        "rating_qty": F("rating_qty") + qty,
+        "rating_sum": F("rating_sum") + total,
+    }
+    for star, n in counts.items():
+        updates[f"stars_{star}"] = F(f"stars_{star}") + n
+
+    rollup = RateDailyStats.objects.filter(car_id=car_id, day=day)
+    if rollup.update(**updates):
+        return
+    try:
+        # Savepoint, so losing the race for the first rating of the day doesn't
+        # break the surrounding transaction
+        with transaction.atomic():
+            RateDailyStats.objects.create(
+                car_id=car_id,
+                day=day,
+                rating_qty=qty,
+                rating_sum=total,
+                **{f"stars_{star}": n for star, n in counts.items()},
+            )
+    except IntegrityError:
+        rollup.update(**updates)
+
+
+def store_rates(rates: List[Rate]) -> None:
+    """
+    Insert rates of existing cars with one bulk INSERT and apply them to aggregates
+    and rollups once per car and day. Should be called inside a transaction.
+    """
+    per_car_day = defaultdict(list)
+    for rate in rates:
+        per_car_day[rate.car_id, rate.created_at.date()].append(rate)
+    Rate.objects.bulk_create(rates)
+    # Fixed order of row locks keeps concurrent batches from deadlocking
+    for car_id, day in sorted(per_car_day):
+        day_rates = per_car_day[car_id, day]
+        record_ratings(
+            car_id,
+            [rate.rating for rate in day_rates],
+            rated_at=max(rate.created_at for rate in day_rates),
+        )
+    invalidate_listings()
+
+
+def ingest_ratings(items: Iterable, chunk_size: int) -> Tuple[int, List[dict]]:
+    """
+    Validate and store ratings in chunks: one IN query for cars, one bulk INSERT
+    and one aggregate UPDATE per rated car per chunk. Each chunk is stored in its
+    own transaction, so a long stream doesn't hold row locks until its end and
+    chunks stored before a failure stay stored.
+
+    Returns number of created ratings and list of per-item errors.
+    """
+    created = 0
+    errors = []
+    numbered = enumerate(items)
+    while True:
+        chunk = list(islice(numbered, chunk_size))
+        if not chunk:
+            break
+
+        valid = []
+        for index, item in chunk:
+            if isinstance(item, Exception):
+                errors.append({"index": index, "error": f"{item}"})
+                continue
+            serializer = RateBatchItemSerializer(
+                data=item if isinstance(item, dict) else {}
+            )
+            if not serializer.is_valid():
+                errors.append({"index": index, "error": serializer.errors})
+                continue
+            valid.append((index, serializer.validated_data))
+
+        if not valid:
+            continue
+
+        requested_ids = {data["car"] for _, data in valid}
+        car_ids = set(
+            Car.objects.filter(pk__in=requested_ids).values_list("pk", flat=True)
+        )
+        rates = []
+        for index, data in valid:
+            if data["car"] not in car_ids:
+                errors.append(
+                    {"index": index, "error": f"Car {data['car']} does not exist"}
+                )
+                continue
+            rates.append(Rate(car_id=data["car"], rating=data["rating"]))
+
+        if not rates:
+            continue
+
+        with transaction.atomic():
+            store_rates(rates)
+        created += len(rates)
+
+    errors.sort(key=lambda error: error["index"])
+    return created, errors
+
+
+WINDOW_RE = re.compile(r"^(\d+)d$")
+
+
+def window_start(window: str) -> date:
+    """
+    First day of a window like "7d" (today and 6 days before), ValueError when invalid
+    """
+    match = WINDOW_RE.match(window)
+    days = int(match.group(1)) if match else 0
+    if not 1 <= days <= settings.RATE_STATS_MAX_WINDOW_DAYS:
+        raise ValueError(
+            f"window should be number of days from 1d to "
+            f"{settings.RATE_STATS_MAX_WINDOW_DAYS}d, e.g. 7d"
+        )
+    return timezone.now().date() - timedelta(days=days - 1)
+
+
+def window_stats(car_id: int, since: date) -> dict:
+    """
+    Rating count, average and star histogram of a car from its rollups since given day
+    """
+    totals = RateDailyStats.objects.filter(car_id=car_id, day__gte=since).aggregate(
+        rating_qty=Sum("rating_qty"),
+        rating_sum=Sum("rating_sum"),
+        **{f"stars_{star}": Sum(f"stars_{star}") for star in range(1, 6)},
+    )
+    qty = totals["rating_qty"] or 0
+    return {
+        "rating_qty": qty,
+        "average_rate": totals["rating_sum"] / qty if qty else 0,
+        "histogram": {star: totals[f"stars_{star}"] or 0 for star in range(1, 6)},
+    }
@@ -1,20 +1,48 @@
+from collections.abc import Iterator
+
+from django.conf import settings
+from django.db import transaction
 from rest_framework import status
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 from rest_framework.views import APIView
 
+from api_cars.db import pin_to_primary
+
+from .buffer import buffer_rating
+from .parsers import NDJSONParser
 from .serializers import RateSerializer
+from .utils import ingest_ratings, record_ratings
 
 
 class RateCarAPIView(APIView):
     permission_classes = (IsAuthenticated,)
+    parser_classes = api_settings.DEFAULT_PARSER_CLASSES + [NDJSONParser]
 
+    @pin_to_primary
     def post(self, request):
+        if isinstance(request.data, (list, Iterator)):
+            return self.post_batch(request)
+        if not isinstance(request.data, dict):
+            return Response(
+                data={"error": "Expected a rating object or an array of them"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
         serializer = RateSerializer(data=request.data)
         if serializer.is_valid():
             car = serializer.validated_data.get("car")
             rating = serializer.validated_data.get("rating")
-            serializer.save()
+            if settings.RATE_WRITE_BEHIND:
+                buffer_rating(car.pk, rating)
+                return Response(
+                    data={"result ": f"Accepted rating: {rating} for car: {car}"},
+                    status=status.HTTP_202_ACCEPTED,
+                )
+            with transaction.atomic():
+                rate = serializer.save()
+                record_ratings(car.pk, [rating], rated_at=rate.created_at)
             return Response(
                 data={"result ": f"Added rating: {rating} for car: {car}"},
                 status=status.HTTP_201_CREATED,
@@ -23,3 +51,16 @@ class RateCarAPIView(APIView):
             data={"error": f"{serializer.errors}"},
             status=status.HTTP_400_BAD_REQUEST,
         )
+
+    def post_batch(self, request):
+        """
+        Add many ratings from JSON array or NDJSON stream (iterator of parsed lines)
+        of {"car", "rating"} items
+        """
+        created, errors = ingest_ratings(
+            request.data, chunk_size=settings.RATE_BATCH_CHUNK_SIZE
+        )
+        return Response(
+            data={"created": created, "errors": errors},
+            status=status.HTTP_201_CREATED if created else status.HTTP_400_BAD_REQUEST,
+        )